@@ -0,0 +1,223 @@
+"""Run backtest_strategy for many tickers and strategies across a process pool"""
+
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from dataclasses import dataclass, field, replace
+from functools import lru_cache
+from typing import Any
+
+from threadpoolctl import threadpool_limits
+
+import feature_store
+import indicators
+import prep_data
+import strat_defs
+
+# Frames and settings shared with each worker once, when the worker starts
+_worker_state = {}
+
+
+@dataclass
+class BatchConfig:
+    """
+    Batch backtest configuration class
+    """
+    target: str = 'Adj Close'
+    s_date: str = "2015-07-01"
+    exclude_vars: tuple = ("Open","High","Low","Close","Adj Close","Volume")
+    initial_train_period: int = 2140
+    random_state: int = 42
+    drop_tickers: bool = True
+    indicator: prep_data.IndicatorConfig = field(default_factory=prep_data.IndicatorConfig)
+    feature_store: str = None # directory to reuse prep_data outputs from (None: always rebuild)
+    wide_cache: str = None # wide matrix cache directory to slice tickers from (None: pivot each)
+    indicator_engine: bool = False # compute the indicators of every ticker in one IndicatorEngine
+
+@dataclass
+class BacktestResult:
+    """
+    Result of one (ticker, strategy) backtest job
+    """
+    ticker: str
+    strategy: str
+    data: Any = None
+    model: Any = None
+    score: Any = None
+    seconds: float = 0.0
+    error: str = None
+
+
+def prepare_backtest_data(prepd_data, ticker, config: BatchConfig):
+    """
+    Filter prepd_data down to the rows and features used for backtesting.
+
+    Parameters:
+        prepd_data (DataFrame): Output of prep_data.prep_data.
+        ticker (str): Stock ticker
+        config (BatchConfig): Batch configuration.
+
+    Returns:
+        DataFrame: Data ready for backtest_strategy.
+    """
+    target_ticker = config.target+"_"+ticker
+
+    df_for_chart = prepd_data.loc[prepd_data['Date']>=config.s_date].reset_index(drop=True)
+    df_for_chart = df_for_chart.drop(columns=[
+        col for col in df_for_chart.columns
+        if col.startswith(config.exclude_vars) and col != target_ticker
+    ])
+    df_for_chart = df_for_chart.dropna(axis='columns') # drop columns with an na
+
+    return df_for_chart
+
+def _pool_context():
+    """
+    Start method of the worker processes: fork where the platform has it, so workers inherit
+    the frames without pickling (it is not the default on macOS, Windows or Python 3.14+), and
+    the platform default otherwise, which pickles the frames once per worker.
+    """
+    if 'fork' in multiprocessing.get_all_start_methods():
+        return multiprocessing.get_context('fork')
+    return multiprocessing.get_context()
+
+def build_engine(stocks_df, wiki_pageviews, tickers, config: BatchConfig, wide=None):
+    """
+    IndicatorEngine over the tickers (and SPY), with the indicators of config.indicator already
+    computed so forked workers share them.
+
+    Parameters:
+        tickers (list): Tickers to compute indicators for.
+        config (BatchConfig): Batch configuration.
+        wide (WideMatrix, optional): Wide matrix cache to take the prices from.
+
+    Returns:
+        IndicatorEngine: The engine.
+    """
+    tickers = sorted(set(tickers) | {'SPY'})
+    if wide is not None:
+        stocks_w = wide.frame([t for t in tickers if t in wide.tickers])
+    else:
+        stocks_w = prep_data.gen_stocks_w(None, stocks_df.loc[stocks_df['ticker'].isin(tickers)],
+                                          wiki_pageviews)
+
+    engine = indicators.IndicatorEngine.from_wide(stocks_w, config.target)
+    engine.compute(config.indicator)
+
+    return engine
+
+def _init_worker(frames, config, threads_per_worker, wide_snapshot=None, engine=None):
+    """
+    Store the shared frames and indicator engine in the worker, open the wide matrix cache and
+    cap the worker's BLAS/OpenMP thread pools.
+    """
+    _worker_state['frames'] = frames
+    _worker_state['engine'] = engine
+    _worker_state['wide'] = None
+    if wide_snapshot is not None:
+        _worker_state['wide'] = prep_data.load_wide_cache(wide_snapshot, config.wide_cache)
+    _worker_state['config'] = config
+    _worker_state['threads'] = threads_per_worker
+    _worker_state['limits'] = threadpool_limits(limits=threads_per_worker)
+
+@lru_cache(maxsize=2)
+def _prepared(ticker):
+    """
+    Build the backtest data for a ticker (cached so strategies on one ticker share it).
+    """
+    frames = _worker_state['frames']
+    config = _worker_state['config']
+
+    indicator_config = replace(config.indicator, ticker=ticker, target=config.target)
+    if config.feature_store is not None:
+        prepd_data = feature_store.get_features(frames, indicator_config,
+                                                drop_tickers=config.drop_tickers,
+                                                root=config.feature_store,
+                                                wide=_worker_state['wide'],
+                                                engine=_worker_state['engine'])
+    else:
+        prepd_data = prep_data.prep_data(*frames, config=indicator_config,
+                                         drop_tickers=config.drop_tickers,
+                                         wide=_worker_state['wide'],
+                                         engine=_worker_state['engine'])
+
+    return prepare_backtest_data(prepd_data, ticker, config)
+
+def _run_job(ticker, strategy, backtest_config):
+    """
+    Run one backtest inside a worker.
+    """
+    config = _worker_state['config']
+    start_time = time.time()
+    try:
+        data, model, score = strat_defs.backtest_strategy(
+            data=_prepared(ticker),
+            strategy=strategy,
+            target=config.target,
+            ticker=ticker,
+            config=backtest_config,
+            initial_train_period=config.initial_train_period,
+            random_state=config.random_state,
+            n_jobs=_worker_state['threads']
+        )
+    except Exception as e: # pylint: disable=broad-exception-caught
+        return BacktestResult(ticker, strategy, seconds=time.time()-start_time,
+                              error=f"{type(e).__name__}: {e}")
+
+    return BacktestResult(ticker, strategy, data, model, score, time.time()-start_time)
+
+def run_batch(jobs, stocks_df, wiki_pageviews, ffr, weather, gt_adjusted,
+              config: BatchConfig = None, max_workers=None):
+    """
+    Run (ticker, strategy, BacktestConfig) jobs across a process pool.
+
+    The loaded frames are handed to each worker once through the pool initializer, not pickled
+    per job. The pool uses the fork start method when it is available (see _pool_context), so
+    the workers inherit them without pickling at all. With config.wide_cache set, the wide
+    matrix cache of the frames is built (or found) once here and each worker opens it as a
+    memory map, instead of pivoting stocks_df for every ticker. With config.indicator_engine
+    set, the indicators of every ticker in jobs are computed here in one IndicatorEngine (see
+    build_engine) that the workers share. Each worker gets
+    cpu_count // max_workers threads for BLAS/OpenMP and as n_jobs for GridSearchCV/XGBoost so
+    nested parallelism does not oversubscribe the cores.
+
+    Parameters:
+        jobs (list): List of (ticker, strategy, BacktestConfig) tuples.
+        config (BatchConfig): Batch configuration.
+        max_workers (int, optional): Number of worker processes (default: cpu count).
+
+    Yields:
+        BacktestResult: One result per job, as soon as the job finishes.
+    """
+    if config is None:
+        config = BatchConfig()
+
+    cpu_count = os.cpu_count() or 1
+    max_workers = max_workers or cpu_count
+    threads_per_worker = max(1, cpu_count // max_workers)
+
+    # Group jobs by ticker so a worker is more likely to reuse its prepared data
+    jobs = sorted(jobs, key=lambda job: job[0])
+
+    # Build the wide matrix cache once, before any worker needs it
+    wide_snapshot, wide = None, None
+    if config.wide_cache is not None:
+        wide_snapshot = prep_data.wide_snapshot(stocks_df, wiki_pageviews)
+        wide = prep_data.get_wide_cache(stocks_df, wiki_pageviews, wide_snapshot,
+                                        config.wide_cache)
+
+    engine = None
+    if config.indicator_engine:
+        engine = build_engine(stocks_df, wiki_pageviews, [job[0] for job in jobs], config, wide)
+
+    frames = (stocks_df, wiki_pageviews, ffr, weather, gt_adjusted)
+    with ProcessPoolExecutor(max_workers=max_workers, mp_context=_pool_context(),
+                             initializer=_init_worker,
+                             initargs=(frames, config, threads_per_worker,
+                                       wide_snapshot, engine)) as executor:
+        futures = [executor.submit(_run_job, ticker, strategy, backtest_config)
+                   for ticker, strategy, backtest_config in jobs]
+
+        for future in as_completed(futures):
+            yield future.result()
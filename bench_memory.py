@@ -0,0 +1,112 @@
+"""Peak memory (RSS) of prep_data and the rule based backtests over many tickers"""
+
+import argparse
+import json
+import resource
+import subprocess
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+import prep_data
+import strat_defs
+
+STRATEGIES = ['Hold', 'SMA', 'RSI', 'VWAP', 'Bollinger', 'Breakout']
+
+
+def synthetic_data(n_tickers, n_days=2500, seed=0) -> tuple:
+    """
+    Random walk prices, volumes and page views for n_tickers tickers (SPY first), in the layout
+    of prep_data.load_data (float64 and string tickers, as loaded from the store).
+    """
+    rng = np.random.default_rng(seed)
+    dates = pd.bdate_range('2015-01-01', periods=n_days)
+    tickers = ['SPY'] + [f'T{i:03d}' for i in range(n_tickers - 1)]
+
+    prices = 100 * np.exp(np.cumsum(rng.normal(0, 0.01, (n_days, n_tickers)), axis=0))
+    stocks_df = pd.DataFrame({
+        'Date': np.tile(dates, n_tickers),
+        'ticker': np.repeat(tickers, n_days),
+        'Open': prices.T.ravel(),
+        'High': prices.T.ravel() * 1.01,
+        'Low': prices.T.ravel() * 0.99,
+        'Close': prices.T.ravel(),
+        'Adj Close': prices.T.ravel(),
+        'Volume': rng.integers(10**5, 10**8, n_days * n_tickers).astype(float),
+    })
+    wiki_pageviews = stocks_df[['Date', 'ticker']].assign(
+        views=rng.integers(0, 10**4, len(stocks_df)).astype(float)
+    )
+
+    days = pd.date_range(dates[0], dates[-1])
+    ffr = pd.DataFrame({'Date': days, 'federal_funds_rate': 2.0})
+    weather = pd.DataFrame({'date': days, 'high_temp_nyc': 20.0, 'low_temp_nyc': 10.0,
+                            'precipitation_PRCP_nyc': 0.0, 'precipitation_SNOW_nyc': 0.0})
+    gt_adjusted = pd.DataFrame({'date': days, 'search_term': 'stocks', 'index': 50.0})
+
+    return stocks_df, wiki_pageviews, ffr, weather, gt_adjusted
+
+def run(compact, n_tickers, synthetic, drop_tickers) -> dict:
+    """
+    Prepare every ticker and run the rule based strategies on it, keeping the results (as a
+    notebook run does). Returns the peak RSS of this process.
+    """
+    began = time.perf_counter()
+    if synthetic:
+        frames = synthetic_data(n_tickers)
+        if compact:
+            frames = (prep_data.compact_dtypes(frames[0]), prep_data.compact_dtypes(frames[1]),
+                      *frames[2:])
+    else:
+        frames = prep_data.load_data(compact=compact)
+    stocks_df = frames[0]
+
+    tickers = [t for t in stocks_df['ticker'].unique() if t != 'SPY'][:n_tickers - 1]
+    results = {}
+    for ticker in tickers:
+        config = prep_data.IndicatorConfig(ticker=ticker)
+        prepd_data = prep_data.prep_data(*frames, config=config, drop_tickers=drop_tickers)
+        for strategy in STRATEGIES:
+            data, _, _ = strat_defs.backtest_strategy(prepd_data, strategy, config.target, ticker,
+                                                      strat_defs.BacktestConfig())
+            results[ticker, strategy] = data[['Date', 'Signal', 'Strategy_Return']]
+
+    return {
+        'compact': compact,
+        'tickers': len(tickers) + 1,
+        'stocks_df_mb': stocks_df.memory_usage(deep=True).sum() / 2**20,
+        'peak_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 2**10,
+        'seconds': time.perf_counter() - began,
+    }
+
+def main():
+    """
+    Measure the default and the compact mode, each in a fresh process (peak RSS can not go down
+    within a process).
+    """
+    parser = argparse.ArgumentParser(description='Peak memory of a full backtest run.')
+    parser.add_argument('--tickers', type=int, default=500, help='Number of tickers (with SPY)')
+    parser.add_argument('--synthetic', action='store_true',
+                        help='Use random data instead of the data store')
+    parser.add_argument('--wide', action='store_true',
+                        help='Keep every ticker in the wide frames (drop_tickers=False)')
+    parser.add_argument('--mode', choices=['default', 'compact'], help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.mode is not None:
+        print(json.dumps(run(args.mode == 'compact', args.tickers, args.synthetic,
+                             not args.wide)))
+        return
+
+    for mode in ['default', 'compact']:
+        command = [sys.executable, __file__, '--mode', mode, '--tickers', str(args.tickers)]
+        command += ['--synthetic'] * args.synthetic + ['--wide'] * args.wide
+        output = subprocess.run(command, check=True, capture_output=True, text=True).stdout
+        result = json.loads(output.strip().splitlines()[-1])
+        print(f"{mode:8s} {result['tickers']} tickers: stocks_df {result['stocks_df_mb']:.0f} MB,"
+              f" peak RSS {result['peak_rss_mb']:.0f} MB, {result['seconds']:.1f}s")
+
+if __name__ == "__main__":
+    main()
@@ -1,21 +1,148 @@
 """Create an interactive plot in a browser window"""
 
-import glob
-import os
+from functools import lru_cache
 
+import numpy as np
 import pandas as pd
 import plotly.graph_objects as go
 from plotly.subplots import make_subplots
 from dash import Dash, html, dcc, Output, Input
 
-import prep_data # custom functions
+import indicators # custom functions
+import prep_data
+
+INDICATOR_CACHE_SIZE = 256 # (ticker, indicator, window) series kept in memory
+MAX_POINTS = 2000 # points per trace in the WebGL mode (for the whole history and the zoom window)
 
 app = Dash()
 
-# Load data
-stocks_df_files = glob.glob('stocks_df_*.csv')
-stocks_df_latest = max(stocks_df_files, key=os.path.getctime)
-stocks_df = pd.read_csv(stocks_df_latest, parse_dates=['Date'])
+# Load data (only the columns the chart uses), sorted so the rows of each ticker are one slice
+stocks_df = prep_data.load_dataset('stocks_df', 'stocks_df', 'Date',
+                                   columns=['Date', 'ticker', 'Adj Close'])
+stocks_df = stocks_df.sort_values(['ticker', 'Date'], ignore_index=True)
+
+
+def build_ticker_index(df) -> dict:
+    """
+    Rows of each ticker of a DataFrame sorted by ticker, as {ticker: slice}.
+    """
+    tickers = df['ticker'].to_numpy()
+    starts = np.flatnonzero(np.concatenate([[True], tickers[1:] != tickers[:-1]]))
+    stops = np.append(starts[1:], len(tickers))
+    return {str(tickers[start]): slice(start, stop) for start, stop in zip(starts, stops)}
+
+ticker_index = build_ticker_index(stocks_df)
+
+def ticker_rows(ticker) -> slice:
+    """
+    Rows of a ticker in stocks_df (an empty slice for an unknown ticker).
+    """
+    return ticker_index.get(ticker, slice(0, 0))
+
+@lru_cache(maxsize=INDICATOR_CACHE_SIZE)
+def indicator_series(ticker, indicator, window):
+    """
+    Indicator of a ticker's Adj Close, cached by (ticker, indicator, window), so a callback only
+    computes the series whose inputs changed.
+
+    Parameters:
+        ticker (str): Stock ticker.
+        indicator (str): 'sma' (moving average), 'std' (rolling standard deviation) or 'rsi'.
+        window (int): Window.
+
+    Returns:
+        ndarray: One value per row of the ticker (read-only, it is shared by later callbacks).
+    """
+    engine = indicators.IndicatorEngine(stocks_df['Adj Close'].to_numpy()[ticker_rows(ticker)])
+    if indicator == 'sma':
+        values = engine.rolling_mean(window)[:, 0]
+    elif indicator == 'std':
+        values = engine.rolling_std(window)[:, 0]
+    elif indicator == 'rsi':
+        values = engine.rsi(window)[:, 0]
+    else:
+        raise ValueError(f"Indicator '{indicator}' is not implemented.")
+
+    values.setflags(write=False)
+    return values
+
+def downsample_rows(values, max_points) -> np.ndarray:
+    """
+    Rows to plot so a series keeps its shape with about max_points points (min/max bucketing):
+    the first and last rows, and the rows of the lowest and highest value in each of
+    max_points // 2 equal buckets of rows. Spikes survive, unlike with every n-th row.
+
+    Parameters:
+        values (ndarray): Series.
+        max_points (int): Most points to keep.
+
+    Returns:
+        ndarray: Sorted row positions.
+    """
+    n = len(values)
+    if n <= max_points:
+        return np.arange(n)
+
+    n_buckets = max_points // 2
+    size = -(-n // n_buckets)
+    padded = np.full(n_buckets * size, np.nan)
+    padded[:n] = values
+    buckets = padded.reshape(n_buckets, size)
+
+    valid = ~np.isnan(buckets)
+    lows = np.where(valid, buckets, np.inf).argmin(axis=1)
+    highs = np.where(valid, buckets, -np.inf).argmax(axis=1)
+    offsets = np.arange(n_buckets) * size
+    keep = valid.any(axis=1)
+
+    return np.union1d(np.concatenate([(offsets + lows)[keep], (offsets + highs)[keep]]),
+                      [0, n - 1])
+
+def visible_range(relayout_data):
+    """
+    x range the chart is zoomed or panned to, from its relayoutData (None for the whole
+    history). Either subplot's axis counts, they are shared.
+    """
+    for key, value in (relayout_data or {}).items():
+        if not key.startswith('xaxis'):
+            continue
+        if key.endswith('.range'):
+            return pd.Timestamp(value[0]), pd.Timestamp(value[1])
+        if key.endswith('.range[0]'):
+            return (pd.Timestamp(value),
+                    pd.Timestamp(relayout_data[key.replace('range[0]', 'range[1]')]))
+    return None
+
+def plot_rows(values, window_rows, max_points) -> np.ndarray:
+    """
+    Rows of a series to plot: the whole history downsampled to max_points, and the rows of the
+    zoom window at full resolution (downsampled to max_points too if it has more rows).
+
+    Parameters:
+        values (ndarray): Series.
+        window_rows (tuple): (start, stop) rows of the zoom window, or None.
+        max_points (int): Most points for the history and for the window.
+    """
+    rows = downsample_rows(values, max_points)
+    if window_rows is not None:
+        start, stop = window_rows
+        rows = np.union1d(rows, start + downsample_rows(values[start:stop], max_points))
+    return rows
+
+@app.server.route('/cache-stats')
+def cache_stats():
+    """
+    Indicator cache statistics (JSON), for monitoring.
+    """
+    info = indicator_series.cache_info()
+    lookups = info.hits + info.misses
+    return {
+        'hits': info.hits,
+        'misses': info.misses,
+        'hit_rate': info.hits / lookups if lookups else None,
+        'size': info.currsize,
+        'maxsize': info.maxsize,
+    }
 
 
 # App layout
@@ -68,6 +195,14 @@ app.layout = html.Div(
             type='number',
             value=2
         ),
+        html.Label(" Rendering"),
+        dcc.RadioItems(
+            id='render-input',
+            options=[{'label': 'Fast (WebGL, downsampled)', 'value': 'webgl'},
+                     {'label': 'Full (SVG)', 'value': 'svg'}],
+            value='webgl',
+            inline=True
+        ),
         dcc.Graph(
             id='my_fig',
             style={'height': '100%'}
@@ -85,50 +220,78 @@ app.layout = html.Div(
      Input('overbought-input', 'value'),
      Input('rsi_window-input', 'value'),
      Input('bma-input', 'value'),
-     Input('bstd-input', 'value')]
+     Input('bstd-input', 'value'),
+     Input('render-input', 'value'),
+     Input('my_fig', 'relayoutData')]
 )
 
 def update_graph(ticker, short_window, long_window, oversold, overbought, rsi_window, 
-                 bollinger_window, bollinger_num_std):
+                 bollinger_window, bollinger_num_std, render='svg', relayout_data=None):
     """
     Update graph
+
+    In the 'webgl' rendering mode the traces are Scattergl, and each one sends the whole
+    history downsampled (downsample_rows) plus the rows of the zoomed window at full resolution.
+    Zooming or panning changes relayoutData, which calls this again for the new window.
     """
-    chart_df = stocks_df.loc[stocks_df['ticker']==ticker].reset_index(drop=True)
+    chart_df = stocks_df.iloc[ticker_rows(ticker)].reset_index(drop=True)
+
+    # Daily prices with moving averages and RSI (cached, so only changed windows are computed)
+    chart_df['SMA_Short'] = indicator_series(ticker, 'sma', short_window)
+    chart_df['SMA_Long'] = indicator_series(ticker, 'sma', long_window)
+    chart_df['RSI'] = indicator_series(ticker, 'rsi', rsi_window)
 
-    # Daily prices with moving averages and RSI
-    chart_df['SMA_Short'] = chart_df['Adj Close'].rolling(window=short_window).mean()
-    chart_df['SMA_Long'] = chart_df['Adj Close'].rolling(window=long_window).mean()
-    chart_df['RSI'] = prep_data.calculate_rsi_long(chart_df, 'Adj Close', window=rsi_window)
+    ma_b = indicator_series(ticker, 'sma', bollinger_window)
+    std_b = indicator_series(ticker, 'std', bollinger_window)
+    chart_df['MA_B'] = ma_b
+    chart_df['Bollinger_Upper'] = ma_b + bollinger_num_std * std_b
+    chart_df['Bollinger_Lower'] = ma_b - bollinger_num_std * std_b
 
-    chart_df['MA_B'] = chart_df['Adj Close'].rolling(window=bollinger_window).mean()
-    chart_df['Bollinger_Upper'] = (chart_df['MA_B'] +
-                                   bollinger_num_std *
-                                   chart_df['Adj Close'].rolling(window=bollinger_window).std())
-    chart_df['Bollinger_Lower'] = (chart_df['MA_B'] -
-                                   bollinger_num_std *
-                                   chart_df['Adj Close'].rolling(window=bollinger_window).std())
+    dates = chart_df['Date'].to_numpy()
+    scatter = go.Scattergl if render == 'webgl' else go.Scatter
+
+    window_rows = None
+    visible = visible_range(relayout_data)
+    if visible is not None:
+        window_rows = tuple(np.searchsorted(dates, [np.datetime64(visible[0]),
+                                                    np.datetime64(visible[1])]))
+
+    def xy(*cols):
+        """
+        x and y of each column, on the rows to plot (shared by the columns, so filled bands
+        line up).
+        """
+        series = [chart_df[col].to_numpy() for col in cols]
+        if render != 'webgl':
+            return [{'x': dates, 'y': values} for values in series]
+        rows = plot_rows(series[0], window_rows, MAX_POINTS)
+        for values in series[1:]:
+            rows = np.union1d(rows, plot_rows(values, window_rows, MAX_POINTS))
+        return [{'x': dates[rows], 'y': values[rows]} for values in series]
+
+    upper, lower = xy('Bollinger_Upper', 'Bollinger_Lower')
 
     fig_sub = make_subplots(rows=2, cols=1,
                             shared_xaxes=True, vertical_spacing=0.02, row_heights=[0.7,0.3])
 
-    fig_sub.add_trace(go.Scatter(x=chart_df['Date'], y=chart_df['Bollinger_Upper'],mode='lines',
-                                 line_color='rgba(177, 208, 252, 0.9)',
-                                 name='Bollinger Upper'), row=1, col=1)
-    fig_sub.add_trace(go.Scatter(x=chart_df['Date'], y=chart_df['Bollinger_Lower'],mode='lines',
-                                 line_color='rgba(177, 208, 252, 0.9)', fill='tonexty',
-                                 name='Bollinger Lower'), row=1, col=1)
-    fig_sub.add_trace(go.Scatter(x=chart_df['Date'], y=chart_df['MA_B'],mode='lines',
-                                 line_color='rgba(177, 208, 252, 0.9)',
-                                 name='Bollinger moving average'), row=1, col=1)
-
-    fig_sub.add_trace(go.Scatter(x=chart_df['Date'], y=chart_df['Adj Close'],mode='lines',
-                                 name=f'{ticker} Adj Close'), row=1, col=1)
-    fig_sub.add_trace(go.Scatter(x=chart_df['Date'], y=chart_df['SMA_Short'],mode='lines',
-                                 name=f'SMA {short_window}'), row=1, col=1)
-    fig_sub.add_trace(go.Scatter(x=chart_df['Date'], y=chart_df['SMA_Long'],mode='lines',
-                                 name=f'SMA {long_window}'), row=1, col=1)
-
-    fig_sub.add_trace(go.Scatter(x=chart_df['Date'], y=chart_df['RSI'],mode='lines',name='RSI'),
+    fig_sub.add_trace(scatter(**upper, mode='lines',
+                              line_color='rgba(177, 208, 252, 0.9)',
+                              name='Bollinger Upper'), row=1, col=1)
+    fig_sub.add_trace(scatter(**lower, mode='lines',
+                              line_color='rgba(177, 208, 252, 0.9)', fill='tonexty',
+                              name='Bollinger Lower'), row=1, col=1)
+    fig_sub.add_trace(scatter(**xy('MA_B')[0], mode='lines',
+                              line_color='rgba(177, 208, 252, 0.9)',
+                              name='Bollinger moving average'), row=1, col=1)
+
+    fig_sub.add_trace(scatter(**xy('Adj Close')[0], mode='lines',
+                              name=f'{ticker} Adj Close'), row=1, col=1)
+    fig_sub.add_trace(scatter(**xy('SMA_Short')[0], mode='lines',
+                              name=f'SMA {short_window}'), row=1, col=1)
+    fig_sub.add_trace(scatter(**xy('SMA_Long')[0], mode='lines',
+                              name=f'SMA {long_window}'), row=1, col=1)
+
+    fig_sub.add_trace(scatter(**xy('RSI')[0], mode='lines', name='RSI'),
                       row=2, col=1)
     fig_sub.add_hline(y=oversold,line_dash="dash", line_color="green",
                       label={'text':f'Oversold ({oversold})','textposition':"end"},
@@ -138,7 +301,8 @@ def update_graph(ticker, short_window, long_window, oversold, overbought, rsi_wi
                       row=2, col=1)
 
     fig_sub.update_layout(title=f'Daily {ticker} Adj Close',
-                          legend={'yanchor':"top",'y': 0.98,'xanchor':"left",'x':0.01})
+                          legend={'yanchor':"top",'y': 0.98,'xanchor':"left",'x':0.01},
+                          uirevision=ticker) # keep the zoom when only the data changes
 
     return fig_sub
 
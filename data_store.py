@@ -0,0 +1,312 @@
+"""Versioned columnar (Parquet) store for the downloaded data"""
+
+import hashlib
+import json
+import os
+import shutil
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+
+STORE_DIR = 'data_store'
+MANIFEST = '_manifest.json'
+# Partition value of rows with a missing ticker or date (they are kept, not dropped)
+NULL_PARTITION = '__null__'
+
+# Date column of each dataset - datasets with a date column are partitioned by year, datasets
+# with a ticker column are also partitioned by ticker
+DATE_COLUMNS = {
+    'sp_df': None,
+    'stocks_df': 'Date',
+    'wiki_pageviews': 'Date',
+    'os_df_days': 'date',
+    'ffr': 'Date',
+    'weather_df': 'date',
+    'gt_monthly': 'start_date',
+    'gt_weekly': 'start_date',
+    'gt_daily': 'date',
+    'gt_adjusted': 'date',
+}
+
+
+def new_version() -> str:
+    """
+    Version string for a write made now (sorts in time order).
+
+    Versions have microsecond resolution, so a delta written in the same second as its parent
+    gets a version of its own. Versions written with one-second resolution are prefixes of the
+    versions made later in the same second, so they still sort before them.
+    """
+    return datetime.now().strftime("%Y%m%d%H%M%S%f")
+
+def list_versions(name, root=STORE_DIR) -> list:
+    """
+    List the complete versions of a dataset, oldest first.
+
+    Parameters:
+        name (str): Dataset name (e.g. 'stocks_df').
+        root (str): Store directory.
+
+    Returns:
+        list: Version strings.
+    """
+    dataset_dir = os.path.join(root, name)
+    if not os.path.isdir(dataset_dir):
+        return []
+
+    return sorted(
+        v for v in os.listdir(dataset_dir)
+        if os.path.isfile(os.path.join(dataset_dir, v, MANIFEST))
+    )
+
+def dataset_version(name, root=STORE_DIR):
+    """
+    Latest version of a dataset, or None if the dataset is not in the store.
+    """
+    versions = list_versions(name, root)
+    return versions[-1] if versions else None
+
+def read_manifest(name, version, root=STORE_DIR) -> dict:
+    """
+    Read the manifest of one version of a dataset.
+    """
+    with open(os.path.join(root, name, version, MANIFEST), "r", encoding="utf-8") as f:
+        return json.load(f)
+
+def _partition_path(keys, values) -> str:
+    """
+    Hive style partition path, e.g. ticker=SPY/year=2024
+    """
+    return '/'.join(f"{key}={value}" for key, value in zip(keys, values))
+
+def _parse_partition(path) -> dict:
+    """
+    Parse a hive style partition path back to a dict.
+    """
+    parts = [p.split('=', 1) for p in path.split('/') if '=' in p]
+    return dict(parts)
+
+def write_dataset(name, df, version=None, parent=None, root=STORE_DIR) -> str:
+    """
+    Write a DataFrame to the store as a new version, partitioned by ticker and year. Rows with
+    a missing ticker or date go to the NULL_PARTITION partition of that key.
+
+    A version with a parent only holds the partitions it replaces, the rest are read from the
+    parent version. The version directory is written under a temporary name and renamed once
+    complete, so readers never see a partial version.
+
+    Parameters:
+        name (str): Dataset name (e.g. 'stocks_df').
+        df (DataFrame): Data to write.
+        version (str, optional): Version string (default: new_version()).
+        parent (str, optional): Version this one is layered on top of.
+        root (str): Store directory.
+
+    Returns:
+        str: The version written.
+    """
+    version = version or new_version()
+    if version == parent:
+        raise ValueError(f"Version {version} of '{name}' can not be its own parent.")
+    date_col = DATE_COLUMNS.get(name)
+
+    version_dir = os.path.join(root, name, version)
+    tmp_dir = version_dir + '.tmp'
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    os.makedirs(tmp_dir)
+
+    keys = []
+    groupers = []
+    if 'ticker' in df.columns:
+        keys.append('ticker')
+        groupers.append(np.where(df['ticker'].notna(), df['ticker'].astype(str), NULL_PARTITION))
+    if date_col is not None:
+        keys.append('year')
+        dates = df[date_col]
+        groupers.append(np.where(dates.notna(), dates.dt.year.fillna(0).astype(int).astype(str),
+                                 NULL_PARTITION))
+
+    partitions = []
+    if keys:
+        for values, part in df.groupby(groupers, sort=True, dropna=False):
+            values = values if isinstance(values, tuple) else (values,)
+            partition = _partition_path(keys, values)
+            os.makedirs(os.path.join(tmp_dir, partition))
+            pq.write_table(pa.Table.from_pandas(part, preserve_index=False),
+                           os.path.join(tmp_dir, partition, 'part-0.parquet'))
+            partitions.append(partition)
+    else:
+        pq.write_table(pa.Table.from_pandas(df, preserve_index=False),
+                       os.path.join(tmp_dir, 'part-0.parquet'))
+        partitions.append('')
+
+    manifest = {
+        'name': name,
+        'version': version,
+        'parent': parent,
+        'created': datetime.now().isoformat(),
+        'rows': len(df),
+        'columns': list(df.columns),
+        'partitions': partitions,
+    }
+    with open(os.path.join(tmp_dir, MANIFEST), "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=1)
+
+    shutil.rmtree(version_dir, ignore_errors=True)
+    os.replace(tmp_dir, version_dir)
+
+    return version
+
+def write_delta(name, df, keys, version=None, root=STORE_DIR) -> str:
+    """
+    Write changed rows as a new version layered on the latest one.
+
+    Only the (ticker, year) partitions df touches are written: each one holds the parent's
+    rows for it, with rows that have the same keys as a row of df replaced by df's. Every other
+    partition is read from the parent, so a daily refresh writes a few small files.
+
+    Parameters:
+        name (str): Dataset name (e.g. 'stocks_df').
+        df (DataFrame): New and changed rows.
+        keys (list): Columns identifying a row (e.g. ['ticker', 'Date']).
+        version (str, optional): Version string (default: new_version()).
+        root (str): Store directory.
+
+    Returns:
+        str: The version written (the latest version if df is empty).
+    """
+    parent = dataset_version(name, root)
+    if parent is None:
+        return write_dataset(name, df, version, root=root)
+    if len(df) == 0:
+        return parent
+
+    date_col = DATE_COLUMNS.get(name)
+    touched = df[['ticker']].assign(year=df[date_col].dt.year).drop_duplicates()
+
+    existing = read_dataset(
+        name, tickers=list(touched['ticker'].unique()),
+        start=pd.Timestamp(year=touched['year'].min(), month=1, day=1), version=parent,
+        root=root
+    )
+    if len(existing) > 0:
+        existing = existing.assign(year=existing[date_col].dt.year).merge(
+            touched, on=['ticker', 'year']
+        ).drop(columns='year')
+        replaced = existing.set_index(keys).index.isin(df.set_index(keys).index)
+        df = pd.concat([existing.loc[~replaced], df[existing.columns]], ignore_index=True)
+
+    merged = df.sort_values(keys, ignore_index=True)
+
+    return write_dataset(name, merged, version, parent=parent, root=root)
+
+def _resolve_files(name, version, root) -> dict:
+    """
+    Map each partition to the file of the newest version (following parents) that has it.
+    """
+    files = {}
+    seen = set()
+    while version is not None:
+        if version in seen:
+            raise ValueError(f"Version {version} of '{name}' is its own ancestor.")
+        seen.add(version)
+        manifest = read_manifest(name, version, root)
+        for partition in manifest['partitions']:
+            if partition not in files:
+                files[partition] = os.path.join(root, name, version, partition, 'part-0.parquet')
+        version = manifest['parent']
+
+    return files
+
+def dataset_token(name, tickers=None, version=None, root=STORE_DIR):
+    """
+    Token that changes whenever the data of a dataset (or of some of its tickers) changes: a
+    hash of the path, size and modification time of the files the dataset is read from, so a
+    version rewritten in place changes it too. A version layered on a parent only changes the
+    token of the tickers it rewrote. None if the dataset is not in the store.
+
+    Parameters:
+        name (str): Dataset name (e.g. 'stocks_df').
+        tickers (list, optional): Only the partitions of these tickers.
+        version (str, optional): Version (default: latest).
+        root (str): Store directory.
+    """
+    version = version or dataset_version(name, root)
+    if version is None:
+        return None
+
+    files = []
+    for partition, path in sorted(_resolve_files(name, version, root).items()):
+        keys = _parse_partition(partition)
+        if tickers is not None and 'ticker' in keys and keys['ticker'] not in tickers:
+            continue
+        stat = os.stat(path)
+        files.append([path, stat.st_size, stat.st_mtime_ns])
+
+    return hashlib.sha1(json.dumps(files).encode()).hexdigest()[:16]
+
+def read_dataset(name, columns=None, tickers=None, start=None, end=None, version=None,
+                 root=STORE_DIR) -> pd.DataFrame:
+    """
+    Read a dataset from the store.
+
+    Ticker and date filters prune whole partitions before any file is opened, and are then
+    pushed down to the Parquet row groups. Only the requested columns are read.
+
+    Parameters:
+        name (str): Dataset name (e.g. 'stocks_df').
+        columns (list, optional): Columns to read (default: all).
+        tickers (list, optional): Only read these tickers.
+        start (str or Timestamp, optional): First date to read.
+        end (str or Timestamp, optional): Last date to read.
+        version (str, optional): Version to read (default: latest).
+        root (str): Store directory.
+
+    Returns:
+        DataFrame: The requested data.
+    """
+    version = version or dataset_version(name, root)
+    if version is None:
+        raise FileNotFoundError(f"Dataset '{name}' not found in {root}")
+
+    date_col = DATE_COLUMNS.get(name)
+    start = pd.Timestamp(start) if start is not None else None
+    end = pd.Timestamp(end) if end is not None else None
+
+    paths = []
+    for partition, path in sorted(_resolve_files(name, version, root).items()):
+        keys = _parse_partition(partition)
+        if tickers is not None and 'ticker' in keys and keys['ticker'] not in tickers:
+            continue
+        # Rows without a date never pass a date filter
+        if (start is not None or end is not None) and keys.get('year') == NULL_PARTITION:
+            continue
+        if start is not None and 'year' in keys and int(keys['year']) < start.year:
+            continue
+        if end is not None and 'year' in keys and int(keys['year']) > end.year:
+            continue
+        paths.append(path)
+
+    if not paths:
+        return pd.DataFrame(columns=columns or read_manifest(name, version, root)['columns'])
+
+    dataset = ds.dataset(paths, format='parquet')
+
+    row_filter = None
+    conditions = []
+    if tickers is not None and 'ticker' in dataset.schema.names:
+        conditions.append(ds.field('ticker').isin(list(tickers)))
+    if start is not None and date_col is not None:
+        conditions.append(ds.field(date_col) >= start)
+    if end is not None and date_col is not None:
+        conditions.append(ds.field(date_col) <= end)
+    for condition in conditions:
+        row_filter = condition if row_filter is None else row_filter & condition
+
+    table = dataset.to_table(columns=columns, filter=row_filter)
+
+    return table.to_pandas()
@@ -1,17 +1,22 @@
 """This module downloads the data necessary to test different strategies"""
 
 import glob
+import json
 import os
-import time
+import shutil
 import urllib.parse
 from datetime import datetime, date, timedelta
 
+import numpy as np
 import pandas as pd
 import requests
 import yfinance as yf
 from dotenv import load_dotenv
 from fredapi import Fred
 
+import data_store
+import fetch_utils
+
 # Authentication
 load_dotenv()
 fred_api_key = os.getenv("fred_api_key")
@@ -20,13 +25,27 @@ wiki_user_agent = os.getenv("wiki_user_agent")
 
 WIKI_SDATE = "20150701" # earliest date is"20150701"
 WIKI_BASE_URL = "https://wikimedia.org/api/rest_v1/metrics/pageviews/per-article/en.wikipedia/all-access/user/"
+WIKI_RATE = 50 # requests per second (the pageviews API allows 100)
+WIKI_WORKERS = 8
 START_DATE = "1993-01-29" # SPY launched on 1993-01-22 ... first data is January 29?
 end_date = datetime.today().strftime('%Y-%m-%d')
 
+NOAA_BASE_URL = 'https://www.ncei.noaa.gov/cdo-web/api/v2/data'
+OBSERVATIONS_URL = "https://api.weather.gov/stations/KNYC/observations"
+STATIONID = "GHCND:USW00094728" # Central Park Station in NYC
+NOAA_RATE = 4 # requests per second (the API allows 5)
+NOAA_WORKERS = 4
+WEATHER_CHECKPOINT_DIR = 'weather_checkpoints'
+
+OVERLAP_DAYS = 10 # days of stored prices re-downloaded to detect split/dividend restatements
+
 def load_existing_data():
     """
-    Load existing weather data from CSV files.
+    Load existing weather data from the columnar store (or the latest CSV file).
     """
+    if data_store.dataset_version('weather_df') is not None:
+        return data_store.read_dataset('weather_df')
+
     weather_df_files = glob.glob('weather_df_*.csv')
     weather_df_latest = max(weather_df_files, key=os.path.getctime)
     weather_df_loaded = pd.read_csv(weather_df_latest, parse_dates=['date'])
@@ -105,302 +124,597 @@ def get_sp500_tickers():
     build_sp_df = pd.concat([build_sp_df,build_sp_df_spy],ignore_index=True)
     return build_sp_df
 
-def get_wikipedia_pageviews(sp_df):
+def wiki_session(max_workers=WIKI_WORKERS):
+    """
+    Session with a connection pool large enough for max_workers concurrent requests
+    """
+    session = requests.Session()
+    session.headers.update({"User-Agent": wiki_user_agent})
+    adapter = requests.adapters.HTTPAdapter(pool_maxsize=max_workers)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
+
+def last_pageview_dates(root=data_store.STORE_DIR) -> pd.Series:
+    """
+    Last stored pageviews date of each ticker (comma separated tickers for shared pages).
+    """
+    stored = data_store.read_dataset('wiki_pageviews', columns=['Date', 'ticker'], root=root)
+    return stored.groupby('ticker')['Date'].max()
+
+def get_wikipedia_pageviews(sp_df, last_dates=None, max_workers=WIKI_WORKERS, rate=WIKI_RATE,
+                            session=None) -> tuple:
     """
     Get daily wikipedia pageviews for each company
+
+    Pages are fetched concurrently through one pooled session, rate limited, with rate limit and
+    server errors retried. With last_dates, each page is only fetched from the day after its last
+    stored date.
+
+    Parameters:
+        sp_df (DataFrame): S&P 500 companies with Symbol and wiki_page.
+        last_dates (Series, optional): Last stored date by ticker (see last_pageview_dates).
+        max_workers (int): Maximum number of concurrent requests.
+        rate (float): Requests per second.
+        session (optional): requests session (default: wiki_session()).
+
+    Returns:
+        DataFrame: Pageviews (only the new days with last_dates).
+        list: Pages that could not be fetched or had no data.
     """
     wiki_edate=(date.today()-pd.Timedelta(days=1)).strftime('%Y%m%d') # yesterday
 
-    wiki_headers = {
-        "User-Agent": wiki_user_agent
-    }
-
-    dat=[]
-    missing=[]
-    for page in set(sp_df['wiki_page']):
-        url = f"{WIKI_BASE_URL}{page}/daily/{WIKI_SDATE}/{wiki_edate}"
-
-        try:
-            page_response = requests.get(url, headers=wiki_headers, timeout=20)
-            page_response.raise_for_status()
-
-            json_data = page_response.json()
-            if 'items' in json_data:
-                items_df = pd.DataFrame(json_data['items'])
-
-                if len(sp_df.loc[sp_df['wiki_page']==page,'Symbol']) > 1:
-                    items_df['ticker'] = ','.join(
-                        list(sp_df.loc[sp_df['wiki_page']==page,'Symbol'])
-                    )
-                else:
-                    items_df['ticker'] = sp_df.loc[sp_df['wiki_page']==page,'Symbol'].item()
-            else:
-                print(f"'items' key missing in response for page: {page}")
-                missing.append(page)
-
-        except requests.exceptions.RequestException as e:
-            print(f"Request error for {page}: {e}")
-            missing.append(page)
+    # Tickers of each page (comma separated if several share one, e.g. GOOGL,GOOG)
+    page_tickers = sp_df.groupby('wiki_page', sort=False)['Symbol'].agg(','.join).to_dict()
+
+    start_dates = {}
+    for page, tickers in page_tickers.items():
+        start_date = WIKI_SDATE
+        if last_dates is not None and tickers in last_dates.index:
+            start_date = (last_dates[tickers] + pd.Timedelta(days=1)).strftime('%Y%m%d')
+        if start_date <= wiki_edate:
+            start_dates[page] = start_date
+
+    session = session or wiki_session(max_workers)
+
+    def fetch(page):
+        url = f"{WIKI_BASE_URL}{page}/daily/{start_dates[page]}/{wiki_edate}"
+        page_response = session.get(url, timeout=20)
+        fetch_utils.check_retryable(page_response.status_code, url)
+        page_response.raise_for_status()
+        return page_response.json()
+
+    results, failures = fetch_utils.fetch_all(
+        fetch, list(start_dates), max_workers=max_workers,
+        bucket=fetch_utils.TokenBucket(rate, capacity=max_workers),
+        retry_on=(requests.exceptions.ConnectionError, requests.exceptions.Timeout,
+                  fetch_utils.RetryableStatus)
+    )
 
-        except ValueError as e:
-            print(f"ValueError for page {page}: {e}")
-            missing.append(page)
+    missing = []
+    for page, e in failures.items():
+        print(f"Request error for {page}: {e}")
+        missing.append(page)
 
-        if len(items_df)==0:
+    dat = []
+    for page, json_data in results.items():
+        if not json_data.get('items'):
             print(f"wiki pageviews data frame empty: {page}")
             missing.append(page)
+            continue
 
+        items_df = pd.DataFrame(json_data['items'])
+        items_df['ticker'] = page_tickers[page]
         dat.append(items_df)
 
+    if not dat:
+        return pd.DataFrame(columns=['Date', 'ticker']), missing
+
     build_wiki_pv = pd.concat(dat).reset_index(drop=True)
     build_wiki_pv['Date'] =  pd.to_datetime(build_wiki_pv['timestamp'], format='%Y%m%d%H')
-    return build_wiki_pv
+    return build_wiki_pv, missing
 
-def save_data_to_csv(dic_of_dfs):
-    """Save data to CSV files"""
-    today_str = datetime.today().strftime("%Y%m%d")
-    for df_name, final_df in dic_of_dfs.items():
-        final_df.to_csv(f"{df_name}_{today_str}.csv", index=False)
+def _split_batch(data, batch) -> dict:
+    """
+    Split a yf.download result (grouped by ticker) into one DataFrame per ticker with data.
+    """
+    frames = {}
+    for ticker in batch:
+        if isinstance(data.columns, pd.MultiIndex):
+            if ticker not in data.columns.get_level_values(0):
+                continue
+            frame = data[ticker].copy()
+        else:
+            frame = data.copy()
+
+        # Tickers are aligned on the dates of the whole batch
+        frame = frame.dropna(how='all')
+        if 'Volume' in frame.columns and frame['Volume'].notna().all():
+            frame['Volume'] = frame['Volume'].astype('int64')
+        if len(frame) > 0:
+            frame['ticker'] = ticker
+            frames[ticker] = frame
+
+    return frames
+
+def download_prices(tickers, start=START_DATE, end=None, batch_size=20, max_workers=4, rate=1.0,
+                    attempts=4, session=None) -> pd.DataFrame:
+    """
+    Download daily price history for many tickers with yfinance.
+
+    Tickers are downloaded in batches, one yf.download call per batch fetching its tickers on
+    max_workers threads. The batches run one after another: older yfinance versions collect
+    the results of yf.download in module globals that concurrent calls overwrite, and every
+    version shares its thread limit across calls. A token bucket limits how many batches start
+    per second, with jittered backoff between retries. Tickers missing from their batch's
+    result are retried one by one.
+
+    Parameters:
+        tickers (list): Tickers to download.
+        start (str): First date.
+        end (str, optional): Last date (default: today).
+        batch_size (int): Tickers per yf.download call.
+        max_workers (int): Threads yf.download fetches the tickers of a batch on.
+        rate (float): Downloads started per second.
+        attempts (int): Maximum number of tries per download.
+        session (optional): Session passed to yfinance.
+
+    Returns:
+        DataFrame: Date, price columns and ticker, one block of rows per ticker in ticker order.
+    """
+    end = end or end_date
+    bucket = fetch_utils.TokenBucket(rate)
+
+    def download(batch):
+        data = yf.download(
+            list(batch),
+            start=start,
+            end=end,
+            auto_adjust=False, # ?
+            group_by='ticker',
+            threads=max_workers,
+            progress=False,
+            session=session
+        )
+        frames = _split_batch(data, batch)
+        if not frames:
+            raise ValueError(f"No data for {', '.join(batch)}")
+        return frames
+
+    batches = [tuple(tickers[i:i+batch_size]) for i in range(0, len(tickers), batch_size)]
+    results, _ = fetch_utils.fetch_all(download, batches, max_workers=1, bucket=bucket,
+                                       attempts=attempts)
+    frames = {ticker: frame for batch in results.values() for ticker, frame in batch.items()}
+
+    missing = [(ticker,) for ticker in tickers if ticker not in frames]
+    if missing:
+        results, failures = fetch_utils.fetch_all(download, missing, max_workers=1,
+                                                  bucket=bucket, attempts=attempts)
+        for batch in results.values():
+            frames.update(batch)
+        for (ticker,), error in failures.items():
+            print(f"Price download failed for {ticker}: {error}")
+
+    if not frames:
+        return pd.DataFrame(columns=['Date', 'ticker'])
+
+    build_stocks_df = pd.concat([frames[ticker] for ticker in tickers if ticker in frames])
+    build_stocks_df = build_stocks_df.reset_index()
+    build_stocks_df = build_stocks_df.rename_axis(None, axis=1)
+    return build_stocks_df
+
+def last_stored_dates(root=data_store.STORE_DIR) -> pd.Series:
+    """
+    Last stored date of each ticker in the stocks_df store.
+    """
+    stored = data_store.read_dataset('stocks_df', columns=['Date', 'ticker'], root=root)
+    return stored.groupby('ticker')['Date'].max()
+
+def find_restated(fetched, stored, columns=('Close', 'Adj Close'), rtol=1e-6) -> list:
+    """
+    Tickers whose fetched prices differ from the stored prices on the same dates (a split
+    restates Close, a dividend restates Adj Close).
+    """
+    both = fetched.merge(stored, on=['ticker', 'Date'], suffixes=('', '_stored'))
+    changed = pd.Series(False, index=both.index)
+    for col in columns:
+        changed |= ~np.isclose(both[col], both[col+'_stored'], rtol=rtol, equal_nan=True)
 
+    return sorted(both.loc[changed, 'ticker'].unique())
 
-sp500_dataframe = get_sp500_tickers()
+def refresh_prices(tickers, overlap_days=OVERLAP_DAYS, root=data_store.STORE_DIR,
+                   **download_kwargs) -> str:
+    """
+    Bring the stocks_df store up to date without downloading the whole history.
+
+    Each ticker is downloaded from overlap_days before its last stored date (tickers with the
+    same last date share batches). Tickers whose overlapping rows changed, and tickers not in
+    the store yet, get their whole history again. Only the new and restated rows are written,
+    as a new version layered on the latest one (see data_store.write_delta).
+
+    Parameters:
+        tickers (list): Tickers to refresh.
+        overlap_days (int): Days of stored prices compared with the new download.
+        root (str): Store directory.
+        **download_kwargs: Passed to download_prices.
 
-####################################################################################################
-# Get daily stocks data for each company wih yfinance ##############################################
-####################################################################################################
-sp500_tickers = sp500_dataframe['Symbol']
+    Returns:
+        str: The stocks_df version holding the refreshed data.
+    """
+    last_dates = last_stored_dates(root)
+    known = [ticker for ticker in tickers if ticker in last_dates.index]
+    starts = last_dates[known] - pd.Timedelta(days=overlap_days)
+
+    tails = []
+    restated = []
+    for start, group in starts.groupby(starts):
+        group_tickers = list(group.index)
+        fetched = download_prices(group_tickers, start=start.strftime('%Y-%m-%d'),
+                                  **download_kwargs)
+        if len(fetched) == 0:
+            continue
+
+        stored = data_store.read_dataset('stocks_df', tickers=group_tickers, start=start,
+                                         root=root)
+        restated += find_restated(fetched, stored)
+
+        is_new = fetched['Date'] > fetched['ticker'].map(last_dates)
+        tails.append(fetched.loc[is_new & ~fetched['ticker'].isin(restated)])
+
+    full = [ticker for ticker in tickers if ticker not in last_dates.index] + restated
+    if restated:
+        print(f"Restated, downloading again: {', '.join(restated)}")
+    if full:
+        tails.append(download_prices(full, **download_kwargs))
+
+    tails = [tail for tail in tails if len(tail) > 0]
+    if not tails:
+        return data_store.dataset_version('stocks_df', root)
+
+    return data_store.write_delta('stocks_df', pd.concat(tails, ignore_index=True),
+                                  keys=['ticker', 'Date'], root=root)
+
+def download_shares(tickers, start=START_DATE, end=None, max_workers=4, rate=2.0, attempts=4,
+                    session=None) -> pd.DataFrame:
+    """
+    Download outstanding shares reports for many tickers with yfinance (one yf.Ticker per
+    ticker, fetched concurrently on a bounded thread pool and rate limited).
 
-selected_tickers = list(sp500_tickers)
+    Returns:
+        DataFrame: os_report_datetime, os_report_date, ticker and outstanding_shares (no rows
+            if every ticker failed).
+    """
+    end = end or end_date
 
-dat_list = []
-for i in selected_tickers:
-    data = yf.download(
-        i,
-        start=START_DATE,
-        end=end_date,
-        auto_adjust=False, # ?
-        progress=False
+    def download(ticker):
+        return yf.Ticker(ticker, session=session).get_shares_full(start=start, end=end)
+
+    results, failures = fetch_utils.fetch_all(
+        download, tickers, max_workers=max_workers, bucket=fetch_utils.TokenBucket(rate),
+        attempts=attempts
     )
-    data.columns = data.columns.get_level_values(0)
-    data['ticker'] = i
-    dat_list.append(data)
-    time.sleep(1)
-
-stocks_df = pd.concat(dat_list)
-stocks_df = stocks_df.reset_index()
-stocks_df = stocks_df.rename_axis(None, axis=1)
-
-# Get outstanding shares data
-dat_list = []
-for i in sp500_tickers:
-    if yf.Ticker(i).get_shares_full() is not None:
-        df = yf.Ticker(i).get_shares_full(start=START_DATE, end=end_date)
-        df = pd.DataFrame(df)
-        df['ticker'] = i
-        dat_list.append(df)
-
-os_df = pd.concat(dat_list)
-
-os_df = os_df.rename_axis('os_report_datetime').reset_index()
-os_df['os_report_date'] = pd.to_datetime(os_df['os_report_datetime'].dt.date)
-os_df = os_df.rename(columns={0: 'outstanding_shares'})
-os_df = os_df.groupby(
-    ['os_report_datetime','os_report_date','ticker']
-).agg(outstanding_shares = ('outstanding_shares','mean')).reset_index()
-
-# Group to dates
-# is mean correct? or should I take last value? only matters if there are duplicate dates above
-os_df_date_tick = os_df.groupby(
-    ['os_report_date','ticker']
-).agg(outstanding_shares = ('outstanding_shares','mean')).reset_index()
-
-# Set outstanding shares for each day
-# can this be updated to use .ffill?()?
-dat_list = []
-prev_date = None
-prev_ticker = None
-prev_value = None
-for index, row in os_df_date_tick.iterrows():
-    current_date = row['os_report_date']
-    current_ticker = row['ticker']
-    current_value = row['outstanding_shares']
-
-    if prev_date is not None:
-        # Generate missing dates and values
-        missing_dates = pd.date_range(start=prev_date, end=current_date, inclusive='neither')
-
-        # Append missing dates and values to dat_list
-        dat_list.append(pd.DataFrame({'os_report_date': prev_date
-                                    ,'date': missing_dates
-                                    ,'ticker': prev_ticker
-                                    ,'outstanding_shares': prev_value}))
-
-    # Add the current row to dat_list
-    dat_list.append(pd.DataFrame({'os_report_date': [current_date]
-                                ,'date': [current_date]
-                                ,'ticker': [current_ticker]
-                                ,'outstanding_shares': [current_value]}))
-
-    # Update previous date and value
-    prev_date = current_date
-    prev_ticker = current_ticker
-    prev_value = current_value
-
-os_df_days = pd.concat(dat_list, ignore_index=True)
-
-####################################################################################################
-# Get historical weaher data for NYC from NOAA and weather.gov #####################################
-####################################################################################################
-NOAA_BASE_URL = 'https://www.ncei.noaa.gov/cdo-web/api/v2/data'
-OBSERVATIONS_URL = "https://api.weather.gov/stations/KNYC/observations"
-STATIONID = "GHCND:USW00094728" # Central Park Station in NYC
+    for ticker, error in failures.items():
+        print(f"Shares download failed for {ticker}: {error}")
+
+    dat_list = []
+    for ticker in tickers:
+        if results.get(ticker) is not None:
+            df = pd.DataFrame(results[ticker])
+            df['ticker'] = ticker
+            dat_list.append(df)
+
+    if not dat_list:
+        return pd.DataFrame({
+            'os_report_datetime': pd.Series(dtype='datetime64[ns, UTC]'),
+            'os_report_date': pd.Series(dtype='datetime64[ns]'),
+            'ticker': pd.Series(dtype=str),
+            'outstanding_shares': pd.Series(dtype='float64')
+        })
+
+    build_os_df = pd.concat(dat_list)
+
+    build_os_df = build_os_df.rename_axis('os_report_datetime').reset_index()
+    build_os_df['os_report_date'] = pd.to_datetime(build_os_df['os_report_datetime'].dt.date)
+    build_os_df = build_os_df.rename(columns={0: 'outstanding_shares'})
+    build_os_df = build_os_df.groupby(
+        ['os_report_datetime','os_report_date','ticker']
+    ).agg(outstanding_shares = ('outstanding_shares','mean')).reset_index()
+
+    return build_os_df
+
+def expand_outstanding_shares(os_df_date_tick, since=None) -> pd.DataFrame:
+    """
+    Outstanding shares for every day, carried forward from each report until the ticker's next
+    report (the last report of a ticker only gives its own date).
 
-weather_df_hist = load_existing_data()
+    Parameters:
+        os_df_date_tick (DataFrame): os_report_date, ticker and outstanding_shares, one row per
+            report date and ticker.
+        since (str or Timestamp, optional): Only return days from this date on (earlier
+            reports are still carried forward into it), for incremental runs on new reports.
 
-# Set up date_ranges - the data we are going to get download in the current run
-# date_ranges is a list of dictionaries with start and end dates for 29 (30?) day periods
-# filter to end_date >= min(one_year_ago,last_hist_data_date)
-end_date_dt = datetime.strptime(end_date, "%Y-%m-%d") # to datetime
+    Returns:
+        DataFrame: os_report_date, date, ticker and outstanding_shares.
+    """
+    reports = os_df_date_tick.sort_values(['ticker', 'os_report_date'], ignore_index=True)
+    next_report = reports.groupby('ticker')['os_report_date'].shift(-1)
+    n_days = (next_report - reports['os_report_date']).dt.days.fillna(1).astype('int64')
+
+    first = reports['os_report_date']
+    if since is not None:
+        since = pd.Timestamp(since)
+        keep = (next_report.isna() & (reports['os_report_date'] >= since)) | (next_report > since)
+        reports, next_report, n_days = reports[keep], next_report[keep], n_days[keep]
+
+        # Days skipped at the start of reports that began before since
+        first = reports['os_report_date'].clip(lower=since)
+        n_days = n_days - (first - reports['os_report_date']).dt.days
+
+    rows = np.repeat(np.arange(len(reports)), n_days.to_numpy())
+    offsets = np.arange(len(rows)) - np.repeat(np.cumsum(n_days.to_numpy()) - n_days.to_numpy(),
+                                               n_days.to_numpy())
+
+    expanded = reports.iloc[rows].reset_index(drop=True)
+    expanded['date'] = first.to_numpy()[rows] + pd.to_timedelta(offsets, unit='D')
+
+    return expanded[['os_report_date', 'date', 'ticker', 'outstanding_shares']]
+
+def get_outstanding_shares_days(os_df, since=None):
+    """
+    Outstanding shares for every day from the reports (see expand_outstanding_shares)
+    """
+    # Group to dates
+    # is mean correct? or should I take last value? only matters if there are duplicate dates above
+    os_df_date_tick = os_df.groupby(
+        ['os_report_date','ticker']
+    ).agg(outstanding_shares = ('outstanding_shares','mean')).reset_index()
+
+    return expand_outstanding_shares(os_df_date_tick, since)
+
+def noaa_windows(start, end) -> list:
+    """
+    Split a date range into the (start_date, end_date) windows of 30 days requested from NOAA
+    (one request returns at most 1000 records, about 30 days of the four datatypes).
+    """
+    end_dt = datetime.strptime(end, "%Y-%m-%d") # to datetime
+
+    current_start_date = datetime.strptime(start, "%Y-%m-%d")
+    windows = []
+    while current_start_date <= end_dt:
+        current_end_date = current_start_date + timedelta(days=29)
+        current_end_date = min(current_end_date, end_dt)
 
-current_start_date = datetime.strptime(START_DATE, "%Y-%m-%d")
-date_ranges = []
-while current_start_date <= end_date_dt:
-    current_end_date = current_start_date + timedelta(days=29)
-    current_end_date = min(current_end_date, end_date_dt)
+        windows.append((current_start_date.strftime("%Y-%m-%d"),
+                        current_end_date.strftime("%Y-%m-%d")))
 
-    date_ranges.append({'start_date': current_start_date.strftime("%Y-%m-%d")
-                        ,'end_date': current_end_date.strftime("%Y-%m-%d")})
+        current_start_date = current_end_date + timedelta(days=1)
 
-    current_start_date = current_end_date + timedelta(days=1)
+    return windows
 
-date_ranges_df = pd.DataFrame(date_ranges)
+def _checkpoint_path(checkpoint_dir, window) -> str:
+    return os.path.join(checkpoint_dir, f"{window[0]}_{window[1]}.json")
 
-one_year_ago = (datetime.now()-timedelta(days=365)).strftime("%Y-%m-%d") # to string
-last_hist_data_date = max(weather_df_hist['date']).strftime("%Y-%m-%d") # to string
+def fetch_noaa_windows(windows, checkpoint_dir, max_workers=NOAA_WORKERS, rate=NOAA_RATE,
+                       attempts=4, session=None) -> tuple:
+    """
+    Fetch NOAA daily summaries for date windows concurrently, checkpointing each window.
+
+    Each window's results are saved to checkpoint_dir as soon as they arrive, and windows that
+    already have a checkpoint are not requested again, so a crashed or rate limited run picks
+    up from the windows it is missing.
+
+    Parameters:
+        windows (list): (start_date, end_date) windows (see noaa_windows).
+        checkpoint_dir (str): Directory of the window checkpoints.
+        max_workers (int): Maximum number of concurrent requests.
+        rate (float): Requests per second.
+        attempts (int): Maximum number of requests per window.
+        session (optional): requests session (default: a new one).
+
+    Returns:
+        list: NOAA results of every completed window, in window order.
+        list: Windows that failed.
+    """
+    os.makedirs(checkpoint_dir, exist_ok=True)
+    session = session or requests.Session()
+    session.headers.update({'token': noaa_api_key})
+
+    def fetch(window):
+        params = {
+            'datasetid': 'GHCND',  # Daily Summaries dataset
+            'stationid': STATIONID,
+            'startdate': window[0],
+            'enddate': window[1],
+            'units': 'metric',  # Use metric units (Celsius for temperatures, mm for precipitation)
+            'limit': 1000  # Maximum number of records to fetch
+        }
+        resp = session.get(NOAA_BASE_URL, params=params, timeout=300)
+        fetch_utils.check_retryable(resp.status_code, f"start date {window[0]}")
+        resp.raise_for_status()
+
+        # No 'results' key: no data in this window
+        results = resp.json().get('results', [])
+
+        path = _checkpoint_path(checkpoint_dir, window)
+        with open(path+'.tmp', "w", encoding="utf-8") as f:
+            json.dump(results, f)
+        os.replace(path+'.tmp', path)
+
+        print(resp.status_code, window[0])
+        return results
+
+    todo = [w for w in windows if not os.path.isfile(_checkpoint_path(checkpoint_dir, w))]
+    if len(todo) < len(windows):
+        print(f"Resuming: {len(windows) - len(todo)} of {len(windows)} windows checkpointed")
+
+    _, failures = fetch_utils.fetch_all(
+        fetch, todo, max_workers=max_workers, bucket=fetch_utils.TokenBucket(rate),
+        attempts=attempts, base_delay=10.0,
+        retry_on=(requests.exceptions.ConnectionError, requests.exceptions.Timeout,
+                  fetch_utils.RetryableStatus)
+    )
+    for window, e in failures.items():
+        print(f"Error at start date {window[0]}: {e}")
 
-date_ranges_df = date_ranges_df.loc[
-    date_ranges_df['end_date'] >= min(one_year_ago,last_hist_data_date)
-]
-date_ranges_df = date_ranges_df.reset_index(drop=True)
+    results = []
+    for window in windows:
+        path = _checkpoint_path(checkpoint_dir, window)
+        if os.path.isfile(path):
+            with open(path, "r", encoding="utf-8") as f:
+                results.extend(json.load(f))
 
-headers = {
-    'token': noaa_api_key
-}
+    return results, list(failures)
 
-weather_data = {}
-for index, row in date_ranges_df.iterrows():
-    params = {
-        'datasetid': 'GHCND',  # Daily Summaries dataset
-        'stationid': STATIONID,
-        'startdate': row['start_date'],
-        'enddate': row['end_date'],
-        'units': 'metric',  # Use metric units (Celsius for temperatures, mm for precipitation)
-        'limit': 1000  # Maximum number of records to fetch
+def parse_noaa_results(results) -> pd.DataFrame:
+    """
+    One row per date with the temperatures and precipitation of NOAA daily summaries
+    """
+    columns = {
+        'TMAX': 'high_temp_nyc',
+        'TMIN': 'low_temp_nyc',
+        'PRCP': 'precipitation_PRCP_nyc',
+        'SNOW': 'precipitation_SNOW_nyc',
     }
+    records = pd.DataFrame(results, columns=['date', 'datatype', 'value'])
+    records = records.loc[records['datatype'].isin(list(columns))]
 
-    resp = requests.get(NOAA_BASE_URL, headers=headers, params=params, timeout=300)
-
-    if resp.status_code != 200:
-        print(f"Error at start date {row['start_date']}: {resp.status_code}, {resp.text}")
-        print(f"Trying start date {row['start_date']} again")
-        time.sleep(10)
-        resp = requests.get(NOAA_BASE_URL, headers=headers, params=params, timeout=300)
-        if resp.status_code != 200:
-            print(f"Error #2 at start date {row['start_date']}: {resp.status_code}, {resp.text}")
-            print(f"Failed twice. Trying start date {row['start_date']} one last time")
-            time.sleep(20)
-            resp = requests.get(NOAA_BASE_URL, headers=headers, params=params, timeout=300)
-            if resp.status_code != 200:
-                print(f"Error at start date {row['start_date']}: {resp.status_code}, {resp.text}")
-                print("Failed three times. Not trying again")
-                break
-
-    print(resp.status_code, row['start_date'])
-    data = resp.json()
-
-    # Check if 'results' key exists
-    if 'results' not in data:
-        print(f"No 'results' key in response for start date {row['start_date']} data: {data}")
-        continue  # Skip to the next iteration if 'results' is missing
-
-    for item in data['results']:
-        item_date = item['date']
-        datatype = item['datatype']
-        value = item['value']
-
-        # Initialize date entry if not already present
-        if item_date not in weather_data:
-            weather_data[item_date] = {
-                'date': item_date
-                ,'high_temp_nyc': None
-                ,'low_temp_nyc': None
-                ,'precipitation_PRCP_nyc': None
-                ,'precipitation_SNOW_nyc': None
-            }
-
-        # Update the weather data dictionary based on the datatype
-        if datatype == 'TMAX':
-            weather_data[item_date]['high_temp_nyc'] = value
-        elif datatype == 'TMIN':
-            weather_data[item_date]['low_temp_nyc'] = value
-        elif datatype == 'PRCP':
-            weather_data[item_date]['precipitation_PRCP_nyc'] = value
-        elif datatype == 'SNOW':
-            weather_data[item_date]['precipitation_SNOW_nyc'] = value
-    time.sleep(1)
-
-weather_records = list(weather_data.values())
-
-noaa_weather = pd.DataFrame(weather_records)
-noaa_weather['date'] = pd.to_datetime(noaa_weather['date'])
-
-# Recent weather
-observations_response = requests.get(OBSERVATIONS_URL, timeout=300)
-observations_response.raise_for_status()
-observations = observations_response.json()
-
-recent_weather_data = []
-for obs in observations["features"]:
-    props = obs["properties"]
-    recent_weather_data.append({
-        '@id': props["@id"],
-        'timestamp': props["timestamp"],
-        'temperature': props.get("temperature", {}).get("value"),
-        'minTemperatureLast24Hours': props.get("minTemperatureLast24Hours", {}).get("value"),
-        'maxTemperatureLast24Hours': props.get("maxTemperatureLast24Hours", {}).get("value"),
-        'windSpeed': props.get("windSpeed", {}).get("value"), # In km_h-1
-        'precipitationLastHour': props.get("precipitationLastHour", {}).get("value"),  # In mm
-        'precipitationLast3Hours': props.get("precipitationLast3Hours", {}).get("value"),  # In mm
-        'precipitationLast6Hours': props.get("precipitationLast6Hours", {}).get("value"),  # In mm
-    })
+    noaa_weather = records.pivot_table(index='date', columns='datatype', values='value',
+                                       aggfunc='last')
+    noaa_weather = noaa_weather.reindex(columns=list(columns)).rename(columns=columns)
+    noaa_weather = noaa_weather.rename_axis(None, axis=1).reset_index()
+    noaa_weather['date'] = pd.to_datetime(noaa_weather['date'])
+    return noaa_weather
+
+def get_noaa_weather(weather_df_hist, checkpoint_dir=None, **fetch_kwargs) -> pd.DataFrame:
+    """
+    Get daily NYC weather from NOAA for the windows from min(one year ago, last stored date) on.
 
-recent_weather_df = pd.DataFrame(recent_weather_data)
-recent_weather_df['timestamp'] = pd.to_datetime(recent_weather_df['timestamp'])
-recent_weather_df['date'] = pd.to_datetime(recent_weather_df['timestamp'].dt.date)
+    The windows are checkpointed under checkpoint_dir (default: one directory per run date in
+    WEATHER_CHECKPOINT_DIR, so a run restarted the same day resumes). The checkpoints are
+    deleted once every window is complete.
+    """
+    checkpoint_dir = checkpoint_dir or os.path.join(WEATHER_CHECKPOINT_DIR, end_date)
+
+    # filter to end_date >= min(one_year_ago,last_hist_data_date)
+    one_year_ago = (datetime.now()-timedelta(days=365)).strftime("%Y-%m-%d") # to string
+    last_hist_data_date = max(weather_df_hist['date']).strftime("%Y-%m-%d") # to string
+
+    windows = [w for w in noaa_windows(START_DATE, end_date)
+               if w[1] >= min(one_year_ago, last_hist_data_date)]
+
+    results, failed = fetch_noaa_windows(windows, checkpoint_dir, **fetch_kwargs)
+    if failed:
+        print(f"{len(failed)} windows failed, run again to resume from {checkpoint_dir}")
+    else:
+        shutil.rmtree(checkpoint_dir, ignore_errors=True)
+
+    return parse_noaa_results(results)
+
+def get_recent_weather(session=None) -> pd.DataFrame:
+    """
+    Daily low and high temperatures from the latest weather.gov observations (the last days,
+    before NOAA publishes them)
+    """
+    session = session or requests.Session()
+    observations_response = session.get(OBSERVATIONS_URL, timeout=300)
+    observations_response.raise_for_status()
+    observations = observations_response.json()
+
+    recent_weather_data = []
+    for obs in observations["features"]:
+        props = obs["properties"]
+        recent_weather_data.append({
+            '@id': props["@id"],
+            'timestamp': props["timestamp"],
+            'temperature': props.get("temperature", {}).get("value"),
+            'minTemperatureLast24Hours': props.get("minTemperatureLast24Hours", {}).get("value"),
+            'maxTemperatureLast24Hours': props.get("maxTemperatureLast24Hours", {}).get("value"),
+            'windSpeed': props.get("windSpeed", {}).get("value"), # In km_h-1
+            'precipitationLastHour': props.get("precipitationLastHour", {}).get("value"),  # In mm
+            'precipitationLast3Hours': props.get("precipitationLast3Hours", {}).get("value"),  # In mm
+            'precipitationLast6Hours': props.get("precipitationLast6Hours", {}).get("value"),  # In mm
+        })
+
+    recent_weather_df = pd.DataFrame(recent_weather_data)
+    recent_weather_df['timestamp'] = pd.to_datetime(recent_weather_df['timestamp'])
+    recent_weather_df['date'] = pd.to_datetime(recent_weather_df['timestamp'].dt.date)
+
+    #
+    weather_simp = recent_weather_df[['date','timestamp','temperature']]
+    weather_simp = weather_simp.groupby('date').agg(low_temp_nyc=('temperature', 'min')
+                                                    ,high_temp_nyc=('temperature', 'max')).reset_index()
+    return weather_simp
+
+def merge_weather(weather_df_hist, noaa_weather, recent_weather=None) -> pd.DataFrame:
+    """
+    Combine stored, NOAA and recent weather, one row per date.
+
+    NOAA data replaces stored data for the dates it has, and recent observations are only used
+    for the days after the last NOAA date. Stored rows are kept for any other date, so a NOAA
+    window that failed leaves the stored data in place instead of a gap.
+    """
+    frames = [noaa_weather]
+    if recent_weather is not None:
+        last_noaa_date = noaa_weather['date'].max() if len(noaa_weather) > 0 else pd.NaT
+        frames.append(recent_weather.loc[~(recent_weather['date'] <= last_noaa_date)])
+    frames.append(weather_df_hist)
 
-#
-weather_simp = recent_weather_df[['date','timestamp','temperature']]
-weather_simp = weather_simp.groupby('date').agg(low_temp_nyc=('temperature', 'min')
-                                                ,high_temp_nyc=('temperature', 'max')).reset_index()
+    weather_df = pd.concat(frames).drop_duplicates('date', keep='first')
+    return weather_df.sort_values('date').reset_index(drop=True)
 
-just_new = weather_simp.loc[weather_simp['date']>max(noaa_weather['date'])]
+def get_weather_data():
+    """
+    Get daily NYC weather: history from NOAA and the latest days from weather.gov observations
+    """
+    weather_df_hist = load_existing_data()
+    noaa_weather = get_noaa_weather(weather_df_hist)
 
-# Putting it all togeather
-weather_df_hist = weather_df_hist.loc[weather_df_hist['date']<min(noaa_weather['date'])]
+    return merge_weather(weather_df_hist, noaa_weather, get_recent_weather())
 
-weather_df = pd.concat([weather_df_hist, noaa_weather, just_new]).reset_index(drop=True)
+def save_data_to_csv(dic_of_dfs):
+    """Save data to CSV files and to a new version in the columnar store"""
+    today_str = datetime.today().strftime("%Y%m%d")
+    version = data_store.new_version()
+    for df_name, final_df in dic_of_dfs.items():
+        final_df.to_csv(f"{df_name}_{today_str}.csv", index=False)
+        data_store.write_dataset(df_name, final_df, version=version)
+
+def main(incremental=True):
+    """
+    Download everything and save it
+
+    Parameters:
+        incremental (bool): Only add the new days of stocks_df (see refresh_prices) and
+            wiki_pageviews to the store instead of downloading and saving their whole history
+            (always done for a dataset that is not in the store).
+    """
+    sp500_dataframe = get_sp500_tickers()
+    sp500_tickers = list(sp500_dataframe['Symbol'])
+
+    dic_of_dfs = {}
+    if incremental and data_store.dataset_version('stocks_df') is not None:
+        refresh_prices(sp500_tickers)
+    else:
+        dic_of_dfs['stocks_df'] = download_prices(sp500_tickers)
+
+    if incremental and data_store.dataset_version('wiki_pageviews') is not None:
+        wiki_pageviews, _ = get_wikipedia_pageviews(sp500_dataframe, last_pageview_dates())
+        data_store.write_delta('wiki_pageviews', wiki_pageviews, keys=['ticker', 'Date'])
+    else:
+        dic_of_dfs['wiki_pageviews'], _ = get_wikipedia_pageviews(sp500_dataframe)
+
+    os_df_days = get_outstanding_shares_days(download_shares(sp500_tickers))
+    weather_df = get_weather_data()
+    ffr = get_federal_funds_rate()
+
+    save_data_to_csv({
+        'sp_df':sp500_dataframe,
+        **dic_of_dfs,
+        'os_df_days':os_df_days,
+        'ffr':ffr,
+        'weather_df':weather_df
+    })
 
-####################################################################################################
-# main #############################################################################################
-####################################################################################################
-ffr = get_federal_funds_rate()
-wiki_pageviews = get_wikipedia_pageviews(sp500_dataframe)
 
-save_data_to_csv({
-    'sp_df':sp500_dataframe,
-    'wiki_pageviews':wiki_pageviews,
-    'stocks_df':stocks_df,
-    'os_df_days':os_df_days,
-    'ffr':ffr,
-    'weather_df':weather_df
-})
+if __name__ == "__main__":
+    main()
@@ -4,22 +4,34 @@ import argparse
 import glob
 import logging
 import os
-import re
-import time
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
 
+import numpy as np
 import pandas as pd
-from pandas.tseries.offsets import MonthBegin, MonthEnd
+from pandas.tseries.offsets import MonthEnd
 from pytrends.request import TrendReq
 from pytrends.exceptions import ResponseError
 import requests
 
+import data_store
+import fetch_utils
+import gt_queue
+
+GT_RATE = 0.5 # requests per second, before any rate limiting
+GT_COOLDOWN = 60.0 # pause after the first 429 (seconds), doubles with each consecutive 429
+GT_WORKERS = 2
+MAX_ATTEMPTS = 5
+
 # Argument parsing
 parser = argparse.ArgumentParser(description='Download Google Trends data.')
 parser.add_argument('--keyword', type=str, help='Keyword to add for Google Trends data')
+parser.add_argument('--workers', type=int, default=GT_WORKERS,
+                    help='Number of concurrent requests')
 args = parser.parse_args()
 
 new_keyword = args.keyword
+workers = args.workers
 
 # Config
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
@@ -27,27 +39,33 @@ logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(
 # Load data
 def load_existing_data() -> tuple:
     """
-    Load existing Google Trends data from CSV files.
+    Load existing Google Trends data from the columnar store (or the latest CSV files).
 
     Returns:
         tuple: DataFrames for monthly, weekly, and daily data.
     """
     gt_monthly_files = glob.glob('gt_monthly_*.csv')
-    if gt_monthly_files:
+    if data_store.dataset_version('gt_monthly') is not None:
+        gt_monthly_loaded = data_store.read_dataset('gt_monthly')
+    elif gt_monthly_files:
         gt_monthly_latest = max(gt_monthly_files, key=os.path.getctime)
         gt_monthly_loaded = pd.read_csv(gt_monthly_latest, parse_dates=['start_date', 'end_date'])
     else:
         gt_monthly_loaded = pd.DataFrame(columns=['start_date','index','isPartial','end_date','search_term','pytrends_params'])
 
     gt_weekly_files = glob.glob('gt_weekly_*.csv')
-    if gt_weekly_files:
+    if data_store.dataset_version('gt_weekly') is not None:
+        gt_weekly_loaded = data_store.read_dataset('gt_weekly')
+    elif gt_weekly_files:
         gt_weekly_latest = max(gt_weekly_files, key=os.path.getctime)
         gt_weekly_loaded = pd.read_csv(gt_weekly_latest, parse_dates=['start_date','end_date'])
     else:
         gt_weekly_loaded = pd.DataFrame(columns=['start_date','index','isPartial','end_date','search_term','pytrends_params'])
 
     gt_daily_files = glob.glob('gt_daily_*.csv')
-    if gt_daily_files:
+    if data_store.dataset_version('gt_daily') is not None:
+        gt_daily_loaded = data_store.read_dataset('gt_daily')
+    elif gt_daily_files:
         gt_daily_latest = max(gt_daily_files, key=os.path.getctime)
         gt_daily_loaded = pd.read_csv(gt_daily_latest, parse_dates=['date'])
     else:
@@ -63,234 +81,377 @@ def load_existing_data() -> tuple:
 
     return gt_monthly_loaded, gt_weekly_loaded, gt_daily_loaded, params_return_empty_df_raw
 
-def clean_up(gt_monthly, gt_weekly, gt_daily) -> pd.DataFrame:
+def month_index(gt_monthly) -> pd.DataFrame:
     """
-    Clean up Google Trends data by merging and adjusting indices.
+    Monthly index of each search term from its latest monthly request.
 
-    Parameters:
-        gt_monthly (DataFrame): Monthly Google Trends data.
-        gt_weekly (DataFrame): Weekly Google Trends data.
-        gt_daily (DataFrame): Daily Google Trends data.
     Returns:
-        DataFrame: gt_adjusted DataFrame with adjusted indices.
+        DataFrame: search_term, month_start and idx_of_month.
     """
-    idx_of_month = gt_monthly.copy()
-    idx_of_month['params_date_range'] = idx_of_month['pytrends_params'].str.extract(
-        r'"(\d{4}-\d{2}-\d{2} \d{4}-\d{2}-\d{2})"'
-    )[0]
+    # The latest request of a search term is the one reaching the latest month
+    monthly = gt_monthly.assign(
+        last_start=gt_monthly.groupby(['search_term', 'pytrends_params'])['start_date']
+        .transform('max')
+    )
+    monthly = monthly.sort_values(['last_start', 'request_datetime'], na_position='first',
+                                  kind='stable')
+    latest = monthly.drop_duplicates('search_term', keep='last')[['search_term', 'pytrends_params']]
+    monthly = monthly.merge(latest, on=['search_term', 'pytrends_params'])
+    monthly = monthly.drop_duplicates(['search_term', 'start_date'], keep='last')
 
-    idx_of_month = idx_of_month.loc[
-        idx_of_month['params_date_range']==max(idx_of_month['params_date_range'])
-    ]
-    idx_of_month = idx_of_month.rename(columns={'start_date':'month_start','index':'idx_of_month'})
-    idx_of_month = idx_of_month[['month_start','idx_of_month','search_term']]
-    idx_of_month = idx_of_month.drop_duplicates(subset=['month_start', 'search_term'], keep='first')
-
-    # there are duplicate start_date/search_term rows because weeks can be spread across different
-    # years - smart way to adjust this would be weighted average based on days of week in each year
-    # just keeping the first row for now, come back to this later
-    idx_of_week = gt_weekly.drop_duplicates(subset=['start_date', 'search_term'], keep='first')
-    idx_of_week = idx_of_week[['start_date','index','search_term']]
-    idx_of_week = idx_of_week.rename(columns={'start_date':'week_start_sun','index':'idx_of_week'})
-
-    # Daily
-    idx_of_day_nas = gt_daily.loc[gt_daily['request_datetime'].isna()]
-    idx_of_day_nas = idx_of_day_nas.loc[~idx_of_day_nas['isPartial']]
-
-    idx_of_day = gt_daily.loc[~gt_daily['request_datetime'].isna()]
-    idx_of_day = idx_of_day.loc[
-        idx_of_day.groupby(['date', 'search_term'])['request_datetime'].idxmax()
-    ]
-    idx_of_day = pd.concat([idx_of_day_nas, idx_of_day], ignore_index=True)
-    idx_of_day = idx_of_day.loc[~idx_of_day['isPartial']] # exclude partial data (last day)
-
-    # Drop duplicates where one row has a request_datetime and the other is missing request_datetime
-    idx_of_day = idx_of_day.sort_values(by='request_datetime', na_position='last')
-    idx_of_day = idx_of_day.drop_duplicates(
-        subset=['date', 'isPartial', 'search_term', 'pytrends_params'],
-        keep='first'
+    idx_of_month = monthly.rename(columns={'start_date':'month_start', 'index':'idx_of_month'})
+    return idx_of_month[['search_term', 'month_start', 'idx_of_month']].reset_index(drop=True)
+
+def week_index(gt_weekly) -> pd.DataFrame:
+    """
+    Weekly index of each search term from the one year requests.
+
+    A week that spans two years is in the requests of both years, with a value relative to each
+    year's peak. Its index is the average of the two weighted by the number of days of the week
+    in each year. Of repeated requests of a year (the current year) the latest is used.
+
+    Returns:
+        DataFrame: search_term, week_start_sun and idx_of_week.
+    """
+    # A one year request returns weeks from the one holding 1 Jan to the one holding 31 Dec, so
+    # its year is the year of its last week
+    weekly = gt_weekly.assign(
+        request_year=gt_weekly.groupby('pytrends_params')['start_date'].transform('max').dt.year
     )
-    idx_of_day['day_of_week'] = idx_of_day['date'].dt.day_name()
-    idx_of_day['week_start_sun'] = idx_of_day["date"].dt.to_period("W-SAT").dt.start_time
-    idx_of_day['month_start'] = idx_of_day["date"] - MonthBegin(1)
+    weekly = weekly.sort_values('request_datetime', na_position='first', kind='stable')
+    weekly = weekly.drop_duplicates(['search_term', 'request_year', 'start_date'], keep='last')
+
+    year_start = pd.to_datetime(pd.DataFrame({'year': weekly['request_year'], 'month': 1,
+                                              'day': 1}))
+    year_end = year_start + pd.offsets.YearEnd(0)
+    week_end = weekly['start_date'] + pd.Timedelta(days=6)
+    days_in_year = ((week_end.where(week_end < year_end, year_end)
+                     - weekly['start_date'].where(weekly['start_date'] > year_start, year_start))
+                    .dt.days + 1).clip(lower=0)
+
+    weekly = weekly.assign(days=days_in_year,
+                           weighted=weekly['index'].astype(float)*days_in_year)
+    sums = weekly.groupby(['search_term', 'start_date'], as_index=False)[['weighted', 'days']].sum()
+    sums['idx_of_week'] = sums['weighted'] / sums['days'].where(sums['days'] > 0)
+
+    idx_of_week = sums.rename(columns={'start_date':'week_start_sun'})
+    return idx_of_week[['search_term', 'week_start_sun', 'idx_of_week']]
+
+def day_index(gt_daily) -> pd.DataFrame:
+    """
+    Daily index of each search term: the latest complete (not partial) value of each day.
 
-    # Adjusted
-    gt_adjusted = idx_of_day.merge(idx_of_week, how='left', on=['week_start_sun','search_term'])
-    gt_adjusted = gt_adjusted.merge(idx_of_month, how='left', on=['month_start','search_term'])
+    Returns:
+        DataFrame: date, search_term, index and request_datetime, with the week_start_sun and
+            month_start keys.
+    """
+    idx_of_day = gt_daily.loc[~gt_daily['isPartial'].astype(bool)]
+    idx_of_day = idx_of_day.sort_values('request_datetime', na_position='first', kind='stable')
+    idx_of_day = idx_of_day.drop_duplicates(['search_term', 'date'], keep='last')
 
-    gt_adjusted['index'] = gt_adjusted['index']*gt_adjusted['idx_of_week']/100
-    gt_adjusted['index'] = gt_adjusted['index']*gt_adjusted['idx_of_month']/100
+    idx_of_day = idx_of_day[['date', 'search_term', 'index', 'request_datetime']].copy()
+    idx_of_day['week_start_sun'] = _week_start_sun(idx_of_day['date'])
+    idx_of_day['month_start'] = _month_start(idx_of_day['date'])
+    return idx_of_day
+
+def _month_start(dates) -> pd.Series:
+    """
+    First day of the month of each date.
+    """
+    return pd.Series(dates.to_numpy().astype('datetime64[M]').astype(dates.dtype),
+                     index=dates.index)
+
+def _week_start_sun(dates) -> pd.Series:
+    """
+    Sunday starting the (Sunday to Saturday) week of each date.
+    """
+    return dates - pd.to_timedelta((dates.dt.dayofweek + 1) % 7, unit='D')
 
-    gt_adjusted = gt_adjusted[['date','day_of_week','search_term','index']]
+def _in_blocks(search_terms, month_starts, blocks) -> np.ndarray:
+    """
+    Whether each (search_term, month_start) pair is one of the blocks.
+    """
+    pairs = pd.MultiIndex.from_arrays([search_terms, month_starts])
+    return pairs.isin(pd.MultiIndex.from_frame(blocks[['search_term', 'month_start']]))
 
-    return gt_adjusted
+def _changed_keys(new, old, keys, value) -> pd.DataFrame:
+    """
+    Keys whose value differs between two tables (or that are only in one of them).
+    """
+    both = new.merge(old, on=keys, how='outer', suffixes=('', '_old'), indicator=True)
+    same = (both[value] == both[value+'_old']) | (both[value].isna() & both[value+'_old'].isna())
+    return both.loc[(both['_merge'] != 'both') | ~same, keys]
 
-def custom_retry(kw, pytrends, df_list, no_resp_list, rep_count):
+def _affected_blocks(idx_of_week, idx_of_month, gt_daily, previous) -> pd.DataFrame:
+    """
+    (search_term, month_start) blocks of a previous gt_adjusted that have to be recomputed:
+    months whose monthly index changed, months holding a day of a week whose weekly index
+    changed, and months with daily rows requested since the previous run.
     """
-    Custom retry function to handle exceptions and retry the request.
+    old_month = previous[['search_term', 'month_start', 'idx_of_month']].drop_duplicates(
+        ['search_term', 'month_start'])
+    months = _changed_keys(idx_of_month, old_month, ['search_term', 'month_start'],
+                           'idx_of_month')
+
+    old_week = previous[['search_term', 'week_start_sun', 'idx_of_week']].drop_duplicates(
+        ['search_term', 'week_start_sun'])
+    weeks = _changed_keys(idx_of_week, old_week, ['search_term', 'week_start_sun'],
+                          'idx_of_week')
+    week_months = [
+        weeks.assign(month_start=_month_start(weeks['week_start_sun'] + pd.Timedelta(days=offset)))
+        for offset in (0, 6)
+    ]
 
-    Parameters::
-        kw (str): Keyword to search for.
-        pytrends (TrendReq): Pytrends object.
-        df_list (list): List to store DataFrames.
-        no_resp_list (list): List to store failed requests.
-        rep_count (int): Number of retry attempts.
-    """
-    for attempt in range(rep_count):
-        try:
-            resp_df = pytrends.interest_over_time()
-            if resp_df.empty:
-                no_resp_list.append(str(pytrends.token_payload))
-            else:
-                resp_df = resp_df.reset_index()
-                resp_df = resp_df.rename(columns={kw:'index'})
-                resp_df['search_term'] = kw
-                resp_df['pytrends_params'] = str(pytrends.token_payload)
-                resp_df['request_datetime'] = datetime.now()
-                df_list.append(resp_df)
-
-            logging.info("Success!")
-            break
-        except requests.exceptions.RequestException as e:
-            logging.error('RequestException: %s',e)
-            if attempt<(rep_count-1):
-                logging.error('Sleeping for 71s and then trying attempt %d...',attempt+2)
-                time.sleep(71)
-        except ResponseError as e:
-            logging.error("ResponseError: %s", e)
-            if attempt<(rep_count-1):
-                logging.error('Sleeping for 71s and then trying attempt %d...',attempt+2)
-                time.sleep(71)
-
-def review_past_requests(my_kws, params_return_empty_df, gt_weekly, gt_daily) -> tuple:
-    """
-    Review past requests to determine which data needs to be fetched.
-
-    Builds year ranges to pull weekly data and week ranges to pull daily data. Checks if the
-    data for the keyword and year or keyword and week already exists, avoiding redundant
-    requests. Google Trends returns weekly data when a full year is requested and daily data
-    when one week is requested.
+    new_daily = gt_daily.loc[gt_daily['request_datetime'] > previous['request_datetime'].max()]
+    daily_months = new_daily[['search_term']].assign(month_start=_month_start(new_daily['date']))
 
-    Parameters:
-        my_kws (set): Set of keywords to search for.
-        params_return_empty_df (list): List of parameters that returned empty data frames.
-        gt_weekly (DataFrame): DataFrame containing raw weekly Google Trends data.
-        gt_daily (DataFrame): DataFrame containing raw daily Google Trends data.
+    blocks = pd.concat([months] + [w[['search_term', 'month_start']] for w in week_months]
+                       + [daily_months])
+    return blocks.drop_duplicates(ignore_index=True)
 
-    Returns:
-        tuple: Contains dictionaries for year ranges to do, week ranges to do, and parameters
-            that returned empty data frames.
+def clean_up(gt_monthly, gt_weekly, gt_daily, previous=None) -> pd.DataFrame:
     """
-    # Build year ranges to pull weekly data
-    years = list(range(2004, datetime.now().year+1))
-    year_ranges = [(f'{year}-01-01 {year}-12-31') for year in years]
+    Clean up Google Trends data: scale the daily index by the weekly and monthly indices.
 
-    logging.info('Since 2004 there are %d year ranges', len(year_ranges))
-    kw_yrc = {}
-    kw_yrtd = {}
-    for kw in my_kws:
-        kw_data = gt_weekly.loc[gt_weekly['search_term']==kw]
+    With a previous gt_adjusted, only the (search_term, month) blocks affected by new raw data
+    are recomputed (see _affected_blocks), the other rows are kept as they are.
 
-        year_ranges_completed = kw_data['pytrends_params'].str.extract(
-            r'"(\d{4}-\d{2}-\d{2} \d{4}-\d{2}-\d{2})"'
-        )[0]
-        year_ranges_completed = list(set(year_ranges_completed))
+    Parameters:
+        gt_monthly (DataFrame): Monthly Google Trends data.
+        gt_weekly (DataFrame): Weekly Google Trends data.
+        gt_daily (DataFrame): Daily Google Trends data.
+        previous (DataFrame, optional): gt_adjusted of the previous run.
+    Returns:
+        DataFrame: gt_adjusted DataFrame with adjusted indices.
+    """
+    idx_of_month = month_index(gt_monthly)
+    idx_of_week = week_index(gt_weekly)
+
+    keep = None
+    if previous is not None and len(previous) > 0 and 'idx_of_week' in previous.columns:
+        # Same datetime resolution as the raw data (the store may read it back differently)
+        previous = previous.astype({'date': gt_daily['date'].dtype,
+                                    'week_start_sun': gt_daily['date'].dtype,
+                                    'month_start': gt_daily['date'].dtype,
+                                    'request_datetime': gt_daily['request_datetime'].dtype})
+        blocks = _affected_blocks(idx_of_week, idx_of_month, gt_daily, previous)
+        logging.info('Recomputing %d (search_term, month) blocks', len(blocks))
+
+        keep = previous.loc[~_in_blocks(previous['search_term'], previous['month_start'], blocks)]
+        gt_daily = gt_daily.loc[
+            _in_blocks(gt_daily['search_term'], _month_start(gt_daily['date']), blocks)
+        ]
 
-        # Remove the current year - new weeks in current year may have occurred
-        current_year_date_range = f"{datetime.now().year}-01-01 {datetime.now().year}-12-31"
-        year_ranges_completed = [x for x in year_ranges_completed if x != current_year_date_range]
+    gt_adjusted = day_index(gt_daily)
+    gt_adjusted = gt_adjusted.merge(idx_of_week, how='left', on=['week_start_sun','search_term'])
+    gt_adjusted = gt_adjusted.merge(idx_of_month, how='left', on=['month_start','search_term'])
 
-        kw_yrc[kw] = year_ranges_completed
-        logging.info('Already have %d year ranges for "%s"', len(kw_yrc[kw]), kw)
+    gt_adjusted['index'] = gt_adjusted['index']*gt_adjusted['idx_of_week']/100
+    gt_adjusted['index'] = gt_adjusted['index']*gt_adjusted['idx_of_month']/100
+    gt_adjusted['day_of_week'] = gt_adjusted['date'].dt.day_name()
+
+    gt_adjusted = gt_adjusted[['date','day_of_week','search_term','index','week_start_sun',
+                               'month_start','idx_of_week','idx_of_month','request_datetime']]
+    if keep is not None:
+        gt_adjusted = pd.concat([keep, gt_adjusted])
 
-        year_ranges_to_do = [x for x in year_ranges if x not in kw_yrc[kw]]
-        year_ranges_to_do.sort()
+    return gt_adjusted.sort_values(['date', 'search_term'], ignore_index=True)
 
-        kw_yrtd[kw] = year_ranges_to_do
-        logging.info('Need to get %d year ranges for "%s"', len(year_ranges_to_do), kw)
+def year_ranges() -> list:
+    """
+    One year timeframes since 2004 (Google Trends returns weekly data for a year).
+    """
+    return [f'{year}-01-01 {year}-12-31' for year in range(2004, datetime.now().year+1)]
 
-    print('-----------------------------------------------------------------------------')
-    # Build week ranges to pull daily data
-    week_ranges = []
+def week_ranges() -> list:
+    """
+    One week (Sunday to Saturday) timeframes since 2004 (Google Trends returns daily data for a
+    week).
+    """
+    ranges = []
     current = datetime.strptime("2003-12-28", "%Y-%m-%d")
     while current <= datetime.today():
         week_start = current
         week_end = current + timedelta(days=6)
-        week_ranges.append(f"{week_start.strftime('%Y-%m-%d')} {week_end.strftime('%Y-%m-%d')}")
+        ranges.append(f"{week_start.strftime('%Y-%m-%d')} {week_end.strftime('%Y-%m-%d')}")
         current += timedelta(weeks=1)
+    return ranges
 
-    params_return_empty_df_dict ={}
-    for kw in my_kws:
-        extracted_dates = [
-            re.search(r'"(\d{4}-\d{2}-\d{2} \d{4}-\d{2}-\d{2})"', s)
-            for s in params_return_empty_df
-            if kw in s
-        ]
-        params_return_empty_df_dict[kw] = [match.group(1) for match in extracted_dates]
+def timeframes(kind) -> list:
+    """
+    Timeframes to request for a kind of job.
+    """
+    if kind == 'monthly':
+        return [f'2004-01-01 {datetime.now().strftime("%Y-%m-%d")}']
+    if kind == 'weekly':
+        return year_ranges()
+    return week_ranges()
 
-    logging.info('Since 2004 there are %d week ranges', len(week_ranges))
-    kw_wrc = {}
-    kw_wrtd = {}
-    for kw in my_kws:
-        kw_data = gt_daily.loc[gt_daily['search_term']==kw]
+def is_partial(df, timeframe, requested=None) -> bool:
+    """
+    Whether the rows of a request are incomplete and should be requested again: Google Trends
+    marked them partial, or the timeframe had not ended when they were requested.
+    """
+    requested = requested or datetime.now()
+    timeframe_end = timeframe.split(' ')[1]
+    return bool(df['isPartial'].any()) or timeframe_end >= requested.strftime("%Y-%m-%d")
 
-        # Exclude partial data (we want to request again to finish incomplete weeks)
+def seed_queue(queue, gt_weekly, gt_daily, params_return_empty_df):
+    """
+    Record the requests behind the existing weekly and daily data (and the daily requests that
+    returned empty data frames) in a new queue, so they are not requested again.
 
-        # Can't just exclude the isPartial==True rows,
-        # the week range is still in another row where isPartial==False
+    Parameters:
+        queue (JobQueue): Empty job queue.
+        gt_weekly (DataFrame): Raw weekly Google Trends data.
+        gt_daily (DataFrame): Raw daily Google Trends data.
+        params_return_empty_df (list): Parameters that returned empty data frames.
+    """
+    for kind, raw in [('weekly', gt_weekly), ('daily', gt_daily)]:
+        partial = raw.groupby(['search_term', 'pytrends_params'])['isPartial'].any()
+        jobs = []
+        for (kw, payload), any_partial in partial.items():
+            timeframe = gt_queue.parse_payload(payload)[1]
+            done = not any_partial and timeframe.split(' ')[1] < datetime.now().strftime("%Y-%m-%d")
+            jobs.append((kw, timeframe, 'done' if done else 'partial', payload))
+        queue.set_states(kind, jobs)
+        logging.info('Recorded %d past %s requests', len(jobs), kind)
+
+    queue.set_states('daily', [
+        (*gt_queue.parse_payload(payload), 'empty', payload) for payload in params_return_empty_df
+    ])
+
+def fetch_job(pytrends, kind, kw, timeframe) -> tuple:
+    """
+    Request the interest over time of a keyword for a timeframe.
 
-        # So, lets get a list of pytrends_params where isPartial==True
-        ptp_partial_t = kw_data.loc[kw_data['isPartial'],'pytrends_params'].unique()
+    Parameters:
+        pytrends (TrendReq): Pytrends object.
+        kind (str): 'monthly', 'weekly' or 'daily'.
+        kw (str): Keyword to search for.
+        timeframe (str): Timeframe ('YYYY-MM-DD YYYY-MM-DD').
 
-        # Now lets go back and exclude rows where pytrends_params is one of these values
-        kw_data = kw_data.loc[~kw_data['pytrends_params'].isin(ptp_partial_t)]
+    Returns:
+        DataFrame: Rows in the layout of the kind's dataset (empty if there is no data).
+        str: Parameters of the request.
+    """
+    pytrends.build_payload([kw], cat=0, timeframe=timeframe, geo="US")
+    payload = str(pytrends.token_payload)
 
-        week_ranges_completed = kw_data['pytrends_params'].str.extract(
-            r'"(\d{4}-\d{2}-\d{2} \d{4}-\d{2}-\d{2})"'
-        )[0]
-        week_ranges_completed = list(set(week_ranges_completed))
+    df = pytrends.interest_over_time()
+    if df.empty:
+        return df, payload
 
-        kw_wrc[kw] = week_ranges_completed
-        logging.info('Already have %d week ranges for "%s"', len(kw_wrc[kw]), kw)
+    df = df.reset_index()
+    if kind == 'daily':
+        df = df.rename(columns={kw:'index'})
+    else:
+        df = df.rename(columns={'date':'start_date', kw:'index'})
+        if kind == 'monthly':
+            df['end_date'] = df['start_date'] + MonthEnd(0)
+        else:
+            df['end_date'] = df['start_date'] + pd.Timedelta(days=6)
+    df['search_term'] = kw
+    df['pytrends_params'] = payload
+    df['request_datetime'] = datetime.now()
 
-        week_ranges_to_do = [x for x in week_ranges if x not in kw_wrc[kw]]
-        week_ranges_to_do.sort()
+    return df, payload
 
-        kw_wrtd[kw] = week_ranges_to_do
-        logging.info('Need to get %d week ranges for "%s"', len(week_ranges_to_do), kw)
+def is_rate_limited(e) -> bool:
+    """
+    Whether a pytrends/requests exception is a 429 (too many requests) response.
+    """
+    response = getattr(e, 'response', None)
+    return getattr(response, 'status_code', None) == 429 or '429' in str(e)
 
-        if params_return_empty_df_dict[kw]:
-            logging.info(
-                'But %d params returned empty data frames, so just need %d week ranges for "%s"',
-                len(params_return_empty_df_dict[kw]),
-                len(week_ranges_to_do)-len(params_return_empty_df_dict[kw]),
-                kw
-            )
-    return kw_yrtd, kw_wrtd, params_return_empty_df_dict
+def run_jobs(queue, kind, bucket, workers=GT_WORKERS, max_attempts=MAX_ATTEMPTS):
+    """
+    Work through the pending jobs of a kind on a few worker threads until none is left.
 
+    Requests are paced by an adaptive token bucket: a 429 response halves the request rate and
+    pauses every worker for a cool down, and successful responses bring the rate back up. A
+    failed job goes back to the queue until it has failed max_attempts times.
 
-def main():
+    Parameters:
+        queue (JobQueue): Job queue.
+        kind (str): 'monthly', 'weekly' or 'daily'.
+        bucket (AdaptiveTokenBucket): Rate limiter shared by the workers.
+        workers (int): Number of worker threads (each with its own pytrends session).
+        max_attempts (int): Attempts per job before it is marked failed.
     """
-    Main function to download Google Trends data
+    def work():
+        pytrends = TrendReq()
+        while True:
+            job = queue.claim(kind)
+            if job is None:
+                return
+            kw, timeframe = job
+
+            bucket.acquire()
+            try:
+                df, payload = fetch_job(pytrends, kind, kw, timeframe)
+            except (requests.exceptions.RequestException, ResponseError) as e:
+                if is_rate_limited(e):
+                    cooldown = bucket.throttled()
+                    logging.error('%s "%s" rate limited, cooling down for %.0fs (rate %.3f/s)',
+                                  timeframe, kw, cooldown, bucket.rate)
+                else:
+                    logging.error('%s "%s" %s: %s', timeframe, kw, type(e).__name__, e)
+                state = queue.retry(kind, kw, timeframe, e, max_attempts)
+                if state == 'failed':
+                    logging.error('%s "%s" failed %d times, giving up for this run',
+                                  timeframe, kw, max_attempts)
+                continue
+
+            bucket.succeeded()
+            queue.complete(kind, kw, timeframe, df, payload)
+            logging.info('%s "%s" %d rows', timeframe, kw, len(df))
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for future in [executor.submit(work) for _ in range(workers)]:
+            future.result()
+
+def store_results(queue, kind, raw) -> pd.DataFrame:
     """
-    gt_monthly_raw, gt_weekly_raw, gt_daily_raw, params_return_empty_df_raw = load_existing_data()
+    Add the fetched rows of a kind to its dataset (CSV and store) and mark their jobs stored.
 
-    pytrends = TrendReq(retries=8, backoff_factor=2)
+    Parameters:
+        queue (JobQueue): Job queue.
+        kind (str): 'monthly', 'weekly' or 'daily'.
+        raw (DataFrame): Existing data of the kind.
 
-    past_weekly_requests = set(gt_weekly_raw['pytrends_params'])
+    Returns:
+        DataFrame: The updated data.
+    """
+    results = queue.fetched_results(kind)
+    if not results:
+        return raw
+
+    # (an empty raw frame has object columns, leave it out so the dates stay datetimes)
+    combined = pd.concat([raw][:len(raw) > 0]+[df for _, df in results])
+    combined = combined.drop_duplicates()
 
-    # Exclude partial data (we want to request again to finish incomplete weeks)
+    combined.to_csv(f'gt_{kind}_{datetime.today().strftime("%Y%m%d")}.csv', index=False)
+    # request_datetime is a string in rows reloaded from CSV and a datetime in new rows
+    combined['request_datetime'] = pd.to_datetime(combined['request_datetime'], format='ISO8601')
+    data_store.write_dataset(f'gt_{kind}', combined)
 
-    # Can't just exclude the isPartial==True rows,
-    # the week range is still in another row where isPartial==False
+    queue.mark_stored(kind, {
+        (kw, timeframe): is_partial(df, timeframe, df['request_datetime'].min())
+        for (kw, timeframe), df in results
+    })
+    return combined
 
-    # So, lets get a list of pytrends_params where isPartial==True
-    ptp_partial_t = gt_daily_raw.loc[gt_daily_raw['isPartial'],'pytrends_params'].unique()
 
-    # Now lets go back and exclude rows where pytrends_params is one of these values
-    gt_daily_raw_adj = gt_daily_raw.loc[~gt_daily_raw['pytrends_params'].isin(ptp_partial_t)]
+def main():
+    """
+    Main function to download Google Trends data
+    """
+    gt_monthly_raw, gt_weekly_raw, gt_daily_raw, params_return_empty_df_raw = load_existing_data()
 
-    past_daily_requests = set(list(gt_daily_raw_adj['pytrends_params'])+params_return_empty_df_raw) # params_return_empty_df_raw only in daily for now
+    queue = gt_queue.JobQueue()
+    if len(queue) == 0:
+        seed_queue(queue, gt_weekly_raw, gt_daily_raw, params_return_empty_df_raw)
 
     if new_keyword:
         my_kws = set(list(gt_daily_raw['search_term'].unique())+[new_keyword])
@@ -303,127 +464,33 @@ def main():
             )
             return
 
-    # Maybe I can remove duplicate logic if replace gt_daily_raw with gt_daily_raw_adj here
-    kw_yrtd, kw_wrtd, params_return_empty_df_dict = review_past_requests(
-        my_kws, params_return_empty_df_raw, gt_weekly_raw, gt_daily_raw
-    )
-
-    # Get the interest index by month since 2004
-    dat = []
-    for kw in my_kws:
-        try:
-            pytrends.build_payload(
-                [kw],
-                cat=0,
-                timeframe=f'2004-01-01 {datetime.now().strftime("%Y-%m-%d")}',
-                geo="US"
-            )
-            df = pytrends.interest_over_time()
-            df = df.reset_index()
-            df = df.rename(columns={'date':'start_date', kw:'index'})
-            df['end_date'] = df['start_date'] + MonthEnd(0)
-            df['search_term'] = kw
-            df['pytrends_params'] = str(pytrends.token_payload)
-            df['request_datetime'] = datetime.now()
-
-            dat.append(df)
-
-        except requests.exceptions.RequestException as e:
-            logging.error("RequestException: %s", e)
-        except ResponseError as e:
-            logging.error("ResponseError: %s", e)
+    bucket = fetch_utils.AdaptiveTokenBucket(GT_RATE, cooldown=GT_COOLDOWN)
 
-    if dat:
-        gt_monthly_new = pd.concat(dat)
+    # Interest index by month since 2004, then by week for each year, then by day for each week
+    for kind, raw in [('monthly', gt_monthly_raw), ('weekly', gt_weekly_raw),
+                      ('daily', gt_daily_raw)]:
+        for kw in sorted(my_kws):
+            n_pending = queue.add_jobs(kind, kw, timeframes(kind))
+            logging.info('Need to get %d %s timeframes for "%s"', n_pending, kind, kw)
 
-        gt_monthly = pd.concat([gt_monthly_raw,gt_monthly_new])
-        gt_monthly = gt_monthly.drop_duplicates()
+        run_jobs(queue, kind, bucket, workers=workers)
+        store_results(queue, kind, raw)
+        logging.info('%s jobs: %s', kind, queue.counts(kind))
 
-        gt_monthly.to_csv(f'gt_monthly_{datetime.today().strftime("%Y%m%d")}.csv', index=False)
-
-    # Get the interest index by week for each year for the selected keywords
-    # past_weekly_requests_ncy (not current year)
-    current_year_date_range = f"{datetime.now().year}-01-01 {datetime.now().year}-12-31"
-    past_weekly_requests_ncy = [x for x in past_weekly_requests if current_year_date_range not in x]
-    dat = []
-    for kw in my_kws:
-        for one_year_timeframe in kw_yrtd[kw]:
-            try:
-                pytrends.build_payload([kw], cat=0, timeframe=one_year_timeframe, geo="US")
-
-                if str(pytrends.token_payload) not in past_weekly_requests_ncy:
-                    weekly_us = pytrends.interest_over_time()
-                    weekly_us = weekly_us.reset_index()
-                    weekly_us = weekly_us.rename(columns={'date':'start_date', kw:'index'})
-                    weekly_us['end_date'] = weekly_us['start_date'] + pd.Timedelta(days=6)
-                    weekly_us['search_term'] = kw
-                    weekly_us['pytrends_params'] = str(pytrends.token_payload)
-                    weekly_us['request_datetime'] = datetime.now()
-
-                    dat.append(weekly_us)
-                time.sleep(1)
-
-            except requests.exceptions.RequestException as e:
-                logging.error("RequestException: %s", e)
-                break # if it fails for one year, it will continue to fail
-            except ResponseError as e:
-                logging.error("ResponseError: %s", e)
-                break
-    if dat:
-        gt_weekly_new = pd.concat(dat)
-
-        gt_weekly = pd.concat([gt_weekly_raw,gt_weekly_new])
-        gt_weekly = gt_weekly.drop_duplicates()
-
-        gt_weekly.to_csv(f'gt_weekly_{datetime.today().strftime("%Y%m%d")}.csv', index=False)
-
-    # Get the interest index by day for each week for the selected keyword
-    params_return_empty_df_new = []
-    dat = []
-    for kw in my_kws:
-        for one_week_timeframe in kw_wrtd[kw]:
-            try:
-                if one_week_timeframe in params_return_empty_df_dict[kw]:
-                    continue
-
-                pytrends.build_payload([kw], cat=0, timeframe=one_week_timeframe, geo="US")
-                logging.info('%s "%s" Payload built successfully', one_week_timeframe, kw)
-
-                if str(pytrends.token_payload) not in past_daily_requests:
-                    logging.info("This week is new, gathering interest_over_time...")
-
-                    custom_retry(kw, pytrends, dat, params_return_empty_df_new, 3)
-
-                time.sleep(2)
-
-            except requests.exceptions.RequestException as e:
-                logging.error("RequestException: %s", e) # no break here, worth trying again
-            except ResponseError as e:
-                logging.error("ResponseError: %s", e)
-
-    if dat:
-        gt_daily_new = pd.concat(dat)
-
-        gt_daily = pd.concat([gt_daily_raw,gt_daily_new])
-        gt_daily = gt_daily.drop_duplicates()
-
-        gt_daily.to_csv(f'gt_daily_{datetime.today().strftime("%Y%m%d")}.csv', index=False)
-
-    if params_return_empty_df_new:
-        params_return_empty_df = params_return_empty_df_raw+params_return_empty_df_new
-        with open(
-            f"params_return_empty_df_{datetime.today().strftime("%Y%m%d")}.txt",
-            "w",
-            encoding="utf-8"
-        ) as f:
-            f.writelines(f"{item}\n" for item in params_return_empty_df)
+    queue.close()
 
     # Clean up (refresh "raw" files first) to ensure the latest data is used for the cleanup process
     gt_monthly_refreshed, gt_weekly_refreshed, gt_daily_refreshed, _ = load_existing_data()
 
-    gt_adjusted_raw = clean_up(gt_monthly_refreshed, gt_weekly_refreshed, gt_daily_refreshed)
+    gt_adjusted_previous = None
+    if data_store.dataset_version('gt_adjusted') is not None:
+        gt_adjusted_previous = data_store.read_dataset('gt_adjusted')
+
+    gt_adjusted_raw = clean_up(gt_monthly_refreshed, gt_weekly_refreshed, gt_daily_refreshed,
+                               gt_adjusted_previous)
 
     gt_adjusted_raw.to_csv(f'gt_adjusted_{datetime.today().strftime("%Y%m%d")}.csv', index=False)
+    data_store.write_dataset('gt_adjusted', gt_adjusted_raw)
 
 if __name__ == "__main__":
     main()
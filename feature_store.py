@@ -0,0 +1,261 @@
+"""Persistent store of prep_data outputs, keyed by ticker, configuration and input data"""
+
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import weakref
+from dataclasses import asdict
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+import data_store
+import prep_data
+
+FEATURE_STORE_DIR = 'feature_store'
+ENTRY_FILE = 'entry.json'
+
+# Datasets prep_data reads (in the order load_data returns them)
+FEATURE_INPUTS = ['stocks_df', 'wiki_pageviews', 'ffr', 'weather_df', 'gt_adjusted']
+# Inputs with a ticker column (only the ticker and SPY matter with drop_tickers)
+TICKER_INPUTS = ['stocks_df', 'wiki_pageviews']
+
+stats = {'hits': 0, 'misses': 0, 'stale': 0}
+# Hashes of the frames seen by frames_token: id -> (weak reference, tickers, hash). Frames are
+# not modified after load_data
+_frame_hashes = {}
+FRAME_HASHES_SIZE = 16
+
+
+def feature_key(config, drop_tickers=None, wide=False, engine=False) -> str:
+    """
+    Hash of everything besides the input data that changes prep_data's output.
+
+    Parameters:
+        config (IndicatorConfig): Indicator configuration (ticker included).
+        drop_tickers (bool): Whether other tickers are dropped.
+        wide (bool): Whether the features come from the (float32) wide matrix cache.
+        engine (bool): Whether the indicators come from an IndicatorEngine (float64 prefix
+            sums, which differ from pandas' rolling calculations in the last digits).
+    """
+    settings = {'config': asdict(config), 'drop_tickers': bool(drop_tickers), 'wide': wide}
+    if engine:
+        settings['engine'] = True
+    return hashlib.sha1(json.dumps(settings, sort_keys=True).encode()).hexdigest()[:16]
+
+def input_tokens(ticker, drop_tickers=None, data_root=data_store.STORE_DIR) -> dict:
+    """
+    Token of each input dataset (see data_store.dataset_token), restricted to the ticker and
+    SPY with drop_tickers. Datasets that are only CSV snapshots use the snapshot file name.
+    """
+    tickers = sorted({ticker, 'SPY'}) if drop_tickers else None
+    csv_versions = prep_data.input_versions(FEATURE_INPUTS)
+
+    tokens = {}
+    for name in FEATURE_INPUTS:
+        token = data_store.dataset_token(name, tickers if name in TICKER_INPUTS else None,
+                                         root=data_root)
+        tokens[name] = token if token is not None else csv_versions[name]
+    return tokens
+
+def frame_hash(frame, tickers=None) -> str:
+    """
+    Hash of the columns and values of a frame (only the rows of some tickers if given),
+    memoized per frame object.
+    """
+    cached = _frame_hashes.get(id(frame))
+    if cached is not None and cached[0]() is frame and cached[1] == tickers:
+        return cached[2]
+
+    rows = frame
+    if tickers is not None and 'ticker' in frame.columns:
+        rows = frame.loc[frame['ticker'].isin(tickers)]
+    key = hashlib.sha1(repr(list(map(str, frame.columns))).encode())
+    key.update(pd.util.hash_pandas_object(rows, index=False).to_numpy().tobytes())
+    digest = key.hexdigest()[:16]
+
+    if len(_frame_hashes) >= FRAME_HASHES_SIZE:
+        del _frame_hashes[next(iter(_frame_hashes))]
+    _frame_hashes[id(frame)] = (weakref.ref(frame), tickers, digest)
+    return digest
+
+def frames_token(frames, ticker=None, drop_tickers=None) -> str:
+    """
+    Hash of the loaded frames' contents (restricted to the ticker and SPY with drop_tickers):
+    entries built from other data (e.g. load_data(start=) or a rewritten file) do not match.
+    """
+    tickers = sorted({ticker, 'SPY'}) if drop_tickers else None
+    return json.dumps([
+        frame_hash(frame, tickers if name in TICKER_INPUTS else None)
+        for name, frame in zip(FEATURE_INPUTS, frames)
+    ])
+
+def _entry_dir(ticker, key, root) -> str:
+    return os.path.join(root, ticker, key)
+
+def _dtype_entry(dtype):
+    """
+    JSON form of a column dtype (categories included for categoricals).
+    """
+    if isinstance(dtype, pd.CategoricalDtype):
+        return {'categories': dtype.categories.tolist(), 'ordered': bool(dtype.ordered)}
+    return str(dtype)
+
+def _restore_dtype(values, dtype):
+    """
+    Column of the dtype it was saved from: numpy columns load as they were saved, while
+    categorical, string and timezone-aware columns are saved as numpy objects.
+    """
+    if isinstance(dtype, dict):
+        return pd.Categorical(values, categories=dtype['categories'], ordered=dtype['ordered'])
+    if str(values.dtype) == dtype:
+        return values
+    return pd.array(values, dtype=pd.api.types.pandas_dtype(dtype))
+
+def save_features(prepd_data, ticker, key, tokens, drop_tickers=None, root=FEATURE_STORE_DIR):
+    """
+    Save a prep_data output as one .npy file per column (written to a private temporary
+    directory and renamed, so readers never see half an entry and concurrent writers of the
+    same entry do not touch each other's files). An entry another writer already saved with
+    the same tokens is kept as is.
+    """
+    entry_dir = _entry_dir(ticker, key, root)
+    os.makedirs(os.path.dirname(entry_dir), exist_ok=True)
+    tmp_dir = tempfile.mkdtemp(prefix=key+'.', suffix='.tmp', dir=os.path.dirname(entry_dir))
+    stale_dir = tmp_dir + '.stale'
+    try:
+        columns = list(prepd_data.columns)
+        for i, col in enumerate(columns):
+            values = prepd_data[col].to_numpy()
+            np.save(os.path.join(tmp_dir, f'{i}.npy'), values,
+                    allow_pickle=values.dtype == object)
+
+        with open(os.path.join(tmp_dir, ENTRY_FILE), "w", encoding="utf-8") as f:
+            json.dump({'ticker': ticker, 'key': key, 'drop_tickers': bool(drop_tickers),
+                       'tokens': tokens, 'columns': columns,
+                       'dtypes': [_dtype_entry(prepd_data[col].dtype) for col in columns],
+                       'created': datetime.now().isoformat()}, f, indent=1)
+
+        entry = read_entry(ticker, key, root)
+        if entry is not None and entry['tokens'] == tokens:
+            return
+        if entry is not None:
+            # Move the stale entry aside (another writer may have moved it already)
+            try:
+                os.replace(entry_dir, stale_dir)
+            except OSError:
+                pass
+
+        try:
+            os.replace(tmp_dir, entry_dir)
+        except OSError:
+            # Another writer saved the entry in between
+            if read_entry(ticker, key, root) is None:
+                raise
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        shutil.rmtree(stale_dir, ignore_errors=True)
+
+def read_entry(ticker, key, root=FEATURE_STORE_DIR):
+    """
+    Metadata of an entry ({'tokens', 'columns', ...}), or None if there is no such entry.
+    """
+    path = os.path.join(_entry_dir(ticker, key, root), ENTRY_FILE)
+    if not os.path.isfile(path):
+        return None
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+def load_features(ticker, key, root=FEATURE_STORE_DIR) -> pd.DataFrame:
+    """
+    Open an entry as a DataFrame whose columns are copy-on-write memory maps of the column
+    files: nothing is read until it is used, and writes stay in memory. Columns get back the
+    dtypes they were saved with.
+    """
+    entry_dir = _entry_dir(ticker, key, root)
+    entry = read_entry(ticker, key, root)
+    columns = entry['columns']
+    # Entries saved before the dtypes were recorded load with the numpy dtypes
+    dtypes = entry.get('dtypes', [None] * len(columns))
+
+    data = {}
+    for i, (col, dtype) in enumerate(zip(columns, dtypes)):
+        path = os.path.join(entry_dir, f'{i}.npy')
+        try:
+            data[col] = np.load(path, mmap_mode='c').view(np.ndarray)
+        except ValueError: # object columns can not be memory-mapped
+            data[col] = np.load(path, allow_pickle=True)
+        if dtype is not None:
+            data[col] = _restore_dtype(data[col], dtype)
+
+    return pd.DataFrame(data, columns=columns, copy=False)
+
+def get_features(frames, config, drop_tickers=None, root=FEATURE_STORE_DIR,
+                 data_root=data_store.STORE_DIR, **prep_kwargs) -> pd.DataFrame:
+    """
+    prep_data output for a ticker, from the store if its inputs have not changed since it was
+    saved, otherwise computed and saved.
+
+    Parameters:
+        frames (tuple): (stocks_df, wiki_pageviews, ffr, weather, gt_adjusted), as returned by
+            prep_data.load_data.
+        config (IndicatorConfig): Indicator configuration (ticker included).
+        drop_tickers (bool): Whether to drop other tickers.
+        root (str): Feature store directory.
+        data_root (str): Data store directory.
+        **prep_kwargs: wide and engine, passed on to prep_data.
+
+    Returns:
+        DataFrame: prepd_data (memory-mapped on a hit).
+    """
+    key = feature_key(config, drop_tickers, prep_kwargs.get('wide') is not None,
+                      prep_kwargs.get('engine') is not None)
+    tokens = input_tokens(config.ticker, drop_tickers, data_root)
+    tokens['frames'] = frames_token(frames, config.ticker, drop_tickers)
+
+    entry = read_entry(config.ticker, key, root)
+    if entry is not None and entry['tokens'] == tokens:
+        stats['hits'] += 1
+        return load_features(config.ticker, key, root)
+    stats['stale' if entry is not None else 'misses'] += 1
+
+    prepd_data = prep_data.prep_data(*frames, config=config, drop_tickers=drop_tickers,
+                                     **prep_kwargs)
+    save_features(prepd_data, config.ticker, key, tokens, drop_tickers, root)
+
+    return prepd_data
+
+def invalidate(root=FEATURE_STORE_DIR, data_root=data_store.STORE_DIR) -> list:
+    """
+    Delete the entries whose input data changed since they were saved.
+
+    Returns:
+        list: (ticker, key, changed inputs) of each entry deleted.
+    """
+    if not os.path.isdir(root):
+        return []
+
+    current = {}
+    removed = []
+    for ticker in sorted(os.listdir(root)):
+        for key in sorted(os.listdir(os.path.join(root, ticker))):
+            if key.endswith(('.tmp', '.stale')): # being written by save_features
+                continue
+            entry = read_entry(ticker, key, root)
+            if entry is None:
+                continue
+
+            drop_tickers = entry['drop_tickers']
+            if (ticker, drop_tickers) not in current:
+                current[ticker, drop_tickers] = input_tokens(ticker, drop_tickers, data_root)
+            tokens = current[ticker, drop_tickers]
+
+            changed = [name for name in FEATURE_INPUTS if entry['tokens'].get(name) != tokens[name]]
+            if changed:
+                shutil.rmtree(_entry_dir(ticker, key, root))
+                removed.append((ticker, key, changed))
+
+    return removed
@@ -0,0 +1,264 @@
+"""Rate limited, concurrent fetching with retries, and a local server replaying recorded responses"""
+
+import json
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# HTTP statuses worth retrying: rate limited or a (temporary) server error
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+
+class TokenBucket:
+    """
+    Token bucket rate limiter shared by every worker thread.
+
+    Tokens are added at rate per second up to capacity, and each request takes one, so requests
+    can burst up to capacity and average at most rate per second.
+    """
+    def __init__(self, rate, capacity=1):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        """
+        Wait for a token and take it.
+        """
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+class AdaptiveTokenBucket(TokenBucket):
+    """
+    Token bucket that slows down when the server rate limits (429) and speeds back up slowly.
+
+    Every throttled() call halves the rate and makes all workers wait a cool down that doubles
+    with each consecutive throttle. Every succeeded() call adds increase to the rate, up to
+    max_rate (additive increase, multiplicative decrease).
+    """
+    def __init__(self, rate, capacity=1, min_rate=None, max_rate=None, increase=None,
+                 cooldown=60.0, max_cooldown=900.0):
+        super().__init__(rate, capacity)
+        self.min_rate = min_rate if min_rate is not None else rate / 64
+        self.max_rate = max_rate if max_rate is not None else rate
+        self.increase = increase if increase is not None else rate / 20
+        self.cooldown = cooldown
+        self.max_cooldown = max_cooldown
+        self.strikes = 0
+
+    def throttled(self) -> float:
+        """
+        Record a rate limited response.
+
+        Returns:
+            float: Cool down (seconds) before the next request.
+        """
+        with self.lock:
+            cooldown = min(self.max_cooldown, self.cooldown * 2 ** self.strikes)
+            self.strikes += 1
+            self.rate = max(self.min_rate, self.rate / 2)
+            # Negative tokens: acquire waits for the cool down before the next token
+            self.tokens = min(self.tokens, 0) - cooldown * self.rate
+            return cooldown
+
+    def succeeded(self):
+        """
+        Record a successful response.
+        """
+        with self.lock:
+            self.strikes = 0
+            self.rate = min(self.max_rate, self.rate + self.increase)
+
+
+class RetryableStatus(Exception):
+    """
+    Response with a status in RETRY_STATUSES
+    """
+
+def check_retryable(status_code, url):
+    """
+    Raise RetryableStatus if a response status is worth retrying (pass it in retry_on).
+    """
+    if status_code in RETRY_STATUSES:
+        raise RetryableStatus(f"{status_code} for {url}")
+
+
+def backoff_delay(attempt, base_delay=1.0, max_delay=60.0) -> float:
+    """
+    Delay before retry number attempt (0 based): exponential backoff with full jitter.
+    """
+    return random.uniform(0, min(max_delay, base_delay * 2 ** attempt))
+
+def retry(func, *args, attempts=4, base_delay=1.0, max_delay=60.0, retry_on=(Exception,),
+          **kwargs):
+    """
+    Call func(*args, **kwargs), retrying with jittered exponential backoff.
+
+    Parameters:
+        func: Function to call.
+        attempts (int): Maximum number of calls.
+        base_delay (float): Backoff before the first retry (seconds, before jitter).
+        max_delay (float): Longest backoff (seconds).
+        retry_on (tuple): Exception types that are retried (others are raised at once).
+
+    Returns:
+        The result of func.
+    """
+    for attempt in range(attempts):
+        try:
+            return func(*args, **kwargs)
+        except retry_on:
+            if attempt == attempts - 1:
+                raise
+            time.sleep(backoff_delay(attempt, base_delay, max_delay))
+
+def fetch_all(func, items, max_workers=4, bucket=None, attempts=4, base_delay=1.0,
+              max_delay=60.0, retry_on=(Exception,)) -> tuple:
+    """
+    Call func(item) for every item on a bounded thread pool, rate limited and with retries.
+
+    Parameters:
+        func: Function of one item.
+        items (iterable): Items to fetch (hashable).
+        max_workers (int): Maximum number of concurrent calls.
+        bucket (TokenBucket, optional): Rate limiter taken before every call (retries included).
+        attempts (int): Maximum number of calls per item.
+        base_delay (float): Backoff before the first retry (seconds, before jitter).
+        max_delay (float): Longest backoff (seconds).
+        retry_on (tuple): Exception types that are retried.
+
+    Returns:
+        dict: Result of each item that succeeded.
+        dict: Exception of each item that failed every attempt.
+    """
+    def call(item):
+        if bucket is not None:
+            bucket.acquire()
+        return func(item)
+
+    def run(item):
+        try:
+            return item, retry(call, item, attempts=attempts, base_delay=base_delay,
+                               max_delay=max_delay, retry_on=retry_on), None
+        except Exception as e: # pylint: disable=broad-exception-caught
+            return item, None, e
+
+    results = {}
+    failures = {}
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        for item, result, error in executor.map(run, items):
+            if error is None:
+                results[item] = result
+            else:
+                failures[item] = error
+
+    return results, failures
+
+
+class ReplayServer:
+    """
+    Local HTTP server that replays recorded responses, for testing the downloaders offline.
+
+    Recordings map "METHOD /path?query" to a list of responses ({'status', 'headers', 'body'},
+    body being a string or JSON data), which are served in order and the last one repeated, so a
+    rate limit or server error followed by a success can be replayed. Unrecorded requests get a
+    404. Point a downloader's base URL at server.url to use it:
+
+        with ReplayServer.from_file('recordings.json') as server:
+            download_data.WIKI_BASE_URL = server.url + '/wiki/'
+            ...
+            server.requests  # every request received, in order
+
+    yfinance cannot be pointed at it (its hosts are fixed), so the yfinance downloaders are
+    tested with download_data.yf replaced by a client of the server.
+    """
+    def __init__(self, recordings):
+        self.recordings = {key: list(responses) for key, responses in recordings.items()}
+        self.requests = []
+        self._served = {}
+        self._lock = threading.Lock()
+        self._server = None
+        self._thread = None
+        self.url = None
+
+    @classmethod
+    def from_file(cls, path):
+        """
+        Load recordings from a JSON file.
+        """
+        with open(path, "r", encoding="utf-8") as f:
+            return cls(json.load(f))
+
+    def _next_response(self, key) -> dict:
+        """
+        Next recorded response for a request (404 if there is none).
+        """
+        with self._lock:
+            self.requests.append(key)
+            responses = self.recordings.get(key)
+            if not responses:
+                return {'status': 404, 'body': f"No recording for {key}"}
+            served = self._served.get(key, 0)
+            self._served[key] = served + 1
+            return responses[min(served, len(responses) - 1)]
+
+    def start(self):
+        """
+        Start serving on a free local port.
+        """
+        replay = self
+
+        class Handler(BaseHTTPRequestHandler):
+            """Serve the next recorded response for each request"""
+            def _replay(self):
+                response = replay._next_response(f"{self.command} {self.path}")
+                body = response.get('body', '')
+                if not isinstance(body, str):
+                    body = json.dumps(body)
+                body = body.encode('utf-8')
+
+                self.send_response(response.get('status', 200))
+                for name, value in response.get('headers', {}).items():
+                    self.send_header(name, value)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            do_GET = _replay
+            do_POST = _replay
+
+            def log_message(self, format, *args): # pylint: disable=redefined-builtin
+                pass
+
+        self._server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.url = f"http://127.0.0.1:{self._server.server_address[1]}"
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        """
+        Stop serving.
+        """
+        self._server.shutdown()
+        self._server.server_close()
+        self._thread.join()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
@@ -0,0 +1,232 @@
+"""Persistent queue (SQLite) of Google Trends requests, for resumable downloads"""
+
+import ast
+import json
+import pickle
+import sqlite3
+import threading
+from datetime import datetime
+
+QUEUE_DB = 'gt_queue.sqlite'
+
+# pending: to request, running: claimed by a worker, fetched: rows in the queue, not yet in the
+# dataset, done: rows in the dataset, partial: rows in the dataset but incomplete (requested
+# again), empty: Google Trends returned no data, failed: gave up after max_attempts
+STATES = ('pending', 'running', 'fetched', 'done', 'partial', 'empty', 'failed')
+
+# States re-queued by add_jobs(..., requeue=True)
+REQUEUE_STATES = ('partial', 'failed')
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    kind TEXT NOT NULL,
+    keyword TEXT NOT NULL,
+    timeframe TEXT NOT NULL,
+    state TEXT NOT NULL DEFAULT 'pending',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    error TEXT,
+    payload TEXT,
+    result BLOB,
+    updated TEXT,
+    PRIMARY KEY (kind, keyword, timeframe)
+);
+CREATE INDEX IF NOT EXISTS jobs_kind_state ON jobs (kind, state);
+"""
+
+
+def parse_payload(payload) -> tuple:
+    """
+    Keyword and timeframe of a request from its str(pytrends.token_payload).
+    """
+    req = json.loads(ast.literal_eval(payload)['req'])
+    item = req['comparisonItem'][0]
+    return item['keyword'], item['time']
+
+
+class JobQueue:
+    """
+    Google Trends requests (kind, keyword, timeframe) and their state, in a SQLite database.
+
+    Every state change is committed at once, so a run that crashes or is stopped can be started
+    again: jobs left running are put back to pending, and fetched rows not yet written to the
+    dataset are still in the queue (see fetched_results). The primary key on (kind, keyword,
+    timeframe) is the "already requested" lookup. Safe to share between threads.
+    """
+    def __init__(self, path=QUEUE_DB):
+        self.path = path
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        with self.lock, self.conn:
+            self.conn.executescript(_SCHEMA)
+            # Jobs a previous run was working on when it stopped
+            self.conn.execute(
+                "UPDATE jobs SET state='pending' WHERE state='running'"
+            )
+
+    def close(self):
+        """
+        Close the database.
+        """
+        self.conn.close()
+
+    def __len__(self):
+        with self.lock:
+            return self.conn.execute("SELECT COUNT(*) FROM jobs").fetchone()[0]
+
+    def add_jobs(self, kind, keyword, timeframes, requeue=True) -> int:
+        """
+        Add jobs that are not in the queue yet.
+
+        Parameters:
+            kind (str): 'monthly', 'weekly' or 'daily'.
+            keyword (str): Search term.
+            timeframes (iterable): Timeframes ('YYYY-MM-DD YYYY-MM-DD').
+            requeue (bool): Also put jobs of these timeframes in REQUEUE_STATES back to
+                pending (with their attempts reset).
+
+        Returns:
+            int: Number of jobs that are now pending.
+        """
+        now = datetime.now().isoformat()
+        rows = [(kind, keyword, timeframe, now) for timeframe in timeframes]
+        with self.lock, self.conn:
+            self.conn.executemany(
+                "INSERT OR IGNORE INTO jobs (kind, keyword, timeframe, updated) "
+                "VALUES (?, ?, ?, ?)", rows
+            )
+            if requeue:
+                placeholders = ', '.join('?' * len(REQUEUE_STATES))
+                self.conn.executemany(
+                    "UPDATE jobs SET state='pending', attempts=0, error=NULL, updated=? "
+                    f"WHERE kind=? AND keyword=? AND timeframe=? AND state IN ({placeholders})",
+                    [(now, kind, keyword, timeframe, *REQUEUE_STATES)
+                     for _, _, timeframe, _ in rows]
+                )
+            return self.conn.execute(
+                "SELECT COUNT(*) FROM jobs WHERE kind=? AND keyword=? AND state='pending'",
+                (kind, keyword)
+            ).fetchone()[0]
+
+    def set_states(self, kind, jobs):
+        """
+        Add or overwrite jobs with given states (e.g. to record requests made before the queue
+        existed).
+
+        Parameters:
+            kind (str): Job kind.
+            jobs (list): (keyword, timeframe, state, payload) tuples.
+        """
+        now = datetime.now().isoformat()
+        with self.lock, self.conn:
+            self.conn.executemany(
+                "INSERT INTO jobs (kind, keyword, timeframe, state, payload, updated) "
+                "VALUES (?, ?, ?, ?, ?, ?) ON CONFLICT (kind, keyword, timeframe) DO UPDATE SET "
+                "state=excluded.state, payload=excluded.payload, updated=excluded.updated",
+                [(kind, keyword, timeframe, state, payload, now)
+                 for keyword, timeframe, state, payload in jobs]
+            )
+
+    def state(self, kind, keyword, timeframe):
+        """
+        State of a job, or None if it is not in the queue.
+        """
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT state FROM jobs WHERE kind=? AND keyword=? AND timeframe=?",
+                (kind, keyword, timeframe)
+            ).fetchone()
+        return row[0] if row else None
+
+    def claim(self, kind):
+        """
+        Take the next pending job of a kind (it becomes running), or None if there is none.
+
+        Returns:
+            tuple: (keyword, timeframe)
+        """
+        with self.lock, self.conn:
+            row = self.conn.execute(
+                "SELECT keyword, timeframe FROM jobs WHERE kind=? AND state='pending' "
+                "ORDER BY keyword, timeframe LIMIT 1", (kind,)
+            ).fetchone()
+            if row is not None:
+                self.conn.execute(
+                    "UPDATE jobs SET state='running', updated=? "
+                    "WHERE kind=? AND keyword=? AND timeframe=?",
+                    (datetime.now().isoformat(), kind, *row)
+                )
+        return row
+
+    def complete(self, kind, keyword, timeframe, result, payload=None):
+        """
+        Store the rows fetched for a job (fetched), or mark it empty if result is empty.
+        """
+        empty = result is None or len(result) == 0
+        with self.lock, self.conn:
+            self.conn.execute(
+                "UPDATE jobs SET state=?, attempts=attempts+1, error=NULL, payload=?, result=?, "
+                "updated=? WHERE kind=? AND keyword=? AND timeframe=?",
+                ('empty' if empty else 'fetched', payload, None if empty else pickle.dumps(result),
+                 datetime.now().isoformat(), kind, keyword, timeframe)
+            )
+
+    def retry(self, kind, keyword, timeframe, error, max_attempts=5) -> str:
+        """
+        Record a failed attempt: the job goes back to pending, or to failed after max_attempts.
+
+        Returns:
+            str: The new state.
+        """
+        with self.lock, self.conn:
+            attempts = self.conn.execute(
+                "SELECT attempts FROM jobs WHERE kind=? AND keyword=? AND timeframe=?",
+                (kind, keyword, timeframe)
+            ).fetchone()[0] + 1
+            state = 'failed' if attempts >= max_attempts else 'pending'
+            self.conn.execute(
+                "UPDATE jobs SET state=?, attempts=?, error=?, updated=? "
+                "WHERE kind=? AND keyword=? AND timeframe=?",
+                (state, attempts, str(error), datetime.now().isoformat(), kind, keyword, timeframe)
+            )
+        return state
+
+    def fetched_results(self, kind) -> list:
+        """
+        Rows of the fetched jobs of a kind, as ((keyword, timeframe), DataFrame) pairs.
+        """
+        with self.lock:
+            rows = self.conn.execute(
+                "SELECT keyword, timeframe, result FROM jobs WHERE kind=? AND state='fetched'",
+                (kind,)
+            ).fetchall()
+        return [((keyword, timeframe), pickle.loads(result)) for keyword, timeframe, result in rows]
+
+    def mark_stored(self, kind, jobs):
+        """
+        Mark fetched jobs as written to the dataset (done, or partial if they are in the
+        partial set) and drop their rows from the queue.
+
+        Parameters:
+            kind (str): Job kind.
+            jobs (dict): {(keyword, timeframe): partial (bool)}
+        """
+        now = datetime.now().isoformat()
+        with self.lock, self.conn:
+            self.conn.executemany(
+                "UPDATE jobs SET state=?, result=NULL, updated=? "
+                "WHERE kind=? AND keyword=? AND timeframe=? AND state='fetched'",
+                [('partial' if partial else 'done', now, kind, keyword, timeframe)
+                 for (keyword, timeframe), partial in jobs.items()]
+            )
+
+    def counts(self, kind=None) -> dict:
+        """
+        Number of jobs in each state (of one kind, or all).
+        """
+        query = "SELECT state, COUNT(*) FROM jobs"
+        params = ()
+        if kind is not None:
+            query += " WHERE kind=?"
+            params = (kind,)
+        with self.lock:
+            return dict(self.conn.execute(query + " GROUP BY state", params).fetchall())
@@ -0,0 +1,302 @@
+"""Hyperparameter search for the strat_* pipelines, with a persistent results cache"""
+
+import hashlib
+import os
+import pickle
+import time
+from datetime import datetime
+
+import numpy as np
+from sklearn.base import clone
+from sklearn.experimental import enable_halving_search_cv # pylint: disable=unused-import
+from sklearn.model_selection import (
+    TimeSeriesSplit, GridSearchCV, HalvingGridSearchCV, HalvingRandomSearchCV, ParameterGrid,
+    cross_val_score
+)
+
+# Estimator parameters that change how a fit runs but not its result
+_IGNORED_PARAMS = ('n_jobs', 'verbose', 'memory')
+
+# SearchConfig fields that change the result of a search
+_SEARCH_FIELDS = ('method', 'max_fits', 'time_budget', 'n_iter', 'random_state')
+
+HALVING_FACTOR = 3
+
+
+class TPESearchCV:
+    """
+    Tree-structured Parzen Estimator search over a discrete parameter grid.
+
+    Candidates are drawn at random for the first n_startup evaluations. After that the scored
+    candidates are split into good (top gamma) and bad, and the next candidate is the
+    unevaluated grid point with the highest ratio of good to bad density, each density being a
+    product of smoothed per-parameter frequencies. Scores are mean TimeSeriesSplit scores, as
+    in GridSearchCV. The search stops after n_iter candidates, max_fits fits or time_budget
+    seconds, whichever comes first.
+    """
+    def __init__(self, estimator, param_grid, cv=None, n_iter=30, max_fits=None,
+                 time_budget=None, n_startup=5, gamma=0.25, random_state=None, n_jobs=None):
+        self.estimator = estimator
+        self.param_grid = param_grid
+        self.cv = cv if cv is not None else TimeSeriesSplit()
+        self.n_iter = n_iter
+        self.max_fits = max_fits
+        self.time_budget = time_budget
+        self.n_startup = n_startup
+        self.gamma = gamma
+        self.random_state = random_state
+        self.n_jobs = n_jobs
+
+    def _suggest(self, candidates, evaluated, rng):
+        """
+        Index of the next candidate to evaluate.
+        """
+        remaining = [i for i in range(len(candidates)) if i not in evaluated]
+        if len(evaluated) < self.n_startup:
+            return remaining[rng.integers(len(remaining))]
+
+        ranked = sorted(evaluated, key=lambda i: evaluated[i], reverse=True)
+        n_good = max(1, int(np.ceil(self.gamma * len(ranked))))
+        good, bad = ranked[:n_good], ranked[n_good:]
+
+        names = sorted({name for candidate in candidates for name in candidate})
+        values = {name: {repr(c.get(name)) for c in candidates} for name in names}
+
+        def density(idx, name, value):
+            # Frequency of a parameter value in a group, with one pseudo count per value
+            count = sum(repr(candidates[i].get(name)) == value for i in idx)
+            return (count + 1) / (len(idx) + len(values[name]))
+
+        scores = np.empty(len(remaining))
+        for k, i in enumerate(remaining):
+            ratio = 0.0
+            for name in names:
+                value = repr(candidates[i].get(name))
+                ratio += np.log(density(good, name, value)) - np.log(density(bad, name, value))
+            scores[k] = ratio
+
+        best = np.flatnonzero(scores == scores.max())
+        return remaining[best[rng.integers(len(best))]]
+
+    def fit(self, X, y):
+        """
+        Run the search, then refit the best candidate on all of X.
+        """
+        candidates = list(ParameterGrid(self.param_grid))
+        rng = np.random.default_rng(self.random_state)
+        n_splits = self.cv.get_n_splits(X)
+
+        began = time.perf_counter()
+        evaluated = {}
+        self.n_fits_ = 0
+        while len(evaluated) < min(self.n_iter, len(candidates)):
+            if self.max_fits is not None and self.n_fits_ + n_splits > self.max_fits:
+                break
+            if self.time_budget is not None and time.perf_counter() - began > self.time_budget:
+                break
+
+            i = self._suggest(candidates, evaluated, rng)
+            scores = cross_val_score(clone(self.estimator).set_params(**candidates[i]), X, y,
+                                     cv=self.cv, n_jobs=self.n_jobs)
+            self.n_fits_ += n_splits
+            evaluated[i] = -np.inf if np.isnan(scores).any() else scores.mean()
+
+        if not evaluated:
+            raise ValueError("Search budget too small to evaluate a single candidate.")
+
+        best = max(evaluated, key=evaluated.get)
+        self.cv_results_ = {
+            'params': [candidates[i] for i in evaluated],
+            'mean_test_score': np.array(list(evaluated.values())),
+        }
+        self.best_params_ = candidates[best]
+        self.best_score_ = evaluated[best]
+        self.best_estimator_ = clone(self.estimator).set_params(**self.best_params_).fit(X, y)
+
+        return self
+
+
+def _tuned(params) -> dict:
+    """
+    Parameters without the ones that do not change the result of a fit (_IGNORED_PARAMS).
+    """
+    return {name: value for name, value in params.items() if not name.endswith(_IGNORED_PARAMS)}
+
+def _tuned_grid(param_grid):
+    """
+    Parameter grid without the parameters that do not change the result of a fit.
+    """
+    if isinstance(param_grid, dict):
+        return _tuned(param_grid)
+    return [_tuned(grid) for grid in param_grid]
+
+def _run_params(param_grid, best_params) -> dict:
+    """
+    Values the grid the best parameters were drawn from gives the ignored parameters in this
+    call (e.g. n_jobs set only for the solvers that use it).
+    """
+    for grid in [param_grid] if isinstance(param_grid, dict) else param_grid:
+        tuned = _tuned(grid)
+        if set(tuned) == set(best_params) and all(
+                best_params[name] in list(values) for name, values in tuned.items()):
+            return {name: values[0] for name, values in grid.items()
+                    if name.endswith(_IGNORED_PARAMS) and len(values) == 1}
+    return {}
+
+def search_key(pipeline, param_grid, X_train, y_train, config=None) -> str:
+    """
+    Fingerprint of a search: strategy (pipeline steps and fixed parameters), feature columns,
+    training window, parameter grid and search method, leaving out parameters in
+    _IGNORED_PARAMS.
+    """
+    key = hashlib.sha256()
+
+    key.update(repr([(name, type(step).__name__) for name, step in pipeline.steps]).encode())
+    fixed_params = sorted(
+        (name, repr(value)) for name, value in pipeline.get_params(deep=True).items()
+        if name != 'steps' and not hasattr(value, 'get_params')
+        and not name.endswith(_IGNORED_PARAMS)
+    )
+    key.update(repr(fixed_params).encode())
+
+    key.update(repr(list(X_train.columns)).encode())
+    key.update(np.ascontiguousarray(X_train.to_numpy(dtype=np.float64)).tobytes())
+    key.update(np.ascontiguousarray(np.asarray(y_train)).tobytes())
+
+    key.update(repr(_tuned_grid(param_grid)).encode())
+    key.update(repr([(name, getattr(config, name, None)) for name in _SEARCH_FIELDS]).encode())
+
+    return key.hexdigest()
+
+def load_cached_search(cache_dir, key):
+    """
+    Cached search record ({'best_params', 'best_score', ...}), or None on a miss.
+    """
+    path = os.path.join(cache_dir, key+'.pkl')
+    if not os.path.isfile(path):
+        return None
+    with open(path, "rb") as f:
+        return pickle.load(f)
+
+def save_cached_search(cache_dir, key, record):
+    """
+    Save a search record (written to a temporary file first so readers never see half of it).
+    """
+    os.makedirs(cache_dir, exist_ok=True)
+    path = os.path.join(cache_dir, key+'.pkl')
+    with open(path+'.tmp', "wb") as f:
+        pickle.dump(record, f)
+    os.replace(path+'.tmp', path)
+
+def make_search(pipeline, param_grid, n_splits, n_jobs=None, config=None):
+    """
+    Search object (sklearn search API) for the method of a SearchConfig.
+
+    'grid' is an exhaustive GridSearchCV. 'halving' is successive halving over the training
+    rows; with max_fits set, a random subset of the grid small enough for the budget is halved
+    instead. 'tpe' is TPESearchCV. All of them score with TimeSeriesSplit().
+
+    Parameters:
+        pipeline: Pipeline to tune.
+        param_grid (dict or list): Parameter grid.
+        n_splits (int): Number of TimeSeriesSplit folds.
+        n_jobs (int, optional): Number of parallel jobs.
+        config (SearchConfig, optional): Search configuration.
+    """
+    method = getattr(config, 'method', 'grid')
+    max_fits = getattr(config, 'max_fits', None)
+    random_state = getattr(config, 'random_state', None)
+    cv = TimeSeriesSplit(n_splits=n_splits)
+
+    if method == 'grid':
+        return GridSearchCV(pipeline, param_grid, cv=cv, n_jobs=n_jobs)
+
+    if method == 'halving':
+        if max_fits is None:
+            return HalvingGridSearchCV(pipeline, param_grid, cv=cv, factor=HALVING_FACTOR,
+                                       random_state=random_state, n_jobs=n_jobs)
+
+        # Halving fits about n_candidates * n_splits * factor / (factor - 1) times
+        n_candidates = max_fits * (HALVING_FACTOR - 1) // (HALVING_FACTOR * n_splits)
+        n_candidates = min(max(n_candidates, 1), len(ParameterGrid(param_grid)))
+        return HalvingRandomSearchCV(pipeline, param_grid, n_candidates=n_candidates, cv=cv,
+                                     factor=HALVING_FACTOR, random_state=random_state,
+                                     n_jobs=n_jobs)
+
+    if method == 'tpe':
+        return TPESearchCV(pipeline, param_grid, cv=cv, n_iter=config.n_iter, max_fits=max_fits,
+                           time_budget=config.time_budget, random_state=random_state,
+                           n_jobs=n_jobs)
+
+    raise ValueError(f"Unknown search method '{method}'.")
+
+def _n_fits(search, n_splits) -> int:
+    """
+    Number of model fits a finished search made (excluding the final refit).
+    """
+    if hasattr(search, 'n_fits_'):
+        return search.n_fits_
+    return len(search.cv_results_['params']) * n_splits
+
+def fit_search(pipeline, param_grid, X_train, y_train, n_jobs=None, config=None):
+    """
+    Find the best parameters for a pipeline with the search method of config (see make_search).
+
+    With config.cache_dir set, the best parameters are cached under a fingerprint of the
+    search (see search_key). A hit skips the search and returns the pipeline with the cached
+    parameters, unfitted (the walk-forward loop fits it on the same training window). Parameters
+    such as n_jobs are neither part of the fingerprint nor cached: a hit takes them from the
+    param_grid of the call.
+
+    Parameters:
+        pipeline: Pipeline to tune.
+        param_grid (dict or list): Parameter grid.
+        X_train (DataFrame): Training features.
+        y_train (Series): Training target.
+        n_jobs (int, optional): Number of parallel jobs for the search.
+        config (SearchConfig, optional): Search configuration (default: exhaustive grid).
+
+    Returns:
+        Pipeline with the best parameters.
+    """
+    cache_dir = getattr(config, 'cache_dir', None)
+    report = getattr(config, 'report', False)
+    method = getattr(config, 'method', 'grid')
+    strategy = type(pipeline.steps[-1][1]).__name__
+
+    key = None
+    if cache_dir is not None:
+        key = search_key(pipeline, param_grid, X_train, y_train, config)
+        record = load_cached_search(cache_dir, key)
+        if record is not None:
+            if report:
+                print(f"{strategy} {method} search: cached, best score "
+                      f"{record['best_score']:.4f}, {record['best_params']}")
+            best_params = {**record['best_params'],
+                           **_run_params(param_grid, record['best_params'])}
+            return clone(pipeline).set_params(**best_params)
+
+    n_splits = TimeSeriesSplit().get_n_splits()
+    search = make_search(pipeline, param_grid, n_splits, n_jobs, config)
+
+    began = time.perf_counter()
+    search.fit(X_train, y_train)
+    seconds = time.perf_counter() - began
+    n_fits = _n_fits(search, n_splits)
+
+    if report:
+        print(f"{strategy} {method} search: {n_fits} fits in {seconds:.1f}s, best score "
+              f"{search.best_score_:.4f}, {search.best_params_}")
+
+    if key is not None:
+        save_cached_search(cache_dir, key, {
+            'strategy': strategy,
+            'method': method,
+            'best_params': _tuned(search.best_params_),
+            'best_score': search.best_score_,
+            'n_fits': n_fits,
+            'seconds': seconds,
+            'created': datetime.now().isoformat(),
+        })
+
+    return search.best_estimator_
@@ -0,0 +1,299 @@
+"""PCA that shares its decompositions across strategies, search candidates and refits"""
+
+import hashlib
+import numbers
+import threading
+from collections import OrderedDict
+
+import numpy as np
+from scipy import linalg
+from sklearn.decomposition import PCA
+from sklearn.utils import check_array
+from sklearn.utils.extmath import svd_flip
+
+# Bytes of decompositions kept in memory per process (an entry holds the scores and components
+# of its input, and with incremental updates an n_features x n_features Gram matrix)
+CACHE_BYTES = 256 * 2**20
+# Rows of each cached input kept to recognise it as the start of a later input
+SAMPLE_ROWS = 256
+
+_cache = OrderedDict()
+_lock = threading.Lock()
+stats = {'hits': 0, 'updates': 0, 'misses': 0}
+
+
+def _fingerprint(X) -> str:
+    """
+    Hash of an input matrix (shape, dtype and values).
+    """
+    key = hashlib.sha1(repr((X.shape, X.dtype.str)).encode())
+    key.update(np.ascontiguousarray(X).tobytes())
+    return key.hexdigest()
+
+def clear_cache():
+    """
+    Drop every cached decomposition and reset the statistics.
+    """
+    with _lock:
+        _cache.clear()
+        for name in stats:
+            stats[name] = 0
+
+def _nbytes(entry) -> int:
+    """
+    Bytes held by the arrays of a cache entry.
+    """
+    return sum(value.nbytes for value in entry.values() if isinstance(value, np.ndarray))
+
+def _store(key, entry):
+    """
+    Add an entry to the cache, evicting the least recently used ones past CACHE_BYTES (an entry
+    larger than CACHE_BYTES is not cached).
+    """
+    size = _nbytes(entry)
+    if size > CACHE_BYTES:
+        return
+
+    with _lock:
+        _cache[key] = entry
+        _cache.move_to_end(key)
+        total = sum(_nbytes(cached) for cached in _cache.values())
+        while total > CACHE_BYTES:
+            _, evicted = _cache.popitem(last=False)
+            total -= _nbytes(evicted)
+
+def _sample_rows(X) -> np.ndarray:
+    """
+    Evenly spaced row positions kept to recognise X as the start of a later input.
+    """
+    return np.unique(np.linspace(0, X.shape[0] - 1, SAMPLE_ROWS).astype(int))
+
+def _entry(X, mean, scores, S, Vt, variance, ratio, gram=None, colsum=None) -> dict:
+    """
+    Cache entry of a full-rank decomposition of X (gram and colsum: moments that incremental
+    updates start from, None if not kept).
+    """
+    entry = {'n_samples': X.shape[0], 'mean': mean, 'scores': scores, 'S': S, 'Vt': Vt,
+             'variance': variance, 'ratio': ratio, 'gram': gram, 'colsum': colsum}
+    if gram is not None:
+        entry['rows'] = _sample_rows(X)
+        entry['sample'] = X[entry['rows']].copy()
+    return entry
+
+def _full_svd(X, moments=False) -> dict:
+    """
+    Decomposition of X from a full-rank PCA(svd_solver='full') fit, with the Gram matrix and
+    column sums if moments is True.
+    """
+    pca = PCA(svd_solver='full')
+    scores = pca.fit_transform(X)
+    gram, colsum = (X.T @ X, X.sum(axis=0)) if moments else (None, None)
+
+    return _entry(X, pca.mean_, scores, pca.singular_values_, pca.components_,
+                  pca.explained_variance_, pca.explained_variance_ratio_, gram, colsum)
+
+def _prefix_affine(entry, X):
+    """
+    Per-column scale a and shift b such that X[:n] == X_prev * a + b, where X_prev is the
+    cached input of n rows, or None if the first rows of X are not such a transform.
+
+    This is how the input of the PCA step changes between walk-forward refits: the scaler in
+    front of it is refitted on the longer window, which rescales and shifts every column. The
+    moments of X_prev come from its Gram matrix, and the transform is checked on the sampled
+    rows of X_prev.
+    """
+    n_prev = entry['n_samples']
+    if X.shape[0] <= n_prev or X.shape[1] != entry['sample'].shape[1]:
+        return None
+
+    # Quick rejection on the sampled rows alone, with the transform through their extremes
+    sample, sample_head = entry['sample'], X[entry['rows']]
+    lo, hi = sample.argmin(axis=0), sample.argmax(axis=0)
+    cols = np.arange(X.shape[1])
+    span = sample[hi, cols] - sample[lo, cols]
+    with np.errstate(invalid='ignore', divide='ignore'):
+        a_est = np.where(span > 0, (sample_head[hi, cols] - sample_head[lo, cols]) / span, 1.0)
+    b_est = sample_head[lo, cols] - a_est * sample[lo, cols]
+    if not np.allclose(sample_head, sample * a_est + b_est, rtol=1e-6, atol=1e-6):
+        return None
+
+    head = X[:n_prev]
+    mean_prev = entry['colsum'] / n_prev
+    std_prev = np.sqrt(np.clip(np.diag(entry['gram']) / n_prev - mean_prev**2, 0.0, None))
+    mean_head = head.mean(axis=0)
+    std_head = head.std(axis=0)
+
+    a = np.ones(X.shape[1])
+    varying = std_prev > 1e-12 * np.maximum(np.abs(mean_prev), 1.0)
+    a[varying] = std_head[varying] / std_prev[varying]
+    a *= np.where(((sample - mean_prev) * (sample_head - mean_head)).sum(axis=0) < 0, -1.0, 1.0)
+    b = mean_head - a * mean_prev
+
+    scale = max(np.abs(sample_head).max(), 1.0)
+    if not np.allclose(sample_head, sample * a + b, rtol=1e-9, atol=1e-9 * scale):
+        return None
+    return a, b
+
+def _update_svd(entry, X, a, b) -> dict:
+    """
+    Decomposition of X from a cached decomposition of its (affinely transformed) first rows.
+
+    The cached Gram matrix and column sums are transformed by the per-column scale and shift,
+    the new rows are added, and the covariance matrix (n_features x n_features) is
+    diagonalized. This costs one pass over the new rows instead of an SVD of the whole window.
+    The scores are not computed here (see scores).
+    """
+    n_prev = entry['n_samples']
+    gram, colsum = entry['gram'], entry['colsum']
+
+    # Gram matrix and column sums of X_prev * a + b
+    gram = (a[:, None] * gram * a[None, :] + np.outer(a * colsum, b) + np.outer(b, a * colsum)
+            + n_prev * np.outer(b, b))
+    colsum = a * colsum + n_prev * b
+
+    new_rows = X[n_prev:]
+    gram = gram + new_rows.T @ new_rows
+    colsum = colsum + new_rows.sum(axis=0)
+
+    n_samples = X.shape[0]
+    mean = colsum / n_samples
+    cov = (gram - n_samples * np.outer(mean, mean)) / (n_samples - 1)
+    eigenvals, eigenvecs = linalg.eigh(cov)
+    eigenvals = np.clip(eigenvals[::-1], 0.0, None)
+    _, Vt = svd_flip(None, eigenvecs[:, ::-1].T, u_based_decision=False)
+    S = np.sqrt(eigenvals * (n_samples - 1))
+    variance = eigenvals
+
+    return _entry(X, mean, None, S, Vt, variance, variance / variance.sum(), gram, colsum)
+
+def scores(svd, X, n_components) -> np.ndarray:
+    """
+    First n_components principal component scores of X (a new array).
+    """
+    if svd['scores'] is not None:
+        return svd['scores'][:, :n_components].copy(order='K')
+    return (X - svd['mean']) @ svd['Vt'][:n_components].T
+
+def decompose(X, incremental=False) -> dict:
+    """
+    Full-rank PCA decomposition of X, shared through the cache.
+
+    A repeated input (the same training window seen by another strategy or search candidate)
+    is served from the cache as is. Otherwise X gets a full-rank PCA(svd_solver='full') fit,
+    unless incremental is True and the first rows of X are an affine transform of a cached
+    input (the next walk-forward window): the decomposition is then updated from it, which
+    agrees with a fresh fit to about 1e-12 but not bit for bit.
+
+    Parameters:
+        X (ndarray): Input matrix (n_samples x n_features).
+        incremental (bool): Allow updates from a cached prefix of X.
+
+    Returns:
+        dict: mean, S, Vt, variance, ratio and scores (None for updates) of the decomposition
+            (do not modify, they are shared).
+    """
+    key = _fingerprint(X)
+    # Updated decompositions are kept under their own key, so exact fits never get one
+    keys = [key, key+':updated'] if incremental else [key]
+    with _lock:
+        for cached_key in keys:
+            entry = _cache.get(cached_key)
+            if entry is not None:
+                _cache.move_to_end(cached_key)
+                stats['hits'] += 1
+                return entry
+        candidates = [entry for entry in reversed(_cache.values())
+                      if entry['gram'] is not None] if incremental else []
+
+    for candidate in candidates:
+        affine = _prefix_affine(candidate, X)
+        if affine is not None:
+            entry = _update_svd(candidate, X, *affine)
+            stats['updates'] += 1
+            _store(key+':updated', entry)
+            return entry
+
+    entry = _full_svd(X, moments=incremental)
+    stats['misses'] += 1
+    _store(key, entry)
+    return entry
+
+
+class SharedPCA(PCA):
+    """
+    PCA(svd_solver='full') that truncates a full-rank fit shared through the cache (see
+    decompose).
+
+    Every n_components candidate of a grid search and every strategy fitted on the same
+    training window truncates the same fit, and the results are identical to PCA. With
+    incremental=True walk-forward refits update the decomposition of the previous window
+    instead of refitting it (close to, but not bit for bit, PCA). Whitening, other solvers and
+    'mle' n_components are fitted by PCA itself.
+    """
+    def __init__(self, n_components=None, *, copy=True, whiten=False, svd_solver='full',
+                 tol=0.0, iterated_power='auto', n_oversamples=10,
+                 power_iteration_normalizer='auto', random_state=None, incremental=False):
+        super().__init__(
+            n_components=n_components, copy=copy, whiten=whiten, svd_solver=svd_solver,
+            tol=tol, iterated_power=iterated_power, n_oversamples=n_oversamples,
+            power_iteration_normalizer=power_iteration_normalizer, random_state=random_state
+        )
+        self.incremental = incremental
+
+    def _shared_fit(self, X) -> tuple:
+        """
+        Fit from the cached decomposition of X.
+
+        Returns:
+            ndarray: X as an array, or None if this configuration is fitted by PCA itself.
+            dict: The decomposition.
+        """
+        if self.whiten or self.svd_solver != 'full' or hasattr(X, 'columns'):
+            return None, None
+
+        X = check_array(X, dtype=[np.float64, np.float32])
+        n_components = min(X.shape) if self.n_components is None else self.n_components
+        if isinstance(n_components, bool):
+            return None, None
+        fraction = isinstance(n_components, numbers.Real) and 0 < n_components < 1.0
+        if not fraction and (not isinstance(n_components, numbers.Integral)
+                             or not 0 < n_components <= min(X.shape)):
+            return None, None
+
+        svd = decompose(X, self.incremental)
+        if fraction:
+            # Fewest components explaining more than the fraction of variance, as PCA does
+            ratio_cumsum = np.cumsum(svd['ratio'])
+            n_components = int(np.searchsorted(ratio_cumsum, n_components, side='right') + 1)
+
+        self.n_features_in_ = X.shape[1]
+        self.n_samples_ = X.shape[0]
+        self.n_components_ = int(n_components)
+        # Copies keep the memory layout of PCA's, so transform runs the same BLAS calls
+        self.mean_ = svd['mean'].copy(order='K')
+        self.components_ = svd['Vt'][:n_components].copy(order='K')
+        self.explained_variance_ = svd['variance'][:n_components].copy(order='K')
+        self.explained_variance_ratio_ = svd['ratio'][:n_components].copy(order='K')
+        self.singular_values_ = svd['S'][:n_components].copy(order='K')
+        self.noise_variance_ = (np.mean(svd['variance'][n_components:])
+                                if n_components < min(X.shape) else 0.0)
+
+        return X, svd
+
+    def fit(self, X, y=None):
+        """
+        Fit the model on X (see PCA.fit).
+        """
+        X_array, _ = self._shared_fit(X)
+        if X_array is None:
+            return super().fit(X, y)
+        return self
+
+    def fit_transform(self, X, y=None):
+        """
+        Fit the model on X and return its scores (see PCA.fit_transform).
+        """
+        X_array, svd = self._shared_fit(X)
+        if X_array is None:
+            return super().fit_transform(X, y)
+        return scores(svd, X_array, self.n_components_)
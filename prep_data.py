@@ -1,7 +1,11 @@
 """This module builds prepd_data"""
 
 import glob
+import hashlib
+import json
 import os
+import shutil
+import tempfile
 from dataclasses import dataclass, field
 
 import numpy as np
@@ -10,6 +14,10 @@ import pytz
 from astral import LocationInfo
 from astral.sun import sun
 
+import data_store
+
+PRICE_COLUMNS = ['Open','High','Low','Close','Adj Close']
+
 
 @dataclass
 class MovingAverageConfig:
@@ -47,30 +55,158 @@ class IndicatorConfig:
     bollinger: BollingerConfig = field(default_factory=BollingerConfig)
     macd: MACDConfig = field(default_factory=MACDConfig)
 
+@dataclass
+class WideMatrix:
+    """
+    Memory-mapped wide (dates x ticker fields) float32 matrix built by build_wide_cache.
 
-def load_data():
+    Columns are grouped by ticker and stored column-major, so the columns of one ticker are a
+    contiguous block and slicing them does not copy.
+    """
+    values: np.ndarray
+    dates: np.ndarray
+    tickers: list
+    fields: list
+
+    def ticker_slice(self, ticker) -> slice:
+        """
+        Column slice of a ticker's fields.
+        """
+        start = self.tickers.index(ticker) * len(self.fields)
+        return slice(start, start + len(self.fields))
+
+    def columns(self, tickers) -> list:
+        """
+        Column names (e.g. Adj Close_SPY) of the tickers' fields.
+        """
+        return [f+"_"+t for t in tickers for f in self.fields]
+
+    def frame(self, tickers=None) -> pd.DataFrame:
+        """
+        Wide DataFrame for some (default all) tickers.
+
+        All tickers, or a single ticker, is a zero-copy view of the memory map. A subset of
+        several tickers is concatenated, and dropping the dates where none of the tickers have
+        data is a masked copy, so those frames are copies.
+        """
+        if tickers is None:
+            tickers = self.tickers
+            values = self.values
+        elif len(tickers) == 1:
+            values = self.values[:, self.ticker_slice(tickers[0])]
+        else:
+            values = np.concatenate(
+                [self.values[:, self.ticker_slice(t)] for t in tickers], axis=1
+            )
+
+        dates = self.dates
+        if len(tickers) < len(self.tickers):
+            has_data = ~np.isnan(values).all(axis=1)
+            if not has_data.all():
+                values = values[has_data]
+                dates = dates[has_data]
+
+        stocks_w = pd.DataFrame(values, columns=self.columns(tickers), copy=False)
+        stocks_w.insert(0, 'Date', pd.to_datetime(dates))
+
+        return stocks_w
+
+
+def load_latest_csv(prefix, parse_dates, columns=None):
     """
-    Load data from CSV files.
+    Load the most recently created {prefix}_YYYYMMDD.csv file.
     """
-    stocks_df_files = glob.glob('stocks_df_*.csv')
-    stocks_df_latest = max(stocks_df_files, key=os.path.getctime)
-    stocks_df_raw = pd.read_csv(stocks_df_latest, parse_dates=['Date'])
+    files = glob.glob(f'{prefix}_*.csv')
+    latest = max(files, key=os.path.getctime)
+    return pd.read_csv(latest, parse_dates=parse_dates, usecols=columns)
 
-    wiki_pageviews_files = glob.glob('wiki_pageviews_*.csv')
-    wiki_pageviews_latest = max(wiki_pageviews_files, key=os.path.getctime)
-    wiki_pageviews = pd.read_csv(wiki_pageviews_latest, parse_dates=['Date'])
+def load_dataset(name, csv_prefix, date_col, columns=None, tickers=None, start=None):
+    """
+    Load a dataset from the columnar store, falling back to the latest CSV snapshot.
 
-    ffr_files = glob.glob('ffr_*.csv')
-    ffr_latest = max(ffr_files, key=os.path.getctime)
-    ffr = pd.read_csv(ffr_latest, parse_dates=['Date'])
+    Parameters:
+        name (str): Dataset name in the store.
+        csv_prefix (str): Prefix of the CSV snapshots.
+        date_col (str): Date column.
+        columns (list, optional): Columns to load (default: all).
+        tickers (list, optional): Only load these tickers.
+        start (str, optional): First date to load.
 
-    weather_files = glob.glob('weather_*.csv')
-    weather_latest = max(weather_files, key=os.path.getctime)
-    weather = pd.read_csv(weather_latest, parse_dates=['date'])
+    Returns:
+        DataFrame: The dataset.
+    """
+    if data_store.dataset_version(name) is not None:
+        return data_store.read_dataset(name, columns=columns, tickers=tickers, start=start)
 
-    gt_adjusted_files = glob.glob('gt_adjusted_*.csv')
-    gt_adjusted_latest = max(gt_adjusted_files, key=os.path.getctime)
-    gt_adjusted = pd.read_csv(gt_adjusted_latest, parse_dates=['date'])
+    df = load_latest_csv(csv_prefix, parse_dates=[date_col], columns=columns)
+    if tickers is not None and 'ticker' in df.columns:
+        df = df.loc[df['ticker'].isin(tickers)].reset_index(drop=True)
+    if start is not None:
+        df = df.loc[df[date_col] >= start].reset_index(drop=True)
+    return df
+
+def input_versions(names) -> dict:
+    """
+    Version of each input dataset: the store version, or the latest CSV file name.
+
+    Parameters:
+        names (list): Dataset names in the store (CSV snapshots use the same prefix).
+
+    Returns:
+        dict: Dataset name to version.
+    """
+    versions = {}
+    for name in names:
+        versions[name] = data_store.dataset_version(name)
+        if versions[name] is None:
+            files = glob.glob(f'{name}_*.csv')
+            versions[name] = os.path.basename(max(files, key=os.path.getctime)) if files else None
+    return versions
+
+def compact_dtypes(df) -> pd.DataFrame:
+    """
+    Smaller dtypes for stocks_df or wiki_pageviews: float32 prices and views, integer volumes
+    (uint32 when they fit, float32 with missing values) and a categorical ticker.
+
+    Indicators computed from float32 prices carry float32 rounding, so a rule that compares
+    the price with an indicator can flip where the two are tied in float64 (e.g. VWAP on the
+    first day, where it equals the price).
+    """
+    dtypes = {col: np.float32 for col in PRICE_COLUMNS + ['views'] if col in df.columns}
+    if 'Volume' in df.columns:
+        volume = df['Volume']
+        if volume.isna().any():
+            dtypes['Volume'] = np.float32
+        else:
+            dtypes['Volume'] = np.uint32 if volume.max() < 2**32 else np.int64
+    if 'ticker' in df.columns:
+        dtypes['ticker'] = 'category'
+
+    return df.astype(dtypes)
+
+def load_data(tickers=None, columns=None, start=None, compact=False):
+    """
+    Load data from the columnar store (or the latest CSV files if the store is empty).
+
+    Parameters:
+        tickers (list, optional): Only load stock and pageview rows for these tickers (include
+            SPY, prep_data needs it).
+        columns (list, optional): stocks_df columns to load (default: all).
+        start (str, optional): First date to load.
+        compact (bool): Memory-efficient dtypes for stocks_df and wiki_pageviews (see
+            compact_dtypes), the wide frames built from them are then float32 too.
+    """
+    stocks_df_raw = load_dataset('stocks_df', 'stocks_df', 'Date',
+                                 columns=columns, tickers=tickers, start=start)
+    wiki_pageviews = load_dataset('wiki_pageviews', 'wiki_pageviews', 'Date',
+                                  tickers=tickers, start=start)
+    ffr = load_dataset('ffr', 'ffr', 'Date', start=start)
+    weather = load_dataset('weather_df', 'weather', 'date', start=start)
+    gt_adjusted = load_dataset('gt_adjusted', 'gt_adjusted', 'date', start=start)
+
+    if compact:
+        stocks_df_raw = compact_dtypes(stocks_df_raw)
+        wiki_pageviews = compact_dtypes(wiki_pageviews)
 
     return stocks_df_raw, wiki_pageviews, ffr, weather, gt_adjusted
 
@@ -170,17 +306,25 @@ def calculate_macd(data, short_period=12, long_period=26):
     macd_line = short_ema - long_ema
     return macd_line
 
-def calculate_technical_indicators(data, config: IndicatorConfig):
+def calculate_technical_indicators(data, config: IndicatorConfig, engine=None):
     """
     Calculate technical indicators for the dataset (uses wide functions).
 
     Parameters:
         data (DataFrame): Stock data with required columns.
         config (IndicatorConfig): Configuration object for technical indicators.
+        engine (IndicatorEngine, optional): Batched engine to take the indicators from, if it was
+            built over the same dates as data (rolling windows over other dates would differ).
 
     Returns:
         DataFrame: Original dataframe with technical indicators included 
     """
+    if engine is not None and np.array_equal(engine.dates, data['Date'].to_numpy()):
+        indicators_df = engine.frame(config, config.ticker).reindex(data['Date'])
+        for col in indicators_df.columns:
+            data[col] = indicators_df[col].to_numpy()
+        return data
+
     target_ticker = config.target+"_"+config.ticker
     data['RSI'] = calculate_rsi_wide(data, config.target, config.ticker, window=config.rsi_window)
     data['MA_S'] = data[target_ticker].rolling(window=config.moving_average.short_window).mean()
@@ -214,20 +358,13 @@ def gen_stocks_w(ticker, stocks_df, wiki_pageviews, drop_tickers=None):
         DataFrame: stocks_w dataframe
     """
 
-    stocks_df = stocks_df.copy()
-
-    tickers_list = stocks_df['ticker'].unique()
-    tickers_list = tickers_list[tickers_list != "SPY"]
-
-    drop_tickers_list = [x for x in tickers_list if x!= ticker]
-
     # Can drop other ticker columns for testing (so runs quicker)
     if drop_tickers:
-        stocks_df = stocks_df.loc[~stocks_df['ticker'].isin(drop_tickers_list)]
+        stocks_df = stocks_df.loc[stocks_df['ticker'].isin([ticker, 'SPY'])]
 
-
-    # Set up data frame for testing
-    stocks_df['movement'] = stocks_df.groupby('ticker')['Adj Close'].diff() * stocks_df['Volume']
+    # Set up data frame for testing (assign returns a new frame, the caller's is not modified)
+    movement = stocks_df.groupby('ticker', observed=True)['Adj Close'].diff() * stocks_df['Volume']
+    stocks_df = stocks_df.assign(movement=movement.astype(stocks_df['Adj Close'].dtype))
 
     stocks_df = stocks_df.merge(
         wiki_pageviews[['Date','ticker','views']],how='left', on=['Date','ticker']
@@ -243,36 +380,216 @@ def gen_stocks_w(ticker, stocks_df, wiki_pageviews, drop_tickers=None):
         index='Date', columns='ticker',
         values=['Open','High','Low','Close','Adj Close','Volume','movement','views']
     )
+    # Compact (float32) prices give a float32 wide frame (volumes with gaps would be float64)
+    if stocks_df['Adj Close'].dtype == np.float32:
+        stocks_w = stocks_w.astype(np.float32)
 
     stocks_w.columns = ['_'.join(col).strip() for col in stocks_w.columns.values]
     stocks_w = stocks_w.reset_index().rename_axis(None, axis=1)
 
     return stocks_w
 
+SUNLIGHT_CACHE_FILE = 'sunlight_nyc.csv'
+_sunlight_table = {}
+
+def sunlight_nyc(dates, cache_file=SUNLIGHT_CACHE_FILE) -> np.ndarray:
+    """
+    Seconds of sunlight (sunset - sunrise) in NYC for each date.
+
+    Looks dates up in a date-keyed table that is loaded from cache_file once per process.
+    astral is only called (once per date) for dates not in the table yet, and the table is
+    saved back to cache_file when it grows.
+
+    Parameters:
+        dates (Series): Dates.
+        cache_file (str): CSV file the lookup table is persisted to (None to not persist).
+
+    Returns:
+        ndarray: Seconds of sunlight for each date.
+    """
+    if cache_file not in _sunlight_table:
+        if cache_file is not None and os.path.isfile(cache_file):
+            table = pd.read_csv(cache_file, parse_dates=['Date'])
+            _sunlight_table[cache_file] = pd.Series(table['sunlight_nyc'].to_numpy(),
+                                                    index=pd.DatetimeIndex(table['Date']))
+        else:
+            _sunlight_table[cache_file] = pd.Series(dtype=float, index=pd.DatetimeIndex([]))
+
+    table = _sunlight_table[cache_file]
+
+    new_dates = pd.DatetimeIndex(dates.unique()).difference(table.index)
+    if len(new_dates) > 0:
+        nyc = LocationInfo("New York City", "USA", "America/New_York", 40.7128, -74.0060)
+        nyc_tz = pytz.timezone("America/New_York")
+
+        new_seconds = []
+        for d in new_dates:
+            sun_times = sun(nyc.observer, date=d, tzinfo=nyc_tz)
+            new_seconds.append((sun_times['sunset'] - sun_times['sunrise']).total_seconds())
+
+        table = pd.concat([table, pd.Series(new_seconds, index=new_dates)]).sort_index()
+        _sunlight_table[cache_file] = table
+
+        if cache_file is not None:
+            # Write a private temp file and rename it, so other processes never read a
+            # truncated cache
+            fd, tmp_file = tempfile.mkstemp(suffix='.tmp',
+                                            dir=os.path.dirname(os.path.abspath(cache_file)))
+            try:
+                with os.fdopen(fd, "w", encoding="utf-8", newline='') as f:
+                    table.rename('sunlight_nyc').rename_axis('Date').reset_index().to_csv(
+                        f, index=False
+                    )
+                os.replace(tmp_file, cache_file)
+            finally:
+                if os.path.exists(tmp_file):
+                    os.remove(tmp_file)
+
+    return table.reindex(pd.DatetimeIndex(dates)).to_numpy()
+
+WIDE_CACHE_DIR = 'wide_cache'
+WIDE_FIELDS = ['Open','High','Low','Close','Adj Close','Volume','movement','views']
+
+def frame_fingerprint(frame) -> dict:
+    """
+    Tickers, date range, row count and columns of a long (Date, ticker) frame.
+    """
+    dates = frame['Date']
+    return {
+        'tickers': sorted(map(str, frame['ticker'].dropna().unique())),
+        'dates': [str(dates.min()), str(dates.max())] if len(frame) else None,
+        'rows': len(frame),
+        'columns': list(map(str, frame.columns))
+    }
+
+def wide_snapshot(stocks_df, wiki_pageviews) -> str:
+    """
+    Snapshot key of the wide matrix cache, from the versions of stocks_df and wiki_pageviews and
+    a fingerprint of the frames passed in (a filtered load gets its own snapshot).
+    """
+    key = {
+        'versions': input_versions(['stocks_df', 'wiki_pageviews']),
+        'stocks_df': frame_fingerprint(stocks_df),
+        'wiki_pageviews': frame_fingerprint(wiki_pageviews)
+    }
+    return hashlib.sha1(json.dumps(key, sort_keys=True).encode()).hexdigest()[:16]
+
+def build_wide_cache(stocks_df, wiki_pageviews, snapshot, cache_dir=WIDE_CACHE_DIR) -> str:
+    """
+    Pivot every ticker once and save the float32 wide matrix as a memory-mappable .npy file.
+
+    Parameters:
+        snapshot (str): Snapshot key (see wide_snapshot).
+        cache_dir (str): Cache directory.
+
+    Returns:
+        str: Directory of the snapshot.
+    """
+    stocks_w = gen_stocks_w(None, stocks_df, wiki_pageviews, drop_tickers=False)
+
+    tickers = sorted({col.split('_', 1)[1] for col in stocks_w.columns if col != 'Date'})
+    columns = [f+"_"+t for t in tickers for f in WIDE_FIELDS]
+
+    # Build in a private directory and rename it into place, so readers and concurrent builders
+    # never see a half-written snapshot
+    snapshot_dir = os.path.join(cache_dir, snapshot)
+    os.makedirs(cache_dir, exist_ok=True)
+    tmp_dir = tempfile.mkdtemp(prefix=snapshot+'.', suffix='.tmp', dir=cache_dir)
+    try:
+        values = np.lib.format.open_memmap(
+            os.path.join(tmp_dir, 'values.npy'), mode='w+', dtype=np.float32,
+            shape=(len(stocks_w), len(columns)), fortran_order=True
+        )
+        for j, col in enumerate(columns):
+            values[:, j] = stocks_w[col].to_numpy(dtype=np.float32)
+        values.flush()
+        del values
+
+        # In the unit of stocks_df's dates, so slices have the dtype of gen_stocks_w's frames
+        np.save(os.path.join(tmp_dir, 'dates.npy'), stocks_w['Date'].to_numpy())
+        with open(os.path.join(tmp_dir, 'columns.json'), "w", encoding="utf-8") as f:
+            json.dump({'tickers': tickers, 'fields': WIDE_FIELDS}, f)
+
+        os.replace(tmp_dir, snapshot_dir)
+    except OSError:
+        # Another builder finished the same snapshot first
+        if not os.path.isfile(os.path.join(snapshot_dir, 'columns.json')):
+            raise
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+    return snapshot_dir
+
+def load_wide_cache(snapshot, cache_dir=WIDE_CACHE_DIR) -> WideMatrix:
+    """
+    Open a wide matrix cache as a memory map.
+
+    Parameters:
+        snapshot (str): Snapshot key (see wide_snapshot).
+        cache_dir (str): Cache directory.
+
+    Returns:
+        WideMatrix: The memory-mapped matrix, or None if the snapshot was never built.
+    """
+    snapshot_dir = os.path.join(cache_dir, snapshot)
+    if not os.path.isfile(os.path.join(snapshot_dir, 'columns.json')):
+        return None
+
+    with open(os.path.join(snapshot_dir, 'columns.json'), "r", encoding="utf-8") as f:
+        column_index = json.load(f)
+
+    return WideMatrix(
+        values=np.load(os.path.join(snapshot_dir, 'values.npy'), mmap_mode='r'),
+        dates=np.load(os.path.join(snapshot_dir, 'dates.npy')),
+        tickers=column_index['tickers'],
+        fields=column_index['fields']
+    )
+
+def get_wide_cache(stocks_df, wiki_pageviews, snapshot=None, cache_dir=WIDE_CACHE_DIR):
+    """
+    Open the wide matrix cache of a data snapshot, building it first if needed.
+
+    Parameters:
+        snapshot (str, optional): Snapshot key (default: wide_snapshot(stocks_df, wiki_pageviews)).
+        cache_dir (str): Cache directory.
+
+    Returns:
+        WideMatrix: The memory-mapped matrix.
+    """
+    snapshot = snapshot or wide_snapshot(stocks_df, wiki_pageviews)
+
+    wide = load_wide_cache(snapshot, cache_dir)
+    if wide is None:
+        build_wide_cache(stocks_df, wiki_pageviews, snapshot, cache_dir)
+        wide = load_wide_cache(snapshot, cache_dir)
+
+    return wide
+
 def prep_data(stocks_df, wiki_pageviews, ffr_raw, weather, gt_adjusted, config: IndicatorConfig,
-              drop_tickers=None):
+              drop_tickers=None, wide: WideMatrix = None, engine=None):
     """
     Prepare data for forecasting strategies (add some extra features).
 
     Parameters:
         config (IndicatorConfig): Configuration object for technical indicators.
         drop_tickers (bool): Whether to drop other tickers.
+        wide (WideMatrix, optional): Wide matrix cache to slice instead of pivoting stocks_df
+            (float32 values).
+        engine (IndicatorEngine, optional): Batched indicator engine shared across tickers.
 
     Returns:
         DataFrame: Prepared data with additional features and technical indicators.
     """
     target_ticker = config.target+"_"+config.ticker
 
-    prepd_data = gen_stocks_w(config.ticker, stocks_df, wiki_pageviews, drop_tickers)
+    if wide is not None:
+        tickers = ['SPY', config.ticker] if config.ticker != 'SPY' else ['SPY']
+        prepd_data = wide.frame(tickers if drop_tickers else None)
+    else:
+        prepd_data = gen_stocks_w(config.ticker, stocks_df, wiki_pageviews, drop_tickers)
 
     # Sunlight
-    nyc = LocationInfo("New York City", "USA", "America/New_York", 40.7128, -74.0060)
-    nyc_tz = pytz.timezone("America/New_York")
-
-    prepd_data['sunlight_nyc'] = prepd_data['Date'].apply(
-        lambda d: (sun(nyc.observer, date=d, tzinfo=nyc_tz)['sunset'] -
-                   sun(nyc.observer, date=d, tzinfo=nyc_tz)['sunrise']).total_seconds()
-    )
+    prepd_data['sunlight_nyc'] = sunlight_nyc(prepd_data['Date'])
 
     # Federal funds rate
     prepd_data = prepd_data.merge(ffr_raw,on='Date',how='left')
@@ -311,7 +628,7 @@ def prep_data(stocks_df, wiki_pageviews, ffr_raw, weather, gt_adjusted, config:
 
     prepd_data = prepd_data.drop(columns=['yesterday_to_today','streak'])
 
-    prepd_data = calculate_technical_indicators(prepd_data, config)
+    prepd_data = calculate_technical_indicators(prepd_data, config, engine)
 
     prepd_data['Daily_Return'] = prepd_data[target_ticker].pct_change()
 
@@ -1,22 +1,20 @@
 """Define forecasting strategies"""
 
+import importlib
+import importlib.util
+import os
+from concurrent.futures import ProcessPoolExecutor
 from dataclasses import dataclass, field
+from typing import Callable
 
 import pandas as pd
 import numpy as np
-import tensorflow as tf
-from keras import layers, models
-from prophet import Prophet
-from sklearn.ensemble import RandomForestClassifier, GradientBoostingClassifier
-from sklearn.decomposition import PCA
-from sklearn.linear_model import LogisticRegression
-from sklearn.model_selection import TimeSeriesSplit, GridSearchCV
-from sklearn.neighbors import KNeighborsClassifier
-from sklearn.neural_network import MLPClassifier
-from sklearn.pipeline import make_pipeline
-from sklearn.preprocessing import StandardScaler
-from sklearn.svm import LinearSVC, SVC
-from xgboost import XGBClassifier
+from numpy.lib.stride_tricks import sliding_window_view
+
+# pylint: disable=import-outside-toplevel
+# sklearn, xgboost, tensorflow/keras and prophet (and param_search and pca_cache, which import
+# sklearn) are imported by the functions that use them, so importing this module and running
+# the rule based strategies only loads pandas and numpy
 
 
 @dataclass
@@ -26,7 +24,20 @@ class KerasConfig:
     """
     proba: float = 0.5
     sequence_length: int = 30
-    epochs: int = 20
+    epochs: int = 20 # epochs of the first fit (and of every refit if fine_tune_epochs is None)
+    fine_tune_epochs: int = 2 # epochs of each refit after the first
+    fine_tune_window: int = 250 # most recent sequences each refit after the first trains on
+    batch_size: int = 16
+    validation_split: float = 0.2 # most recent sequences held out of training
+
+@dataclass
+class ProphetConfig:
+    """
+    Prophet configuration class
+    """
+    warm_start: bool = True # start each fit from the parameters of the previous one
+    daily_seasonality: bool = True
+    yearly_seasonality: bool = True
 
 @dataclass
 class ProbaConfig:
@@ -42,6 +53,32 @@ class ProbaConfig:
     svc: float = 0.5
     xgboost: float = 0.5
 
+@dataclass
+class RefitConfig:
+    """
+    Walk-forward refit configuration (warm_start=False refits the whole pipeline every time)
+    """
+    warm_start: bool = False
+    boost_rounds: int = 10 # XGBoost rounds added per refit
+    boost_window: int = 250 # trailing rows the added XGBoost rounds train on
+    new_trees: int = 10 # trees (or boosting stages) appended to forests per refit
+    max_trees: int = 500 # trees/stages/rounds an ensemble may grow to before a full refit
+    full_refit_every: int = 20 # refit the whole pipeline every n refits (None: only at the cap)
+    incremental_pca: bool = False # update the previous window's PCA on full refits (approximate)
+
+@dataclass
+class SearchConfig:
+    """
+    Hyperparameter search configuration (method: 'grid', 'halving' or 'tpe')
+    """
+    method: str = 'grid'
+    max_fits: int = None # fit budget for 'halving' and 'tpe' (None: no limit)
+    time_budget: float = None # seconds for 'tpe' (None: no limit)
+    n_iter: int = 30 # candidates evaluated by 'tpe'
+    random_state: int = None
+    report: bool = True # print the wall-clock time and chosen parameters of each search
+    cache_dir: str = None # directory of cached best parameters (None: always search)
+
 @dataclass
 class BacktestConfig:
     """
@@ -52,9 +89,172 @@ class BacktestConfig:
     retrain_days: int = 1
     proba: ProbaConfig = field(default_factory=ProbaConfig)
     keras: KerasConfig = field(default_factory=KerasConfig)
+    prophet: ProphetConfig = field(default_factory=ProphetConfig)
+    refit: RefitConfig = field(default_factory=RefitConfig)
+    search: SearchConfig = field(default_factory=SearchConfig)
 
 # helper functions
-def pred_loop(data, initial_train_period, best_pipeline, retrain_days) -> tuple:
+def copy_on_write() -> bool:
+    """
+    Whether pandas copies on write (always from pandas 3, or mode.copy_on_write on pandas 2).
+    """
+    return int(pd.__version__.split('.', 1)[0]) >= 3 or pd.get_option('mode.copy_on_write') is True
+
+def writable_copy(data) -> pd.DataFrame:
+    """
+    Copy of data the strategies can add and write columns to without changing data: shallow with
+    copy-on-write (nothing is duplicated until written), deep otherwise.
+    """
+    return data.copy(deep=not copy_on_write())
+
+def pca_pipeline(model, refit: RefitConfig = None):
+    """
+    StandardScaler -> PCA -> model pipeline, with the step names of make_pipeline.
+
+    The PCA step is a pca_cache.SharedPCA, so every strategy and every n_components candidate
+    fitted on the same training window shares one SVD. With refit.incremental_pca, walk-forward
+    refits update the SVD of the previous window instead (see pca_cache.decompose).
+    """
+    from sklearn.pipeline import Pipeline
+    from sklearn.preprocessing import StandardScaler
+
+    import pca_cache
+
+    return Pipeline([
+        ('standardscaler', StandardScaler()),
+        ('pca', pca_cache.SharedPCA(incremental=refit is not None and refit.incremental_pca)),
+        (type(model).__name__.lower(), model)
+    ])
+
+def incremental_refit(pipeline, X, y, prev_stop, stop, refit: RefitConfig) -> bool:
+    """
+    Update the final estimator of a fitted pipeline with the rows since the last refit.
+
+    The preprocessing steps (scaler, PCA) keep the statistics of the first fit so the
+    estimator's feature space does not move under it. The estimator is then updated by the
+    cheapest method it supports:
+        - XGBoost: continue boosting for boost_rounds rounds on the last boost_window rows
+        - forests and gradient boosting: append new_trees trees/stages
+        - partial_fit (SGD style models): one pass over the new rows
+        - warm_start (logit, MLP): refit starting from the current coefficients/weights
+        - anything else: refit the estimator only
+    Ensembles are not grown past max_trees trees/rounds; the caller refits the whole pipeline
+    instead, which also resets the ensemble to its configured size. Only XGBoost and
+    partial_fit models train on a fixed number of rows per refit: forests, gradient boosting
+    and warm-started models still train on every row up to stop (warm starting saves
+    iterations, not rows), so their refits get slower as the window grows.
+
+    Parameters:
+        pipeline: Fitted pipeline.
+        X (ndarray): Features of every row.
+        y (ndarray): Target of every row.
+        prev_stop (int): End of the previous training window.
+        stop (int): End of the new training window.
+        refit (RefitConfig): Refit configuration.
+
+    Returns:
+        bool: False if the ensemble is at max_trees and needs a full refit, else True.
+    """
+    preprocess = pipeline[:-1]
+    model = pipeline.steps[-1][1]
+    params = model.get_params()
+
+    if hasattr(model, 'get_booster'):
+        booster = model.get_booster()
+        if booster.num_boosted_rounds() + refit.boost_rounds > refit.max_trees:
+            return False
+
+        # A trailing window rather than only the new rows, so the added rounds do not overfit
+        # a few samples
+        window_start = max(0, min(prev_stop, stop - refit.boost_window))
+        X_window, y_window = preprocess.transform(X[window_start:stop]), y[window_start:stop]
+        if len(np.unique(y_window)) > 1: # XGBoost needs both classes in the window
+            model.set_params(n_estimators=refit.boost_rounds)
+            model.fit(X_window, y_window, xgb_model=booster)
+            model.set_params(n_estimators=params['n_estimators'])
+
+    elif hasattr(model, 'estimators_') and 'warm_start' in params and 'n_estimators' in params:
+        n_trees = len(model.estimators_) + refit.new_trees
+        if n_trees > refit.max_trees:
+            return False
+
+        model.set_params(warm_start=True, n_estimators=n_trees)
+        model.fit(preprocess.transform(X[:stop]), y[:stop])
+        model.set_params(warm_start=params['warm_start'], n_estimators=params['n_estimators'])
+
+    elif hasattr(model, 'partial_fit'):
+        model.partial_fit(preprocess.transform(X[prev_stop:stop]), y[prev_stop:stop])
+
+    else:
+        if 'warm_start' in params:
+            model.set_params(warm_start=True)
+        model.fit(preprocess.transform(X[:stop]), y[:stop])
+        if 'warm_start' in params:
+            model.set_params(warm_start=params['warm_start'])
+
+    return True
+
+def walk_forward(data, initial_train_period, pipeline, retrain_days, method='predict',
+                 refit: RefitConfig = None) -> tuple:
+    """
+    Walk forward through the data, refitting the pipeline every n days and predicting the whole
+    block of rows between refits in one call.
+
+    The feature matrix is converted to one contiguous array up front so each refit trains on a
+    view of it instead of re-slicing the DataFrame. Rows are taken by position: the prediction
+    for row i comes from a fit on the rows before it, whatever data's index is (the row-by-row
+    loop this replaced predicted data.loc[[i]] by label, a different row once dropna() had
+    removed the first rows).
+
+    Parameters:
+        data (DataFrame): Stock data with required columns.
+        initial_train_period (int): Initial training period.
+        pipeline: Pipeline to refit and predict with.
+        retrain_days (int): Retrain the model every n days.
+        method (str): Pipeline method used for predictions ('predict' or 'predict_proba').
+        refit (RefitConfig, optional): Refit configuration (default: full refits).
+
+    Returns:
+        ndarray: Predictions for every row from initial_train_period onward.
+        ndarray: Features of the last training window.
+        ndarray: Target of the last training window.
+    """
+    if len(data) <= initial_train_period:
+        raise ValueError(f"Need more than initial_train_period={initial_train_period} rows to "
+                         f"walk forward, got {len(data)}.")
+
+    feats = [col for col in data.columns if col not in ['Date', 'Target']]
+
+    X = np.ascontiguousarray(data[feats].to_numpy(dtype=np.float64))
+    y = data['Target'].to_numpy()
+
+    predict = getattr(pipeline, method)
+
+    blocks = []
+    prev_start = None
+    since_full = 0
+    for start in range(initial_train_period, len(data), retrain_days):
+        stop = min(start + retrain_days, len(data))
+
+        # Train only on past data up to the current point (scaling + model training)
+        incremental = (
+            refit is not None and refit.warm_start and prev_start is not None
+            and (refit.full_refit_every is None or since_full < refit.full_refit_every)
+        )
+        if incremental and incremental_refit(pipeline, X, y, prev_start, start, refit):
+            since_full += 1
+        else:
+            pipeline.fit(X[:start], y[:start])
+            since_full = 0
+        prev_start = start
+
+        # Predict every day until the next retrain
+        blocks.append(predict(X[start:stop]))
+
+    return np.concatenate(blocks), X[:start], y[:start]
+
+def pred_loop(data, initial_train_period, best_pipeline, retrain_days,
+              refit: RefitConfig = None) -> tuple:
     """
     Loop through the data and make predictions
 
@@ -63,35 +263,18 @@ def pred_loop(data, initial_train_period, best_pipeline, retrain_days) -> tuple:
         initial_train_period (int): Initial training period.
         best_pipeline: Trained pipeline.
         retrain_days (int): Retrain the model every n days.
+        refit (RefitConfig, optional): Refit configuration (default: full refits).
     
     Returns:
         DataFrame: Data with strategy signals.
         model: Trained model.
         score: Model accuracy score.
     """
-    feats = [col for col in data.columns if col not in ['Date', 'Target']]
-
-    pred_results = []
-    for i in range(initial_train_period, len(data)):
-        # Retrain only every 'retrain_days' days or on the first iteration
-        if (i - initial_train_period) % retrain_days == 0 or i == initial_train_period:
-            # Train only on past data up to the current point
-            train_data = data.iloc[:i]
-            X_train = train_data[feats]
-            y_train = train_data['Target']
-
-            # Fit the pipeline (scaling + model training)
-            best_pipeline.fit(X_train, y_train)
-
-        # Predict for the next day
-        test_data = data.loc[[i]]
-        X_test = test_data[feats]
-
-        # Predict using the pipeline (scales automatically)
-        pred_results.append((i, best_pipeline.predict(X_test)[0]))
+    preds, X_train, y_train = walk_forward(
+        data, initial_train_period, best_pipeline, retrain_days, method='predict', refit=refit
+    )
 
-    pred_df = pd.DataFrame(pred_results, columns=["index", "Signal"]).set_index("index")
-    data.loc[pred_df.index, "Signal"] = pred_df["Signal"]
+    data.loc[data.index[initial_train_period:], "Signal"] = preds
 
     data['Signal'] = data['Signal'].fillna(1)
 
@@ -100,7 +283,8 @@ def pred_loop(data, initial_train_period, best_pipeline, retrain_days) -> tuple:
 
     return data, model, score
 
-def proba_loop(data, initial_train_period, best_pipeline, proba, retrain_days) -> tuple:
+def proba_loop(data, initial_train_period, best_pipeline, proba, retrain_days,
+               refit: RefitConfig = None) -> tuple:
     """
     Loop through the data and predict probabilities, retraining the model every n days.
 
@@ -110,35 +294,21 @@ def proba_loop(data, initial_train_period, best_pipeline, proba, retrain_days) -
         best_pipeline: Trained pipeline.
         proba (float): Probability threshold for Signal = 1.
         retrain_days (int): Retrain the model every n days.
+        refit (RefitConfig, optional): Refit configuration (default: full refits).
 
     Returns:
         DataFrame: Data with strategy signals.
         model: Trained model.
         score: Model accuracy score.
     """
-    feats = [col for col in data.columns if col not in ['Date', 'Target']]
-
-    proba_results = []
-    for i in range(initial_train_period, len(data)):
-        # Retrain only every 'retrain_days' days or on the first iteration
-        if (i - initial_train_period) % retrain_days == 0 or i == initial_train_period:
-            # Train only on past data up to the current point
-            train_data = data.iloc[:i]
-            X_train = train_data[feats]
-            y_train = train_data['Target']
-
-            # Fit the pipeline (scaling + model training)
-            best_pipeline.fit(X_train, y_train)
-
-        # Predict for the next day
-        test_data = data.loc[[i]]
-        X_test = test_data[feats]
-
-        # Store predictions with indices
-        proba_results.append((i, best_pipeline.predict_proba(X_test)[0]))
+    probas, X_train, y_train = walk_forward(
+        data, initial_train_period, best_pipeline, retrain_days, method='predict_proba',
+        refit=refit
+    )
 
-    proba_df = pd.DataFrame(proba_results, columns=["index", "proba"]).set_index("index")
-    data[["proba_0", "proba_1"]] = pd.DataFrame(proba_df["proba"].to_list(), index=proba_df.index)
+    data[["proba_0", "proba_1"]] = pd.DataFrame(
+        probas, index=data.index[initial_train_period:], columns=["proba_0", "proba_1"]
+    )
 
     data['Signal'] = np.where(data['proba_1'].fillna(1) > proba, 1, 0)
 
@@ -150,7 +320,7 @@ def proba_loop(data, initial_train_period, best_pipeline, proba, retrain_days) -
 #
 def generic_sklearn_strategy(
     data, initial_train_period, model_cls, param_grid, retrain_days,
-    proba_threshold=0.5, n_jobs=None, **model_kwargs
+    proba_threshold=0.5, n_jobs=None, refit=None, search=None, **model_kwargs
 ):
     """
     Make predictions using a generic sklearn strategy.
@@ -171,67 +341,72 @@ def generic_sklearn_strategy(
         model: Trained logistic regression model.
         score: Model accuracy score.
     """
+    import param_search
+
     feats = [col for col in data.columns if col not in ['Date', 'Target']]
 
     # Drop rows with missing values due to rolling calculations
-    data = data.dropna().copy()
+    data = writable_copy(data.dropna())
 
     train_data = data.iloc[:initial_train_period]
     X_train, y_train = train_data[feats], train_data['Target']
 
     # Grid search for best parameters
-    pipeline = make_pipeline(
-        StandardScaler(),
-        PCA(svd_solver='full'),
-        model_cls(**model_kwargs)
-    )
+    pipeline = pca_pipeline(model_cls(**model_kwargs), refit=refit)
 
-    search = GridSearchCV(pipeline, param_grid, cv=TimeSeriesSplit(), n_jobs=n_jobs)
-    search.fit(X_train, y_train)
+    best_pipeline = param_search.fit_search(
+        pipeline, param_grid, X_train, y_train, n_jobs=n_jobs, config=search
+    )
 
     # Auto-detect proba support if use_proba is None
-    estimator = search.best_estimator_
+    estimator = best_pipeline
     if hasattr(estimator.steps[-1][1], "predict_proba"):
 
         return proba_loop(
-            data, initial_train_period, estimator, proba_threshold, retrain_days
+            data, initial_train_period, estimator, proba_threshold, retrain_days, refit
         )
 
-    return pred_loop(data, initial_train_period, estimator, retrain_days)
+    return pred_loop(data, initial_train_period, estimator, retrain_days, refit)
 # sklearn models
 def strat_gradient_boost(
-        data, initial_train_period, gradb_proba, retrain_days, random_state=None, n_jobs=None
+        data, initial_train_period, gradb_proba, retrain_days, random_state=None, n_jobs=None,
+        refit=None, search=None
     ):
     """
     Predict with sklearn's GradientBoostingClassifier 
     Probably better to use XGBoost instead (much faster)
     """
+    from sklearn.ensemble import GradientBoostingClassifier
+
+    import param_search
+
     feats = [col for col in data.columns if col not in ['Date', 'Target']]
 
     # Drop rows with missing values due to rolling calculations
-    data = data.dropna().copy()
+    data = writable_copy(data.dropna())
 
     train_data = data.iloc[:initial_train_period]
     X_train, y_train = train_data[feats], train_data['Target']
 
     # Grid search for best parameters
-    pipeline = make_pipeline(
-        StandardScaler(),
-        PCA(svd_solver='full'),
-        GradientBoostingClassifier(random_state=random_state)
-    )
+    pipeline = pca_pipeline(GradientBoostingClassifier(random_state=random_state),
+                            refit=refit)
 
     param_grid = {
         "pca__n_components": [0.6,0.65,0.7,0.75,0.8,0.85,0.9,0.95],
     }
 
-    search = GridSearchCV(pipeline, param_grid, cv=TimeSeriesSplit(), n_jobs=n_jobs)
-    search.fit(X_train, y_train)
-    # print(search.best_params_)
+    best_pipeline = param_search.fit_search(
+        pipeline, param_grid, X_train, y_train, n_jobs=n_jobs, config=search
+    )
 
-    return proba_loop(data, initial_train_period, search.best_estimator_, gradb_proba, retrain_days)
+    return proba_loop(
+        data, initial_train_period, best_pipeline, gradb_proba, retrain_days, refit
+    )
 
-def strat_knn(data, initial_train_period, knn_proba, retrain_days, n_jobs=None):
+def strat_knn(
+        data, initial_train_period, knn_proba, retrain_days, n_jobs=None, refit=None, search=None
+    ):
     """
     Predict probabilities with K nearest neighbors classifier
     
@@ -246,32 +421,37 @@ def strat_knn(data, initial_train_period, knn_proba, retrain_days, n_jobs=None):
         model: Trained K nearest neighbors model.
         score: Model accuracy score.
     """
+    from sklearn.neighbors import KNeighborsClassifier
+
+    import param_search
+
     feats = [col for col in data.columns if col not in ['Date', 'Target']]
 
     # Drop rows with missing values due to rolling calculations
-    data = data.dropna().copy()
+    data = writable_copy(data.dropna())
 
     train_data = data.iloc[:initial_train_period]
     X_train, y_train = train_data[feats], train_data['Target']
 
     # Grid search for best parameters
-    pipeline = make_pipeline(
-        StandardScaler(),
-        PCA(svd_solver='full'),
-        KNeighborsClassifier(n_jobs=n_jobs)
-    )
+    pipeline = pca_pipeline(KNeighborsClassifier(n_jobs=n_jobs), refit=refit)
 
     param_grid = {
         "pca__n_components": [0.6,0.65,0.7,0.75,0.8,0.85,0.9,0.95],
     }
 
-    search = GridSearchCV(pipeline, param_grid, cv=TimeSeriesSplit(), n_jobs=n_jobs)
-    search.fit(X_train, y_train)
-    # print(search.best_params_)
+    best_pipeline = param_search.fit_search(
+        pipeline, param_grid, X_train, y_train, n_jobs=n_jobs, config=search
+    )
 
-    return proba_loop(data, initial_train_period, search.best_estimator_, knn_proba, retrain_days)
+    return proba_loop(
+        data, initial_train_period, best_pipeline, knn_proba, retrain_days, refit
+    )
 
-def strat_linear_svc(data, initial_train_period, retrain_days, random_state=None, n_jobs=None):
+def strat_linear_svc(
+        data, initial_train_period, retrain_days, random_state=None, n_jobs=None, refit=None,
+        search=None
+    ):
     """
     Predict with Linear SVC
     
@@ -285,20 +465,20 @@ def strat_linear_svc(data, initial_train_period, retrain_days, random_state=None
         model: Trained Linear SVC model.
         score: Model accuracy score.
     """
+    from sklearn.svm import LinearSVC
+
+    import param_search
+
     feats = [col for col in data.columns if col not in ['Date', 'Target']]
 
     # Drop rows with missing values due to rolling calculations
-    data = data.dropna().copy()
+    data = writable_copy(data.dropna())
 
     train_data = data.iloc[:initial_train_period]
     X_train, y_train = train_data[feats], train_data['Target']
 
     # Grid search for best parameters
-    pipeline = make_pipeline(
-        StandardScaler(),
-        PCA(svd_solver='full'),
-        LinearSVC(random_state=random_state)
-    )
+    pipeline = pca_pipeline(LinearSVC(random_state=random_state), refit=refit)
 
     train_data = data.iloc[:initial_train_period]
     X_train = train_data.drop(columns=['Date', 'Target'])
@@ -309,13 +489,18 @@ def strat_linear_svc(data, initial_train_period, retrain_days, random_state=None
         "linearsvc__C": np.logspace(-4, 4, 9),
     }
 
-    search = GridSearchCV(pipeline, param_grid, cv=TimeSeriesSplit(), n_jobs=n_jobs)
-    search.fit(X_train, y_train)
-    # print(search.best_params_)
+    best_pipeline = param_search.fit_search(
+        pipeline, param_grid, X_train, y_train, n_jobs=n_jobs, config=search
+    )
 
-    return pred_loop(data, initial_train_period, search.best_estimator_, retrain_days)
+    return pred_loop(
+        data, initial_train_period, best_pipeline, retrain_days, refit
+    )
 
-def strat_logit(data, initial_train_period, logit_proba, retrain_days, n_jobs=None):
+def strat_logit(
+        data, initial_train_period, logit_proba, retrain_days, n_jobs=None, refit=None,
+        search=None
+    ):
     """
     Predict probabilities with logistic regression
     
@@ -330,20 +515,20 @@ def strat_logit(data, initial_train_period, logit_proba, retrain_days, n_jobs=No
         model: Trained logistic regression model.
         score: Model accuracy score.
     """
+    from sklearn.linear_model import LogisticRegression
+
+    import param_search
+
     feats = [col for col in data.columns if col not in ['Date', 'Target']]
 
     # Drop rows with missing values due to rolling calculations
-    data = data.dropna().copy()
+    data = writable_copy(data.dropna())
 
     train_data = data.iloc[:initial_train_period]
     X_train, y_train = train_data[feats], train_data['Target']
 
     # Grid search for best parameters
-    pipeline = make_pipeline(
-        StandardScaler(),
-        PCA(svd_solver='full'),
-        LogisticRegression()
-    )
+    pipeline = pca_pipeline(LogisticRegression(), refit=refit)
 
     # Parameter grid with conditional n_jobs
     param_grid = [
@@ -362,14 +547,18 @@ def strat_logit(data, initial_train_period, logit_proba, retrain_days, n_jobs=No
         }
     ]
 
-    search = GridSearchCV(pipeline, param_grid, cv=TimeSeriesSplit(), n_jobs=n_jobs)
-    search.fit(X_train, y_train)
-    # print(search.best_params_)
-    # print(search.best_estimator_.classes_)
+    best_pipeline = param_search.fit_search(
+        pipeline, param_grid, X_train, y_train, n_jobs=n_jobs, config=search
+    )
 
-    return proba_loop(data, initial_train_period, search.best_estimator_, logit_proba, retrain_days)
+    return proba_loop(
+        data, initial_train_period, best_pipeline, logit_proba, retrain_days, refit
+    )
 
-def strat_mlp(data, initial_train_period, mlp_proba, retrain_days, random_state=None, n_jobs=None):
+def strat_mlp(
+        data, initial_train_period, mlp_proba, retrain_days, random_state=None, n_jobs=None,
+        refit=None, search=None
+    ):
     """
     Predict probabilities with MLP classifier
     
@@ -384,20 +573,21 @@ def strat_mlp(data, initial_train_period, mlp_proba, retrain_days, random_state=
         model: Trained MLP classifier model.
         score: Model accuracy score.
     """
+    from sklearn.neural_network import MLPClassifier
+
+    import param_search
+
     feats = [col for col in data.columns if col not in ['Date', 'Target']]
 
     # Drop rows with missing values due to rolling calculations
-    data = data.dropna().copy()
+    data = writable_copy(data.dropna())
 
     train_data = data.iloc[:initial_train_period]
     X_train, y_train = train_data[feats], train_data['Target']
 
     # Grid search for best parameters
-    pipeline = make_pipeline(
-        StandardScaler(),
-        PCA(svd_solver='full'),
-        MLPClassifier(solver='lbfgs', random_state=random_state)
-    )
+    pipeline = pca_pipeline(MLPClassifier(solver='lbfgs', random_state=random_state),
+                            refit=refit)
 
     param_grid = {
         "pca__n_components": [0.6,0.7,0.8,0.9],
@@ -406,14 +596,17 @@ def strat_mlp(data, initial_train_period, mlp_proba, retrain_days, random_state=
         "mlpclassifier__max_iter": [100,500,1000,5000]
     }
 
-    search = GridSearchCV(pipeline, param_grid, cv=TimeSeriesSplit(), n_jobs=n_jobs)
-    search.fit(X_train, y_train)
-    # print(search.best_params_)
+    best_pipeline = param_search.fit_search(
+        pipeline, param_grid, X_train, y_train, n_jobs=n_jobs, config=search
+    )
 
-    return proba_loop(data, initial_train_period, search.best_estimator_, mlp_proba, retrain_days)
+    return proba_loop(
+        data, initial_train_period, best_pipeline, mlp_proba, retrain_days, refit
+    )
 
 def strat_random_forest(
-        data, initial_train_period, rf_proba, retrain_days, random_state=None, n_jobs=None
+        data, initial_train_period, rf_proba, retrain_days, random_state=None, n_jobs=None,
+        refit=None, search=None
     ):
     """
     Predict probabilities with Random Forest Classifier
@@ -429,6 +622,11 @@ def strat_random_forest(
         model: Trained SVC model.
         score: Model accuracy score.
     """
+    from sklearn.ensemble import RandomForestClassifier
+    from sklearn.pipeline import make_pipeline
+
+    import param_search
+
     pipeline = make_pipeline(
         RandomForestClassifier(random_state=random_state,
                                n_jobs=n_jobs)
@@ -437,29 +635,31 @@ def strat_random_forest(
     feats = [col for col in data.columns if col not in ['Date', 'Target']]
 
     # Drop rows with missing values due to rolling calculations
-    data = data.dropna().copy()
+    data = writable_copy(data.dropna())
 
     train_data = data.iloc[:initial_train_period]
     X_train, y_train = train_data[feats], train_data['Target']
 
     # Grid search for best parameters
-    pipeline = make_pipeline(
-        StandardScaler(),
-        PCA(svd_solver='full'),
-        RandomForestClassifier(random_state=random_state, n_jobs=n_jobs)
-    )
+    pipeline = pca_pipeline(RandomForestClassifier(random_state=random_state, n_jobs=n_jobs),
+                            refit=refit)
 
     param_grid = {
         "pca__n_components": [0.6,0.7,0.8,0.9],
     }
 
-    search = GridSearchCV(pipeline, param_grid, cv=TimeSeriesSplit(), n_jobs=n_jobs)
-    search.fit(X_train, y_train)
-    # print(search.best_params_)
+    best_pipeline = param_search.fit_search(
+        pipeline, param_grid, X_train, y_train, n_jobs=n_jobs, config=search
+    )
 
-    return proba_loop(data, initial_train_period, search.best_estimator_, rf_proba, retrain_days)
+    return proba_loop(
+        data, initial_train_period, best_pipeline, rf_proba, retrain_days, refit
+    )
 
-def strat_svc(data, initial_train_period, retrain_days, random_state=None, n_jobs=None):
+def strat_svc(
+        data, initial_train_period, retrain_days, random_state=None, n_jobs=None, refit=None,
+        search=None
+    ):
     """
     Predict with SVC
     
@@ -473,6 +673,12 @@ def strat_svc(data, initial_train_period, retrain_days, random_state=None, n_job
         model: Trained SVC model.
         score: Model accuracy score.
     """
+    from sklearn.pipeline import make_pipeline
+    from sklearn.preprocessing import StandardScaler
+    from sklearn.svm import SVC
+
+    import param_search
+
     pipeline = make_pipeline(
         StandardScaler(),
         SVC(random_state=random_state)
@@ -481,17 +687,13 @@ def strat_svc(data, initial_train_period, retrain_days, random_state=None, n_job
     feats = [col for col in data.columns if col not in ['Date', 'Target']]
 
     # Drop rows with missing values due to rolling calculations
-    data = data.dropna().copy()
+    data = writable_copy(data.dropna())
 
     train_data = data.iloc[:initial_train_period]
     X_train, y_train = train_data[feats], train_data['Target']
 
     # Grid search for best parameters
-    pipeline = make_pipeline(
-        StandardScaler(),
-        PCA(svd_solver='full'),
-        SVC(random_state=random_state)
-    )
+    pipeline = pca_pipeline(SVC(random_state=random_state), refit=refit)
 
     train_data = data.iloc[:initial_train_period]
     X_train = train_data.drop(columns=['Date', 'Target'])
@@ -502,14 +704,17 @@ def strat_svc(data, initial_train_period, retrain_days, random_state=None, n_job
         "svc__C": np.logspace(-4, 4, 9),
     }
 
-    search = GridSearchCV(pipeline, param_grid, cv=TimeSeriesSplit(), n_jobs=n_jobs)
-    search.fit(X_train, y_train)
-    # print(search.best_params_)
+    best_pipeline = param_search.fit_search(
+        pipeline, param_grid, X_train, y_train, n_jobs=n_jobs, config=search
+    )
 
-    return pred_loop(data, initial_train_period, search.best_estimator_, retrain_days)
+    return pred_loop(
+        data, initial_train_period, best_pipeline, retrain_days, refit
+    )
 
 def strat_svc_proba(
-        data, initial_train_period, svc_proba, retrain_days, random_state=None, n_jobs=None
+        data, initial_train_period, svc_proba, retrain_days, random_state=None, n_jobs=None,
+        refit=None, search=None
     ):
     """
     Predict probabilities with SVC
@@ -526,20 +731,23 @@ def strat_svc_proba(
         model: Trained SVC probability model.
         score: Model accuracy score.
     """
+    from sklearn.svm import SVC
+
+    import param_search
+
     feats = [col for col in data.columns if col not in ['Date', 'Target']]
 
     # Drop rows with missing values due to rolling calculations
-    data = data.dropna().copy()
+    data = writable_copy(data.dropna())
 
     train_data = data.iloc[:initial_train_period]
     X_train, y_train = train_data[feats], train_data['Target']
 
     # Grid search for best parameters
-    pipeline = make_pipeline(
-        StandardScaler(),
-        PCA(svd_solver='full'),
+    pipeline = pca_pipeline(
         SVC(probability=True,
-            random_state=random_state)
+            random_state=random_state),
+        refit=refit
     )
 
     param_grid = {
@@ -548,36 +756,99 @@ def strat_svc_proba(
         "svc__max_iter": [100,500,1000]
     }
 
-    search = GridSearchCV(pipeline, param_grid, cv=TimeSeriesSplit(), n_jobs=n_jobs)
-    search.fit(X_train, y_train)
-    # print(search.best_params_)
+    best_pipeline = param_search.fit_search(
+        pipeline, param_grid, X_train, y_train, n_jobs=n_jobs, config=search
+    )
 
-    return proba_loop(data, initial_train_period, search.best_estimator_, svc_proba, retrain_days)
+    return proba_loop(
+        data, initial_train_period, best_pipeline, svc_proba, retrain_days, refit
+    )
 
 # Other models
-def strat_keras(data, initial_train_period, config: KerasConfig, random_state=None):
+def sequence_dataset(windows, targets, indices, batch_size, seed=None):
+    """
+    keras PyDataset of some of the sequences of a strided window view.
+
+    Each batch is gathered from the view when keras asks for it, so the (samples,
+    sequence_length, features) training tensor is never built. The sequences are shuffled
+    every epoch, as model.fit does with arrays.
+
+    Parameters:
+        windows (ndarray): (samples, sequence_length, features) view.
+        targets (ndarray): Target of each sequence.
+        indices (ndarray): Sequences to use.
+        batch_size (int): Batch size.
+        seed (int, optional): Seed of the shuffles.
     """
-    Predict with Keras
+    from keras.utils import PyDataset
+
+    class SequenceDataset(PyDataset):
+        """Shuffled batches of windows[indices]"""
+        def __init__(self):
+            super().__init__()
+            self.rng = np.random.default_rng(seed)
+            self.order = self.rng.permutation(indices)
+
+        def __len__(self):
+            return -(-len(self.order) // batch_size)
+
+        def __getitem__(self, idx):
+            batch = self.order[idx * batch_size:(idx + 1) * batch_size]
+            return windows[batch], targets[batch]
+
+        def on_epoch_end(self):
+            self.order = self.rng.permutation(indices)
+
+    return SequenceDataset()
+
+def strat_keras(data, initial_train_period, config: KerasConfig, retrain_days=1,
+                random_state=None):
+    """
+    Predict probabilities with a Keras LSTM, walking forward like the sklearn strategies.
+
+    The model is trained on the sequences before initial_train_period for epochs epochs, then
+    every retrain_days days fine-tuned on the fine_tune_window most recent sequences for
+    fine_tune_epochs epochs (or trained on all of them for epochs epochs again if
+    fine_tune_epochs is None), and the days until the next refit are predicted in one call.
+
+    The features are scaled once with the statistics of the initial training period (so the
+    inputs do not shift under the fine-tuned weights, as in incremental_refit) and kept as one
+    float32 array. The sequences are a strided view of it and training batches are copied out
+    one at a time, so memory does not grow with sequence_length or the number of refits.
 
     Parameters:
         data (DataFrame): Stock data with required columns.
         initial_train_period (int): Initial training period.
         config: KerasConfig
+        retrain_days (int): Retrain the model every n days.
         random_state (int, optional): Random state for reproducibility.
 
     Returns:
         DataFrame: Data with strategy signals.
         model: Trained Keras model.
     """
+    import tensorflow as tf
+    from keras import layers, models
+    from sklearn.preprocessing import StandardScaler
+
     feats = [col for col in data.columns if col not in ['Date', 'Target']]
 
     # Drop rows with missing values due to rolling calculations
-    data = data.dropna().copy()
+    data = writable_copy(data.dropna())
 
-    scaler = StandardScaler()
+    sequence_length = config.sequence_length  # Number of time steps (lookback window)
+    if initial_train_period <= sequence_length:
+        raise ValueError("initial_train_period must be longer than sequence_length.")
 
     tf.random.set_seed(random_state) # seems like the seed is very influential...
-    sequence_length = config.sequence_length  # Number of time steps (lookback window)
+
+    scaler = StandardScaler().fit(data[feats].iloc[:initial_train_period])
+    X = scaler.transform(data[feats]).astype(np.float32)
+
+    # Sequence k is X[k:k + sequence_length] (a view of X), labelled with the target of its
+    # last day. Shape: (samples, time_steps, num_features)
+    windows = sliding_window_view(X, sequence_length, axis=0).transpose(0, 2, 1)
+    targets = data['Target'].to_numpy(dtype=np.float32)[sequence_length - 1:]
 
     model = models.Sequential([
         layers.Input(shape=(sequence_length, len(feats))),
@@ -588,92 +859,145 @@ def strat_keras(data, initial_train_period, config: KerasConfig, random_state=No
 
     model.compile(optimizer='adam', loss='binary_crossentropy', metrics=['accuracy'])
 
-    proba_results = []
-    for i in range(initial_train_period, len(data)):
-        # Train only on past data up to the current point
-        train_data = data.iloc[:i]
-        X_train_0 = train_data[feats]
-        y_train_0 = train_data['Target']
+    blocks = []
+    for start in range(initial_train_period, len(data), retrain_days):
+        stop = min(start + retrain_days, len(data))
 
-        # Fit the scaler on the training data and scale training data
-        X_train_0_scaled = scaler.fit_transform(X_train_0)
+        # Train only on past data: the sequences of data.iloc[:start] whose last day is before
+        # start - 1, less the most recent validation_split of them
+        train_size = int((start - sequence_length) * (1 - config.validation_split))
+        if start == initial_train_period or config.fine_tune_epochs is None:
+            first, epochs = 0, config.epochs
+        else:
+            first, epochs = max(0, train_size - config.fine_tune_window), config.fine_tune_epochs
 
-        # Select features and target
-        X = []
-        y = []
-        for j in range(len(X_train_0_scaled) - sequence_length):
-            X.append(X_train_0_scaled[j:j + sequence_length, :])
-            y.append(y_train_0.iloc[j + sequence_length - 1])
+        seed = None if random_state is None else random_state + start
+        model.fit(sequence_dataset(windows, targets, np.arange(first, train_size),
+                                   config.batch_size, seed),
+                  epochs=epochs, verbose=0)
 
-        X = np.array(X)  # Shape: (samples, time_steps, num_features)
-        y = np.array(y)  # Shape: (samples,)
+        # Predict every day until the next retrain, each from the sequence_length days before it
+        blocks.append(model.predict(windows[start - sequence_length:stop - sequence_length],
+                                    verbose=0)[:, 0])
 
-        # Split into train and test sets
-        train_size = int(len(X) * 0.8)
-        X_train_1, y_train_1 = X[:train_size], y[:train_size]
-        X_test_1, y_test_1 = X[train_size:], y[train_size:]
+    data['next_day_prediction'] = pd.Series(np.concatenate(blocks),
+                                            index=data.index[initial_train_period:])
 
-        # Train the Model
-        model.fit(X_train_1, y_train_1, epochs=config.epochs, batch_size=16,
-                  validation_data=(X_test_1, y_test_1), verbose=0)
+    data['Signal'] = np.where(data['next_day_prediction'].fillna(1) > config.proba, 1, 0)
 
-        # Predict the next day - use the last sequence_length rows of all features as input
-        last_sequence = X_train_0_scaled[-sequence_length:, :].reshape(1, sequence_length,
-                                                                       len(feats))
+    return data, model
 
-        # Make the prediction
-        next_day_prediction = model.predict(last_sequence, verbose=0)[0][0]
+def prophet_warm_start_params(model) -> dict:
+    """
+    Fitted parameters of a Prophet model, in the form fit(init=...) takes to start the next
+    fit from them.
+    """
+    params = {}
+    for name in ['k', 'm', 'sigma_obs']:
+        if model.mcmc_samples == 0:
+            params[name] = model.params[name][0][0]
+        else:
+            params[name] = np.mean(model.params[name])
+    for name in ['delta', 'beta']:
+        if model.mcmc_samples == 0:
+            params[name] = model.params[name][0]
+        else:
+            params[name] = np.mean(model.params[name], axis=0)
+    return params
+
+def prophet_forecasts(history, refits, config: ProphetConfig) -> tuple:
+    """
+    Fit Prophet at each refit point in turn and forecast the days until the next one.
 
-        # Store predictions with indices
-        proba_results.append((i, next_day_prediction))
+    Parameters:
+        history (DataFrame): ds and y of every row.
+        refits (list): (start, stop) pairs: fit on history[:start] and forecast the dates of
+            history[start:stop].
+        config (ProphetConfig): Prophet configuration.
 
-        print(f"Date: {max(train_data['Date']).strftime('%Y-%m-%d')}; "
-              f"next_day_pred: {next_day_prediction} "
-              f"Sequence Percent 1: {sum(y_train_0[-sequence_length:])/sequence_length:.0%}")
+    Returns:
+        ndarray: Forecast (yhat) of the rows from the first start to the last stop.
+        model: Last fitted model.
+    """
+    from prophet import Prophet
 
-        # data.loc[data.index[i], 'next_day_prediction'] = next_day_prediction
+    blocks = []
+    init = None
+    for start, stop in refits:
+        # Prophet object can only be fit once - must instantiate a new object every time
+        model = Prophet(daily_seasonality=config.daily_seasonality,
+                        yearly_seasonality=config.yearly_seasonality)
+        if init is not None:
+            model.fit(history.iloc[:start], init=init)
+        else:
+            model.fit(history.iloc[:start])
 
-    proba_df = pd.DataFrame(proba_results,
-                            columns=["index", "next_day_prediction"]).set_index("index")
-    data["next_day_prediction"] = pd.DataFrame(proba_df["next_day_prediction"].to_list(),
-                                               index=proba_df.index)
+        blocks.append(model.predict(history.iloc[start:stop][['ds']])['yhat'].to_numpy())
 
-    data['Signal'] = np.where(data['next_day_prediction'].fillna(1) > config.proba, 1, 0)
+        if config.warm_start:
+            init = prophet_warm_start_params(model)
 
-    return data, model
+    return np.concatenate(blocks), model
 
-def strat_prophet(data, initial_train_period, target, ticker):
+def strat_prophet(data, initial_train_period, target, ticker, config: ProphetConfig = None,
+                  retrain_days=1, n_jobs=None):
     """
-    Predict with Facebook Prophet  
+    Predict with Facebook Prophet
+
+    Prophet is refit every retrain_days days and forecasts the (actual) dates until the next
+    refit, and Signal = 1 on the day before each date it forecasts at or above that day's price.
+    With n_jobs > 1 the refit points are split into n_jobs runs of consecutive refits that are
+    fit in parallel processes; each fit starts from the previous fit of its run (warm_start).
+
+    Parameters:
+        data (DataFrame): Stock data with required columns.
+        initial_train_period (int): Initial training period.
+        target (str): Target column prefix (e.g. 'Adj Close').
+        ticker (str): Stock ticker.
+        config (ProphetConfig, optional): Prophet configuration.
+        retrain_days (int): Retrain the model every n days.
+        n_jobs (int, optional): Number of processes (-1: one per CPU).
+
+    Returns:
+        DataFrame: Data with strategy signals.
+        model: Last fitted Prophet model.
     """
-    model = Prophet(daily_seasonality=True, yearly_seasonality=True)
+    config = config if config is not None else ProphetConfig()
 
     target_ticker = target+"_"+ticker
 
     data_simp = data[['Date',target_ticker]]
     data_simp = data_simp.rename(columns={'Date': 'ds',target_ticker:'y'})
 
-    for i in range(initial_train_period, len(data)):
-        data_simp_cut = data_simp.iloc[:i]
+    refits = [(start, min(start + retrain_days, len(data)))
+              for start in range(initial_train_period, len(data), retrain_days)]
 
-        # Prophet object can only be fit once - must instantiate a new object every time
-        model = Prophet(daily_seasonality=True, yearly_seasonality=True)
-        model.fit(data_simp_cut)
+    workers = os.cpu_count() if n_jobs == -1 else n_jobs or 1
+    runs = [list(run) for run in np.array_split(refits, min(workers, len(refits))) if len(run)]
 
-        future = model.make_future_dataframe(periods=1, include_history=False)
-        forecast = model.predict(future)
+    if len(runs) == 1:
+        predicted, model = prophet_forecasts(data_simp, runs[0], config)
+    else:
+        # The last run is fit here so its model does not have to be sent back
+        with ProcessPoolExecutor(max_workers=len(runs) - 1) as executor:
+            futures = [executor.submit(prophet_forecasts, data_simp, run, config)
+                       for run in runs[:-1]]
+            last, model = prophet_forecasts(data_simp, runs[-1], config)
+            predicted = np.concatenate([future.result()[0] for future in futures] + [last])
 
-        predicted_price_tomorrow = forecast['yhat'].iloc[0]
-        current_price = data.loc[data.index[i - 1], target_ticker]
+    # Forecast of row i is compared with the price of row i - 1, and the Signal set on row i - 1
+    rows = data.index[initial_train_period - 1:len(data) - 1]
+    current_price = data[target_ticker].to_numpy()[initial_train_period - 1:len(data) - 1]
 
-        data.loc[data.index[i-1], 'predicted_price_tomorrow'] = predicted_price_tomorrow
-        data.loc[data.index[i-1], 'Signal'] = 1 if predicted_price_tomorrow >= current_price else 0
-        # maybe also try if predicted_price_tomorrow > predicted_price_today
+    data.loc[rows, 'predicted_price_tomorrow'] = predicted
+    data.loc[rows, 'Signal'] = np.where(predicted >= current_price, 1, 0)
+    # maybe also try if predicted_price_tomorrow > predicted_price_today
 
     return data, model
 
 def strat_xgboost(
-        data, initial_train_period, xgboost_proba, retrain_days, random_state=None, n_jobs=None
+        data, initial_train_period, xgboost_proba, retrain_days, random_state=None, n_jobs=None,
+        refit=None, search=None
     ):
     """
     Predict probabilities with XGBoost
@@ -690,188 +1014,381 @@ def strat_xgboost(
         model: Trained XGBoost model.
         score: Model accuracy score.
     """
+    from xgboost import XGBClassifier
+
+    import param_search
+
     feats = [col for col in data.columns if col not in ['Date', 'Target']]
 
     # Drop rows with missing values due to rolling calculations
-    data = data.dropna().copy()
+    data = writable_copy(data.dropna())
 
     train_data = data.iloc[:initial_train_period]
     X_train, y_train = train_data[feats], train_data['Target']
 
     # Grid search for best parameters
-    pipeline = make_pipeline(
-        StandardScaler(),
-        PCA(svd_solver='full'),
-        XGBClassifier(random_state=random_state, n_jobs=n_jobs)
-    )
+    pipeline = pca_pipeline(XGBClassifier(random_state=random_state, n_jobs=n_jobs),
+                            refit=refit)
 
     param_grid = {
         "pca__n_components": [0.6,0.65,0.7,0.75,0.8,0.85,0.9,0.95],
     }
 
-    search = GridSearchCV(pipeline, param_grid, cv=TimeSeriesSplit(), n_jobs=n_jobs)
-    search.fit(X_train, y_train)
-    # print(search.best_params_)
+    best_pipeline = param_search.fit_search(
+        pipeline, param_grid, X_train, y_train, n_jobs=n_jobs, config=search
+    )
 
     return proba_loop(
-        data, initial_train_period, search.best_estimator_, xgboost_proba, retrain_days
+        data, initial_train_period, best_pipeline, xgboost_proba, retrain_days, refit
     )
 
 
-# Backtest
-def backtest_strategy(
-        data, strategy, target, ticker, config: BacktestConfig, random_state=None, **kwargs
-    ):
+# Strategy registry
+@dataclass
+class StrategyArgs:
     """
-    Backtest various trading strategies.
+    Arguments of backtest_strategy passed on to a strategy
+    """
+    target: str
+    ticker: str
+    config: BacktestConfig
+    random_state: int = None
+    initial_train_period: int = None
+    n_jobs: int = None
+
+    @property
+    def target_ticker(self) -> str:
+        """
+        Target column of the ticker (e.g. 'Close_AAPL')
+        """
+        return self.target+"_"+self.ticker
+
+@dataclass(frozen=True)
+class Strategy:
+    """
+    A strategy of backtest_strategy.
 
-    Parameters:
-        data (DataFrame): Stock data with required columns.
-        strategy (str): The strategy name ('RSI', 'VWAP', 'Bollinger', etc.)
-        config: config info
-        random_state (int): 
-        **kwargs: Additional parameters for some strategies
+    run(data, args) adds the Signal column and returns (data, model, score). backends are the
+    packages it needs (imported on first use), config the BacktestConfig fields it reads (dotted
+    for nested configs, e.g. 'proba.logit') and kwargs the keyword arguments of
+    backtest_strategy it reads.
+    """
+    name: str
+    run: Callable
+    backends: tuple = ()
+    config: tuple = ()
+    kwargs: tuple = ()
 
-    Returns:
-        tuple:
-            - DataFrame: Data with strategy signals and portfolio value.
-            - model: Forecasting model object used for predictions, if applicable.
-            - score: Model accuracy score as a float, if applicable.
+STRATEGIES = {}
+
+# Keyword arguments of backtest_strategy read by the machine learning strategies
+ML_KWARGS = ('initial_train_period', 'n_jobs')
+# BacktestConfig fields read by the walk-forward sklearn strategies (besides their proba)
+WALK_FORWARD_CONFIG = ('retrain_days', 'refit', 'search')
+
+def register(name, backends=(), config=(), kwargs=()):
+    """
+    Decorator adding a run(data, args) function to STRATEGIES under name.
     """
-    data_raw = data.copy()
-    data = data.copy() # Prevent modifying the original DataFrame
+    def decorator(run):
+        STRATEGIES[name] = Strategy(name, run, tuple(backends), tuple(config), tuple(kwargs))
+        return run
+    return decorator
 
-    og_min_date = min(data_raw['Date'])
+def get_strategy(name) -> Strategy:
+    """
+    Registered strategy of a name (ValueError if there is none).
+    """
+    if name not in STRATEGIES:
+        raise ValueError(f"Strategy '{name}' is not implemented.")
+    return STRATEGIES[name]
 
-    model = None
-    score = None
+def backend_available(backend) -> bool:
+    """
+    Whether a package is installed (without importing it).
+    """
+    return importlib.util.find_spec(backend) is not None
 
-    target_ticker = target+"_"+ticker
+def load_backends(strategy: Strategy):
+    """
+    Import the backends of a strategy (only the first call in a process does any work), raising
+    ImportError up front if one is not installed.
+    """
+    missing = [backend for backend in strategy.backends if not backend_available(backend)]
+    if missing:
+        raise ImportError(f"Strategy '{strategy.name}' needs {', '.join(missing)}, which is not "
+                          "installed.")
+    for backend in strategy.backends:
+        importlib.import_module(backend)
+
+def list_strategies(available=False) -> list:
+    """
+    Names of the registered strategies (only those whose backends are installed if available).
+    """
+    return [name for name, strategy in STRATEGIES.items()
+            if not available or all(map(backend_available, strategy.backends))]
 
-    # Strategies
-    if strategy == "Hold":
-        data['Signal'] = 1
+def strategy_schema(name, config: BacktestConfig = None) -> dict:
+    """
+    What a strategy reads and needs.
 
-    elif strategy == "SMA":
-        data['Signal'] = 1
-        data.loc[data['MA_S'] <= data['MA_L'], 'Signal'] = 0
+    Parameters:
+        name (str): Strategy name.
+        config (BacktestConfig, optional): Configuration to read values from (default:
+            BacktestConfig()).
 
-    elif strategy == 'RSI':
-        data['Signal'] = 1
-        data.loc[data['RSI'] > config.overbought, 'Signal'] = 0
+    Returns:
+        dict: {'name', 'backends': {backend: installed}, 'config': {field: value},
+            'kwargs': [keyword arguments]}
+    """
+    strategy = get_strategy(name)
+    config = config if config is not None else BacktestConfig()
+
+    values = {}
+    for path in strategy.config:
+        value = config
+        for attr in path.split('.'):
+            value = getattr(value, attr)
+        values[path] = value
+
+    return {
+        'name': name,
+        'backends': {backend: backend_available(backend) for backend in strategy.backends},
+        'config': values,
+        'kwargs': list(strategy.kwargs),
+    }
 
-    elif strategy == 'VWAP':
-        data['Signal'] = 1
-        data.loc[data[target_ticker] > data['VWAP'], 'Signal'] = 0
+# Rule based strategies
+@register('Hold')
+def run_hold(data, args): # pylint: disable=unused-argument
+    """Always hold"""
+    data['Signal'] = 1
+    return data, None, None
+
+@register('SMA')
+def run_sma(data, args): # pylint: disable=unused-argument
+    """Hold while the short moving average is above the long one"""
+    data['Signal'] = 1
+    data.loc[data['MA_S'] <= data['MA_L'], 'Signal'] = 0
+    return data, None, None
+
+@register('RSI', config=('overbought',))
+def run_rsi(data, args):
+    """Hold unless RSI is overbought"""
+    data['Signal'] = 1
+    data.loc[data['RSI'] > args.config.overbought, 'Signal'] = 0
+    return data, None, None
+
+@register('VWAP')
+def run_vwap(data, args):
+    """Hold while the price is at or below VWAP"""
+    data['Signal'] = 1
+    data.loc[data[args.target_ticker] > data['VWAP'], 'Signal'] = 0
+    return data, None, None
+
+@register('Bollinger')
+def run_bollinger(data, args):
+    """Hold while the price is at or below the upper Bollinger band"""
+    data['Signal'] = 1
+    data.loc[data[args.target_ticker] > data['Bollinger_Upper'], 'Signal'] = 0
+    return data, None, None
+
+@register('Breakout', config=('bko_window',))
+def run_breakout(data, args):
+    """Hold unless the price breaks below the low of the last bko_window days"""
+    window = args.config.bko_window
+    data['High_Max'] = data['High_'+args.ticker].rolling(window=window).max().shift(1)
+    data['Low_Min'] = data['Low_'+args.ticker].rolling(window=window).min().shift(1)
+    data['Signal'] = 1
+    data.loc[data[args.target_ticker] < data['Low_Min'], 'Signal'] = 0
+    return data, None, None
+
+@register('Perfection')
+def run_perfection(data, args): # pylint: disable=unused-argument
+    """Hold exactly when the target goes up (upper bound)"""
+    data['Signal'] = 1
+    data.loc[data['Target']==-1, 'Signal'] = -1
+    return data, None, None
+
+# Machine learning strategies
+@register('Prophet', backends=('prophet',), config=('prophet', 'retrain_days'), kwargs=ML_KWARGS)
+def run_prophet(data, args):
+    """strat_prophet"""
+    data, model = strat_prophet(
+        data, args.initial_train_period, args.target, args.ticker, config=args.config.prophet,
+        retrain_days=args.config.retrain_days, n_jobs=args.n_jobs
+    )
+    return data, model, None
+
+@register('Logit', backends=('sklearn',), config=('proba.logit',) + WALK_FORWARD_CONFIG,
+          kwargs=ML_KWARGS)
+def run_logit(data, args):
+    """strat_logit"""
+    config = args.config
+    return strat_logit(
+        data, args.initial_train_period, config.proba.logit, config.retrain_days,
+        n_jobs=args.n_jobs, refit=config.refit, search=config.search
+    )
 
-    elif strategy == 'Bollinger':
-        data['Signal'] = 1
-        data.loc[data[target_ticker] > data['Bollinger_Upper'], 'Signal'] = 0
+@register('RandomForest', backends=('sklearn',), config=('proba.rf',) + WALK_FORWARD_CONFIG,
+          kwargs=ML_KWARGS)
+def run_random_forest(data, args):
+    """strat_random_forest"""
+    config = args.config
+    return strat_random_forest(
+        data, args.initial_train_period, config.proba.rf, config.retrain_days, args.random_state,
+        args.n_jobs, refit=config.refit, search=config.search
+    )
 
-    elif strategy == 'Breakout':
-        data['High_Max'] = data['High_'+ticker].rolling(window=config.bko_window).max().shift(1)
-        data['Low_Min'] = data['Low_'+ticker].rolling(window=config.bko_window).min().shift(1)
-        data['Signal'] = 1
-        data.loc[data[target_ticker] < data['Low_Min'], 'Signal'] = 0
+@register('KNN', backends=('sklearn',), config=('proba.knn',) + WALK_FORWARD_CONFIG,
+          kwargs=ML_KWARGS)
+def run_knn(data, args):
+    """strat_knn"""
+    config = args.config
+    return strat_knn(
+        data, args.initial_train_period, config.proba.knn, config.retrain_days, args.n_jobs,
+        refit=config.refit, search=config.search
+    )
 
-    elif strategy == "Prophet":
-        initial_train_period = kwargs.get('initial_train_period')
-        data, model = strat_prophet(data, initial_train_period, target, ticker)
+@register('KNN_2', backends=('sklearn',), config=('proba.knn',) + WALK_FORWARD_CONFIG,
+          kwargs=ML_KWARGS)
+def run_knn_2(data, args):
+    """KNN through generic_sklearn_strategy"""
+    from sklearn.neighbors import KNeighborsClassifier
 
-    elif strategy == "Logit":
-        initial_train_period = kwargs.get('initial_train_period')
-        n_jobs = kwargs.get('n_jobs')
-        data, model, score = strat_logit(
-            data, initial_train_period, config.proba.logit, config.retrain_days, n_jobs=n_jobs
-        )
+    config = args.config
+    param_grid = {
+        "pca__n_components": [0.6,0.65,0.7,0.75,0.8,0.85,0.9,0.95]
+    }
+    return generic_sklearn_strategy(
+        data, args.initial_train_period, KNeighborsClassifier, param_grid, config.retrain_days,
+        proba_threshold=config.proba.knn, n_jobs=args.n_jobs, refit=config.refit,
+        search=config.search
+    )
 
-    elif strategy == "RandomForest":
-        initial_train_period = kwargs.get('initial_train_period')
-        n_jobs = kwargs.get('n_jobs')
-        data, model, score = strat_random_forest(
-            data, initial_train_period, config.proba.rf, config.retrain_days, random_state, n_jobs
-        )
+@register('GradientBoosting', backends=('sklearn',),
+          config=('proba.gradb',) + WALK_FORWARD_CONFIG, kwargs=('initial_train_period',))
+def run_gradient_boost(data, args):
+    """strat_gradient_boost"""
+    config = args.config
+    return strat_gradient_boost(
+        data, args.initial_train_period, config.proba.gradb, config.retrain_days,
+        args.random_state, refit=config.refit, search=config.search
+    )
 
-    elif strategy == "KNN":
-        initial_train_period = kwargs.get('initial_train_period')
-        n_jobs = kwargs.get('n_jobs')
-        data, model, score = strat_knn(
-            data, initial_train_period, config.proba.knn, config.retrain_days, n_jobs
-        )
+@register('GradientBoosting_2', backends=('sklearn',), config=WALK_FORWARD_CONFIG,
+          kwargs=('initial_train_period',))
+def run_gradient_boost_2(data, args):
+    """GradientBoosting through generic_sklearn_strategy"""
+    from sklearn.ensemble import GradientBoostingClassifier
 
-    elif strategy == "KNN_2":
-        initial_train_period = kwargs.get('initial_train_period')
-        n_jobs = kwargs.get('n_jobs')
-        param_grid = {
-            "pca__n_components": [0.6,0.65,0.7,0.75,0.8,0.85,0.9,0.95]
-        }
-        data, model, score = generic_sklearn_strategy(
-                data, initial_train_period, KNeighborsClassifier, param_grid,
-                config.retrain_days, proba_threshold=config.proba.knn, n_jobs=n_jobs
-        )
+    config = args.config
+    param_grid = {
+        "pca__n_components": [0.6,0.65,0.7,0.75,0.8,0.85,0.9,0.95]
+    }
+    return generic_sklearn_strategy(
+        data, args.initial_train_period, GradientBoostingClassifier, param_grid,
+        config.retrain_days, proba_threshold=0.5, random_state=None, n_jobs=None,
+        refit=config.refit, search=config.search
+    )
 
-    elif strategy == "GradientBoosting":
-        initial_train_period = kwargs.get('initial_train_period')
-        data, model, score = strat_gradient_boost(
-            data, initial_train_period, config.proba.gradb, config.retrain_days,random_state
-        )
+@register('XGBoost', backends=('sklearn', 'xgboost'),
+          config=('proba.xgboost',) + WALK_FORWARD_CONFIG, kwargs=ML_KWARGS)
+def run_xgboost(data, args):
+    """strat_xgboost"""
+    config = args.config
+    return strat_xgboost(
+        data, args.initial_train_period, config.proba.xgboost, config.retrain_days,
+        args.random_state, args.n_jobs, refit=config.refit, search=config.search
+    )
 
-    elif strategy == "GradientBoosting_2":
-        initial_train_period = kwargs.get('initial_train_period')
-        param_grid = {
-            "pca__n_components": [0.6,0.65,0.7,0.75,0.8,0.85,0.9,0.95]
-        }
-        data, model, score = generic_sklearn_strategy(
-                data, initial_train_period, GradientBoostingClassifier, param_grid,
-                config.retrain_days, proba_threshold=0.5, random_state=None, n_jobs=None
-        )
+@register('SVC', backends=('sklearn',), config=WALK_FORWARD_CONFIG,
+          kwargs=('initial_train_period',))
+def run_svc(data, args):
+    """strat_svc"""
+    config = args.config
+    return strat_svc(
+        data, args.initial_train_period, config.retrain_days, args.random_state,
+        refit=config.refit, search=config.search
+    )
 
-    elif strategy == "XGBoost":
-        initial_train_period = kwargs.get('initial_train_period')
-        n_jobs = kwargs.get('n_jobs')
-        data, model, score = strat_xgboost(
-            data, initial_train_period, config.proba.xgboost, config.retrain_days,
-            random_state, n_jobs
-        )
+@register('SVC_proba', backends=('sklearn',), config=('proba.svc',) + WALK_FORWARD_CONFIG,
+          kwargs=('initial_train_period',))
+def run_svc_proba(data, args):
+    """strat_svc_proba"""
+    config = args.config
+    return strat_svc_proba(
+        data, args.initial_train_period, config.proba.svc, config.retrain_days,
+        args.random_state, refit=config.refit, search=config.search
+    )
 
-    elif strategy == "SVC":
-        initial_train_period = kwargs.get('initial_train_period')
-        data, model, score = strat_svc(
-            data, initial_train_period, config.retrain_days, random_state
-        )
+@register('LinearSVC', backends=('sklearn',), config=WALK_FORWARD_CONFIG,
+          kwargs=('initial_train_period',))
+def run_linear_svc(data, args):
+    """strat_linear_svc"""
+    config = args.config
+    return strat_linear_svc(
+        data, args.initial_train_period, config.retrain_days, args.random_state,
+        refit=config.refit, search=config.search
+    )
 
-    elif strategy == "SVC_proba":
-        initial_train_period = kwargs.get('initial_train_period')
-        data, model, score = strat_svc_proba(
-            data, initial_train_period, config.proba.svc, config.retrain_days, random_state
-        )
+@register('MLP', backends=('sklearn',), config=('proba.mlp',) + WALK_FORWARD_CONFIG,
+          kwargs=ML_KWARGS)
+def run_mlp(data, args):
+    """strat_mlp"""
+    config = args.config
+    return strat_mlp(
+        data, args.initial_train_period, config.proba.mlp, config.retrain_days,
+        random_state=args.random_state, n_jobs=args.n_jobs, refit=config.refit,
+        search=config.search
+    )
 
-    elif strategy == "LinearSVC":
-        initial_train_period = kwargs.get('initial_train_period')
-        data, model, score = strat_linear_svc(
-            data, initial_train_period, config.retrain_days, random_state
-        )
+@register('Keras', backends=('sklearn', 'tensorflow', 'keras'), config=('keras', 'retrain_days'),
+          kwargs=('initial_train_period',))
+def run_keras(data, args):
+    """strat_keras"""
+    data, model = strat_keras(
+        data, args.initial_train_period, config=args.config.keras,
+        retrain_days=args.config.retrain_days, random_state=args.random_state
+    )
+    return data, model, None
 
-    elif strategy == "MLP":
-        initial_train_period = kwargs.get('initial_train_period')
-        n_jobs = kwargs.get('n_jobs')
-        data, model, score = strat_mlp(
-            data, initial_train_period, config.proba.mlp, config.retrain_days,
-            random_state=random_state, n_jobs=n_jobs
-        )
 
-    elif strategy == "Keras":
-        initial_train_period = kwargs.get('initial_train_period')
-        data, model = strat_keras(
-            data, initial_train_period, config=config.keras, random_state=random_state
-        )
+# Backtest
+def backtest_strategy(
+        data, strategy, target, ticker, config: BacktestConfig, random_state=None, **kwargs
+    ):
+    """
+    Backtest various trading strategies.
 
-    elif strategy == "Perfection":
-        data['Signal'] = 1
-        data.loc[data['Target']==-1, 'Signal'] = -1
+    The strategy is looked up in STRATEGIES, and its backends (sklearn, tensorflow, ...) are
+    imported the first time it runs in a process.
 
-    else:
-        raise ValueError(f"Strategy '{strategy}' is not implemented.")
+    Parameters:
+        data (DataFrame): Stock data with required columns.
+        strategy (str): The strategy name ('RSI', 'VWAP', 'Bollinger', etc., see
+            list_strategies)
+        config: config info
+        random_state (int): 
+        **kwargs: Additional parameters for some strategies (initial_train_period, n_jobs)
+
+    Returns:
+        tuple:
+            - DataFrame: Data with strategy signals and portfolio value.
+            - model: Forecasting model object used for predictions, if applicable.
+            - score: Model accuracy score as a float, if applicable.
+    """
+    strategy = get_strategy(strategy)
+    load_backends(strategy)
+
+    data_raw = data # only read
+    data = writable_copy(data) # Prevent modifying the original DataFrame
+
+    og_min_date = min(data_raw['Date'])
+
+    args = StrategyArgs(target, ticker, config, random_state,
+                        kwargs.get('initial_train_period'), kwargs.get('n_jobs'))
+    data, model, score = strategy.run(data, args)
 
     # Stack on older data where had a training period, assume held stock during that time
     #   might not this need anymore since rolling calculations applied in prep_data
@@ -0,0 +1,157 @@
+"""Vectorized parameter sweeps for the rule based strategies of backtest_strategy"""
+
+from dataclasses import dataclass
+from itertools import product
+
+import numpy as np
+import pandas as pd
+
+import indicators
+
+# Parameters swept for each strategy, in axis order of the results tensors
+SWEEP_PARAMS = {
+    'SMA': ('short_window', 'long_window'),
+    'RSI': ('rsi_window', 'overbought'),
+    'VWAP': (),
+    'Bollinger': ('window', 'num_std'),
+    'Breakout': ('bko_window',),
+}
+
+
+@dataclass
+class SweepResult:
+    """
+    Results tensors of a parameter sweep, with one axis per swept parameter
+    """
+    strategy: str
+    params: dict
+    cumulative_return: np.ndarray
+    sharpe: np.ndarray
+    max_drawdown: np.ndarray
+
+    def to_frame(self) -> pd.DataFrame:
+        """
+        One row per parameter combination.
+        """
+        names = list(self.params)
+        combos = list(product(*self.params.values()))
+        sweep_df = pd.DataFrame(combos, columns=names)
+        sweep_df['cumulative_return'] = self.cumulative_return.ravel()
+        sweep_df['sharpe'] = self.sharpe.ravel()
+        sweep_df['max_drawdown'] = self.max_drawdown.ravel()
+        return sweep_df
+
+    def best(self, metric='sharpe') -> dict:
+        """
+        Parameters of the best combination by a metric (max_drawdown: closest to 0).
+        """
+        values = getattr(self, metric)
+        idx = np.unravel_index(np.nanargmax(values), values.shape)
+        return {name: grid[i] for (name, grid), i in zip(self.params.items(), idx)}
+
+
+def _performance(signal, daily_return, start, periods_per_year, held_return=None):
+    """
+    Cumulative return, Sharpe ratio and max drawdown of signals (dates x combinations...).
+
+    Returns are Signal (yesterday) * Daily_Return, as in backtest_strategy, measured from the
+    row after start. held_return replaces the returns of the rows from the second on.
+    """
+    strategy_return = signal[:-1] * daily_return[1:].reshape((-1,) + (1,) * (signal.ndim - 1))
+    if held_return is not None:
+        strategy_return[:len(held_return)] = held_return.reshape(
+            (-1,) + (1,) * (signal.ndim - 1)
+        )
+    strategy_return = np.nan_to_num(strategy_return[start:])
+
+    equity = np.cumprod(1 + strategy_return, axis=0)
+    cumulative_return = equity[-1] - 1
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        sharpe = (np.sqrt(periods_per_year) * strategy_return.mean(axis=0) /
+                  strategy_return.std(axis=0, ddof=1))
+
+    max_drawdown = (equity / np.maximum.accumulate(equity, axis=0) - 1).min(axis=0)
+
+    return cumulative_return, sharpe, max_drawdown
+
+def sweep_strategy(data, strategy, target, ticker, grid=None, start=0, periods_per_year=252,
+                   initial_train_period=None):
+    """
+    Evaluate every parameter combination of a rule based strategy in one vectorized pass.
+
+    Indicators are computed from the data itself, so include enough history before start for
+    the longest window. Signals follow backtest_strategy (1 unless the rule says 0), and so do
+    returns: with initial_train_period, a ticker other than SPY earns Daily_Return_SPY up to
+    that row (by position: data indexed from 0, as from prepare_backtest_data).
+
+    Parameters:
+        data (DataFrame): Stock data with Date, Daily_Return, {target}_{ticker} (and
+            Low_{ticker} and Volume_{ticker} for Breakout and VWAP).
+        strategy (str): 'SMA', 'RSI', 'VWAP', 'Bollinger' or 'Breakout'.
+        target (str): column to predict (usually Adj Close)
+        ticker (str): Stock ticker
+        grid (dict): Values to sweep for each parameter in SWEEP_PARAMS[strategy], e.g.
+            {'short_window': [5, 10, 20], 'long_window': [50, 100, 200]}.
+        start (int): First row (position) of the evaluation period.
+        periods_per_year (int): Periods per year for the annualized Sharpe ratio.
+        initial_train_period (int, optional): Last row of the training period, as passed to
+            backtest_strategy.
+
+    Returns:
+        SweepResult: Cumulative return, Sharpe ratio and max drawdown per combination.
+    """
+    if strategy not in SWEEP_PARAMS:
+        raise ValueError(f"Strategy '{strategy}' can not be swept.")
+
+    grid = grid or {}
+    params = {name: np.asarray(grid[name]) for name in SWEEP_PARAMS[strategy]}
+
+    price = data[target+"_"+ticker].to_numpy(dtype=np.float64)
+    daily_return = data['Daily_Return'].to_numpy(dtype=np.float64)
+
+    # SPY held over the training period
+    held_return = None
+    if ticker != 'SPY' and initial_train_period is not None:
+        held_return = data['Daily_Return_SPY'].to_numpy(dtype=np.float64)[
+            1:initial_train_period+1
+        ]
+
+    volumes = None
+    if strategy == 'VWAP':
+        volumes = data["Volume_"+ticker].to_numpy(dtype=np.float64)
+    engine = indicators.IndicatorEngine(price, volumes)
+
+    with np.errstate(invalid='ignore'):
+        if strategy == 'SMA':
+            ma_s = np.stack([engine.rolling_mean(w)[:, 0] for w in params['short_window']], 1)
+            ma_l = np.stack([engine.rolling_mean(w)[:, 0] for w in params['long_window']], 1)
+            sell = ma_s[:, :, None] <= ma_l[:, None, :]
+
+        elif strategy == 'RSI':
+            rsi = np.stack([engine.rsi(w)[:, 0] for w in params['rsi_window']], 1)
+            sell = rsi[:, :, None] > params['overbought'][None, None, :]
+
+        elif strategy == 'VWAP':
+            sell = price > engine.vwap()[:, 0]
+
+        elif strategy == 'Bollinger':
+            ma_b = np.stack([engine.rolling_mean(w)[:, 0] for w in params['window']], 1)
+            std = np.stack([engine.rolling_std(w)[:, 0] for w in params['window']], 1)
+            upper = ma_b[:, :, None] + params['num_std'][None, None, :] * std[:, :, None]
+            sell = price[:, None, None] > upper
+
+        else: # Breakout
+            low = data['Low_'+ticker]
+            low_min = np.stack([low.rolling(window=w).min().shift(1).to_numpy()
+                                for w in params['bko_window']], 1)
+            sell = price[:, None] < low_min
+
+    signal = np.where(sell, 0.0, 1.0)
+
+    cumulative_return, sharpe, max_drawdown = _performance(
+        signal, daily_return, start, periods_per_year, held_return
+    )
+
+    return SweepResult(strategy, {name: values.tolist() for name, values in params.items()},
+                       cumulative_return, sharpe, max_drawdown)
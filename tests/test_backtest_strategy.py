@@ -0,0 +1,37 @@
+"""backtest_strategy on the rule based strategies"""
+
+import numpy as np
+import pandas as pd
+
+import prep_data
+import strat_defs
+from bench_memory import synthetic_data
+
+RULE_STRATEGIES = ['Hold', 'SMA', 'RSI', 'VWAP', 'Bollinger', 'Breakout']
+
+
+def test_rule_strategies_leave_the_input_unchanged(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    frames = synthetic_data(3, 500)
+    config = prep_data.IndicatorConfig(ticker='T000')
+    prepd_data = prep_data.prep_data(*frames, config=config, drop_tickers=True)
+    before = prepd_data.copy()
+
+    for strategy in RULE_STRATEGIES:
+        data, _, _ = strat_defs.backtest_strategy(prepd_data, strategy, config.target, 'T000',
+                                                  strat_defs.BacktestConfig())
+        assert 'Strategy_Return' in data.columns
+
+    pd.testing.assert_frame_equal(prepd_data, before)
+
+def test_writable_copy_is_shallow_with_copy_on_write():
+    data = pd.DataFrame({'a': np.arange(5.0)})
+    copy = strat_defs.writable_copy(data)
+    copy['b'] = 1.0
+    copy.loc[0, 'a'] = -1.0
+
+    assert list(data.columns) == ['a']
+    assert data.loc[0, 'a'] == 0.0
+    if strat_defs.copy_on_write():
+        assert np.shares_memory(strat_defs.writable_copy(data)['a'].to_numpy(),
+                                data['a'].to_numpy())
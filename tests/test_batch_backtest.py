@@ -0,0 +1,151 @@
+"""run_batch against serial backtests"""
+
+import time
+from dataclasses import replace
+
+import pandas as pd
+from threadpoolctl import threadpool_info
+
+import batch_backtest
+import prep_data
+import strat_defs
+from bench_memory import synthetic_data
+
+
+def compact_frames(n_tickers, n_days):
+    """
+    Synthetic frames with float32 prices, as prep_data.load_data(compact=True) returns them.
+    """
+    stocks_df, wiki_pageviews, *rest = synthetic_data(n_tickers, n_days)
+    return (prep_data.compact_dtypes(stocks_df), prep_data.compact_dtypes(wiki_pageviews), *rest)
+
+def results_by_job(results) -> dict:
+    """
+    Results of a batch keyed by (ticker, strategy), failing on any job error.
+    """
+    results = list(results)
+    assert [result.error for result in results] == [None] * len(results)
+    return {(result.ticker, result.strategy): result for result in results}
+
+def run_slowly(data, args): # pylint: disable=unused-argument
+    """Hold, after a pause long enough for the other jobs of a batch to finish first"""
+    time.sleep(2)
+    data['Signal'] = 1
+    return data, None, None
+
+def run_failing(data, args):
+    """Fail like a strategy missing a column"""
+    raise KeyError(args.target_ticker)
+
+def run_thread_probe(data, args):
+    """Hold, scoring with the thread limits of the worker"""
+    data['Signal'] = 1
+    return data, None, {'n_jobs': args.n_jobs,
+                        'threads': [pool['num_threads'] for pool in threadpool_info()]}
+
+def register_for_test(monkeypatch, name, run):
+    """
+    Register a strategy for one test (forked workers inherit it).
+    """
+    monkeypatch.setitem(strat_defs.STRATEGIES, name, strat_defs.Strategy(name, run))
+
+def test_fork_pool_matches_serial_backtests(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    frames = synthetic_data(3, 400)
+    config = batch_backtest.BatchConfig()
+    jobs = [(ticker, strategy, strat_defs.BacktestConfig())
+            for ticker in ['T001', 'T000'] for strategy in ['SMA', 'RSI']]
+
+    results = results_by_job(batch_backtest.run_batch(jobs, *frames, config=config,
+                                                      max_workers=2))
+
+    assert sorted(results) == sorted((ticker, strategy) for ticker, strategy, _ in jobs)
+    for (ticker, strategy), result in results.items():
+        indicator = replace(config.indicator, ticker=ticker, target=config.target)
+        prepd_data = prep_data.prep_data(*frames, config=indicator,
+                                         drop_tickers=config.drop_tickers)
+        data, _, score = strat_defs.backtest_strategy(
+            batch_backtest.prepare_backtest_data(prepd_data, ticker, config), strategy,
+            config.target, ticker, strat_defs.BacktestConfig(),
+            initial_train_period=config.initial_train_period, random_state=config.random_state
+        )
+        pd.testing.assert_frame_equal(result.data, data)
+        assert result.score == score
+
+def test_results_stream_as_jobs_finish(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    register_for_test(monkeypatch, 'Slow', run_slowly)
+    frames = synthetic_data(3, 300)
+    jobs = [('T000', 'Slow', strat_defs.BacktestConfig()),
+            ('T001', 'Hold', strat_defs.BacktestConfig())]
+
+    results = list(batch_backtest.run_batch(jobs, *frames, max_workers=2))
+
+    assert [(result.ticker, result.strategy) for result in results] == [
+        ('T001', 'Hold'), ('T000', 'Slow')
+    ]
+
+def test_failing_job_reports_its_error(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    register_for_test(monkeypatch, 'Failing', run_failing)
+    frames = synthetic_data(3, 300)
+    jobs = [(ticker, strategy, strat_defs.BacktestConfig())
+            for ticker in ['T000', 'T001'] for strategy in ['Failing', 'Hold']]
+
+    results = {(result.ticker, result.strategy): result
+               for result in batch_backtest.run_batch(jobs, *frames, max_workers=2)}
+
+    for ticker in ['T000', 'T001']:
+        failed = results[(ticker, 'Failing')]
+        assert failed.error == f"KeyError: 'Adj Close_{ticker}'"
+        assert failed.data is None
+        assert results[(ticker, 'Hold')].error is None
+        assert 'Strategy_Return' in results[(ticker, 'Hold')].data.columns
+
+def test_workers_share_the_cores(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    register_for_test(monkeypatch, 'ThreadProbe', run_thread_probe)
+    monkeypatch.setattr(batch_backtest.os, 'cpu_count', lambda: 4)
+    frames = synthetic_data(3, 300)
+    jobs = [(ticker, 'ThreadProbe', strat_defs.BacktestConfig()) for ticker in ['T000', 'T001']]
+
+    for result in results_by_job(batch_backtest.run_batch(jobs, *frames,
+                                                          max_workers=2)).values():
+        assert result.score['n_jobs'] == 2
+        # Every pool at the cap, whatever its default on this machine
+        assert result.score['threads']
+        assert set(result.score['threads']) == {2}
+
+def test_wide_cache_matches_pivoting(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    frames = compact_frames(3, 400)
+    jobs = [(ticker, strategy, strat_defs.BacktestConfig())
+            for ticker in ['T000', 'T001'] for strategy in ['SMA', 'VWAP']]
+
+    pivoted = results_by_job(batch_backtest.run_batch(jobs, *frames, max_workers=1))
+    config = batch_backtest.BatchConfig(wide_cache=str(tmp_path / 'wide'))
+    wide = results_by_job(batch_backtest.run_batch(jobs, *frames, config=config, max_workers=1))
+
+    assert (tmp_path / 'wide').is_dir()
+    assert wide.keys() == pivoted.keys()
+    for job, result in wide.items():
+        pd.testing.assert_frame_equal(result.data, pivoted[job].data, check_like=True)
+        assert result.score == pivoted[job].score
+
+def test_indicator_engine_matches_per_ticker_indicators(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    frames = synthetic_data(3, 400)
+    jobs = [(ticker, 'Bollinger', strat_defs.BacktestConfig()) for ticker in ['T000', 'T001']]
+
+    direct = results_by_job(batch_backtest.run_batch(jobs, *frames, max_workers=1))
+
+    # The forked workers must take every indicator from the engine
+    def per_ticker_rsi(*args, **kwargs):
+        raise AssertionError("per-ticker indicators computed")
+    monkeypatch.setattr(prep_data, 'calculate_rsi_wide', per_ticker_rsi)
+    config = batch_backtest.BatchConfig(indicator_engine=True)
+    batched = results_by_job(batch_backtest.run_batch(jobs, *frames, config=config,
+                                                      max_workers=1))
+
+    for job, result in batched.items():
+        pd.testing.assert_frame_equal(result.data, direct[job].data, rtol=1e-9)
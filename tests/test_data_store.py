@@ -0,0 +1,62 @@
+"""Versions and deltas of the columnar store"""
+
+import json
+import os
+
+import pandas as pd
+import pytest
+
+import data_store
+
+
+def prices(tickers, dates, price):
+    """
+    stocks_df rows of some tickers and dates at one price.
+    """
+    index = pd.MultiIndex.from_product([tickers, pd.to_datetime(dates)], names=['ticker', 'Date'])
+    return pd.DataFrame({'Adj Close': price}, index=index).reset_index()
+
+def test_delta_in_the_same_second_as_its_parent(tmp_path):
+    root = str(tmp_path)
+    parent = data_store.write_dataset('stocks_df', prices(['SPY', 'AAPL'], ['2024-01-02'], 1.0),
+                                      root=root)
+    version = data_store.write_delta('stocks_df', prices(['SPY'], ['2024-01-03'], 2.0),
+                                     keys=['ticker', 'Date'], root=root)
+
+    assert version > parent
+    assert data_store.read_manifest('stocks_df', version, root)['parent'] == parent
+    stored = data_store.read_dataset('stocks_df', root=root)
+    assert stored.groupby('ticker').size().to_dict() == {'AAPL': 1, 'SPY': 2}
+
+    with pytest.raises(ValueError):
+        data_store.write_dataset('stocks_df', prices(['SPY'], ['2024-01-04'], 3.0),
+                                 version=version, parent=version, root=root)
+
+def test_parent_cycle_raises(tmp_path):
+    root = str(tmp_path)
+    first = data_store.write_dataset('stocks_df', prices(['SPY'], ['2024-01-02'], 1.0),
+                                     root=root)
+    second = data_store.write_delta('stocks_df', prices(['SPY'], ['2024-01-03'], 2.0),
+                                    keys=['ticker', 'Date'], root=root)
+
+    # A store whose first version points back at the second one
+    manifest_path = os.path.join(root, 'stocks_df', first, data_store.MANIFEST)
+    with open(manifest_path, "r", encoding="utf-8") as f:
+        manifest = json.load(f)
+    manifest['parent'] = second
+    with open(manifest_path, "w", encoding="utf-8") as f:
+        json.dump(manifest, f)
+
+    with pytest.raises(ValueError, match='its own ancestor'):
+        data_store.read_dataset('stocks_df', root=root)
+
+def test_delta_on_a_second_resolution_version(tmp_path):
+    root = str(tmp_path)
+    parent = data_store.write_dataset('stocks_df', prices(['SPY'], ['2024-01-02'], 1.0),
+                                      version='20240102030405', root=root)
+    version = data_store.write_delta('stocks_df', prices(['SPY'], ['2024-01-03'], 2.0),
+                                     keys=['ticker', 'Date'], root=root)
+
+    assert data_store.list_versions('stocks_df', root) == [parent, version]
+    assert data_store.read_manifest('stocks_df', version, root)['parent'] == parent
+    assert len(data_store.read_dataset('stocks_df', root=root)) == 2
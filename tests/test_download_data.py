@@ -0,0 +1,278 @@
+"""Downloaders against recorded responses served by fetch_utils.ReplayServer"""
+
+import importlib
+import json
+import sys
+import threading
+import types
+import urllib.error
+import urllib.parse
+import urllib.request
+from datetime import date
+from unittest import mock
+
+import pandas as pd
+import pytest
+
+from fetch_utils import ReplayServer
+
+
+def stand_in_requests():
+    """
+    The part of requests the downloaders use (Session.get, get and Response), over urllib.
+    """
+    module = types.ModuleType('requests')
+    module.exceptions = types.SimpleNamespace(
+        ConnectionError=type('ConnectionError', (OSError,), {}),
+        Timeout=type('Timeout', (OSError,), {}),
+        HTTPError=type('HTTPError', (OSError,), {}),
+    )
+    module.adapters = types.SimpleNamespace(HTTPAdapter=lambda **kwargs: None)
+
+    class Response:
+        """Status and body of a response"""
+        def __init__(self, status_code, text):
+            self.status_code = status_code
+            self.text = text
+
+        def json(self):
+            return json.loads(self.text)
+
+        def raise_for_status(self):
+            if self.status_code >= 400:
+                raise module.exceptions.HTTPError(f"{self.status_code}: {self.text}")
+
+    class Session:
+        """GET requests with shared headers"""
+        def __init__(self):
+            self.headers = {}
+
+        def mount(self, prefix, adapter):
+            pass
+
+        def get(self, url, params=None, timeout=None):
+            if params:
+                url += '?' + urllib.parse.urlencode(params)
+            headers = {name: value for name, value in self.headers.items() if value is not None}
+            try:
+                with urllib.request.urlopen(urllib.request.Request(url, headers=headers),
+                                            timeout=timeout) as response:
+                    return Response(response.status, response.read().decode())
+            except urllib.error.HTTPError as e:
+                return Response(e.code, e.read().decode())
+            except urllib.error.URLError as e:
+                raise module.exceptions.ConnectionError(str(e)) from e
+
+    module.Session = Session
+    module.get = lambda url, **kwargs: Session().get(url, **kwargs)
+    return module
+
+def stand_in(name, **attributes):
+    """
+    Module with only the given attributes.
+    """
+    module = types.ModuleType(name)
+    module.__dict__.update(attributes)
+    return module
+
+# Used by download_data only when the packages are not installed. yf itself is replaced by
+# ReplayYahoo and the other two are only used by downloaders not tested here
+STAND_INS = {
+    'requests': stand_in_requests,
+    'yfinance': lambda: stand_in('yfinance'),
+    'dotenv': lambda: stand_in('dotenv', load_dotenv=lambda *args, **kwargs: None),
+    'fredapi': lambda: stand_in('fredapi', Fred=None),
+}
+
+def import_download_data():
+    """
+    Import download_data, with stand-ins for the packages that are not installed.
+    """
+    missing = {}
+    for name, build in STAND_INS.items():
+        try:
+            importlib.import_module(name)
+        except ImportError:
+            missing[name] = build()
+    with mock.patch.dict(sys.modules, missing):
+        return importlib.import_module('download_data')
+
+download_data = import_download_data()
+requests = download_data.requests
+
+
+def chart(dates, price):
+    """
+    Recorded daily prices of a ticker.
+    """
+    n = len(dates)
+    return {'status': 200, 'body': {
+        'Date': dates, 'Open': [price] * n, 'High': [price + 1] * n, 'Low': [price - 1] * n,
+        'Close': [price] * n, 'Adj Close': [price] * n, 'Volume': [1000] * n
+    }}
+
+def recordings():
+    """
+    Recorded responses of every downloader (the wiki end date is always yesterday).
+    """
+    yesterday = (date.today() - pd.Timedelta(days=1)).strftime('%Y%m%d')
+    items = [{'timestamp': '2015070100', 'views': 10}, {'timestamp': '2015070200', 'views': 12}]
+    dates = ['2024-01-02', '2024-01-03']
+
+    def noaa_key(start, end):
+        params = {'datasetid': 'GHCND', 'stationid': download_data.STATIONID,
+                  'startdate': start, 'enddate': end, 'units': 'metric', 'limit': 1000}
+        return f"GET /noaa?{urllib.parse.urlencode(params)}"
+
+    return {
+        # Rate limited once, then served
+        f"GET /wiki/Apple_Inc./daily/{download_data.WIKI_SDATE}/{yesterday}": [
+            {'status': 429, 'body': 'Too many requests'}, {'status': 200, 'body': {'items': items}}
+        ],
+        f"GET /wiki/Alphabet_Inc./daily/{download_data.WIKI_SDATE}/{yesterday}": [
+            {'status': 200, 'body': {'items': items}}
+        ],
+        f"GET /wiki/Empty/daily/{download_data.WIKI_SDATE}/{yesterday}": [
+            {'status': 200, 'body': {'items': []}}
+        ],
+        noaa_key('2020-01-01', '2020-01-30'): [{'status': 200, 'body': {'results': [
+            {'date': '2020-01-01T00:00:00', 'datatype': 'TMAX', 'value': 5.0},
+            {'date': '2020-01-01T00:00:00', 'datatype': 'TMIN', 'value': -1.0},
+        ]}}],
+        noaa_key('2020-01-31', '2020-02-15'): [{'status': 200, 'body': {'results': [
+            {'date': '2020-02-01T00:00:00', 'datatype': 'PRCP', 'value': 2.5},
+        ]}}],
+        "GET /observations": [{'status': 200, 'body': {'features': [
+            {'properties': {'@id': 'a', 'timestamp': '2024-01-02T10:00:00+00:00',
+                            'temperature': {'value': 1.0}}},
+            {'properties': {'@id': 'b', 'timestamp': '2024-01-02T20:00:00+00:00',
+                            'temperature': {'value': 6.0}}},
+        ]}}],
+        "GET /chart/SPY": [chart(dates, 470.0)],
+        # Missing from its batch, then served when retried alone
+        "GET /chart/AAPL": [{'status': 404, 'body': 'Not found'}, chart(dates, 185.0)],
+        "GET /chart/MSFT": [chart(dates[1:], 370.0)],
+        "GET /shares/SPY": [{'status': 200, 'body': {
+            'dates': ['2024-01-02T14:00:00Z', '2024-01-02T18:00:00Z', '2024-02-01T14:00:00Z'],
+            'shares': [100, 200, 300]
+        }}],
+        "GET /shares/AAPL": [{'status': 500, 'body': 'Server error'}],
+    }
+
+
+class ReplayYahoo:
+    """
+    yf.download and yf.Ticker reading the recorded responses of a ReplayServer, recording how
+    many downloads ran at once.
+    """
+    def __init__(self, url):
+        self.url = url
+        self.active = 0
+        self.max_active = 0
+        self.lock = threading.Lock()
+
+    def _history(self, ticker):
+        response = requests.get(f"{self.url}/chart/{ticker}", timeout=5)
+        if response.status_code != 200:
+            return None
+        history = pd.DataFrame(response.json())
+        history['Date'] = pd.to_datetime(history['Date'])
+        return history.set_index('Date')
+
+    def download(self, tickers, **kwargs): # pylint: disable=unused-argument
+        """
+        Prices of the tickers that have a recording, grouped by ticker.
+        """
+        with self.lock:
+            self.active += 1
+            self.max_active = max(self.max_active, self.active)
+        try:
+            frames = {ticker: self._history(ticker) for ticker in tickers}
+            frames = {ticker: frame for ticker, frame in frames.items() if frame is not None}
+            return pd.concat(frames, axis=1) if frames else pd.DataFrame()
+        finally:
+            with self.lock:
+                self.active -= 1
+
+    def Ticker(self, ticker, session=None): # pylint: disable=invalid-name,unused-argument
+        """
+        Object with get_shares_full, like yf.Ticker.
+        """
+        url = self.url
+
+        class Shares:
+            """Shares reports of one ticker"""
+            def get_shares_full(self, start=None, end=None): # pylint: disable=unused-argument
+                response = requests.get(f"{url}/shares/{ticker}", timeout=5)
+                response.raise_for_status()
+                reports = response.json()
+                return pd.Series(reports['shares'],
+                                 index=pd.to_datetime(reports['dates'], utc=True))
+
+        return Shares()
+
+
+@pytest.fixture(name='server')
+def fixture_server(monkeypatch):
+    with ReplayServer(recordings()) as server:
+        monkeypatch.setattr(download_data, 'WIKI_BASE_URL', server.url + '/wiki/')
+        monkeypatch.setattr(download_data, 'NOAA_BASE_URL', server.url + '/noaa')
+        monkeypatch.setattr(download_data, 'OBSERVATIONS_URL', server.url + '/observations')
+        monkeypatch.setattr(download_data, 'yf', ReplayYahoo(server.url))
+        yield server
+
+def test_download_prices_runs_batches_one_at_a_time(server):
+    prices = download_data.download_prices(['SPY', 'AAPL', 'MSFT'], batch_size=2, rate=100,
+                                           attempts=2)
+
+    assert download_data.yf.max_active == 1
+    assert list(prices['ticker'].unique()) == ['SPY', 'AAPL', 'MSFT']
+    assert prices.groupby('ticker').size().to_dict() == {'SPY': 2, 'AAPL': 2, 'MSFT': 1}
+    assert prices['Volume'].dtype == 'int64'
+    assert server.requests.count("GET /chart/AAPL") == 2
+
+def test_download_shares(server):
+    shares = download_data.download_shares(['SPY', 'AAPL'], rate=100, attempts=2)
+
+    assert shares['ticker'].unique().tolist() == ['SPY']
+    assert shares['outstanding_shares'].tolist() == [100, 200, 300]
+    assert server.requests.count("GET /shares/AAPL") == 2
+
+def test_download_shares_when_every_ticker_fails(server): # pylint: disable=unused-argument
+    shares = download_data.download_shares(['AAPL'], rate=100, attempts=1)
+
+    assert shares.empty
+    assert list(shares.columns) == ['os_report_datetime', 'os_report_date', 'ticker',
+                                    'outstanding_shares']
+    days = download_data.get_outstanding_shares_days(shares)
+    assert days.empty
+    assert list(days.columns) == ['os_report_date', 'date', 'ticker', 'outstanding_shares']
+
+def test_wikipedia_pageviews(server):
+    sp_df = pd.DataFrame({'Symbol': ['AAPL', 'GOOGL', 'GOOG', 'XYZ'],
+                          'wiki_page': ['Apple_Inc.', 'Alphabet_Inc.', 'Alphabet_Inc.', 'Empty']})
+    pageviews, missing = download_data.get_wikipedia_pageviews(sp_df, max_workers=2, rate=100)
+
+    assert missing == ['Empty']
+    assert sorted(pageviews['ticker'].unique()) == ['AAPL', 'GOOGL,GOOG']
+    assert pageviews['Date'].min() == pd.Timestamp('2015-07-01')
+    assert sum(key.startswith('GET /wiki/Apple_Inc.') for key in server.requests) == 2
+
+def test_noaa_windows_and_recent_weather(server, tmp_path):
+    windows = download_data.noaa_windows('2020-01-01', '2020-02-15')
+    checkpoint_dir = str(tmp_path / 'checkpoints')
+
+    results, failed = download_data.fetch_noaa_windows(windows, checkpoint_dir, rate=100)
+    assert not failed
+    weather = download_data.parse_noaa_results(results)
+    assert weather['date'].tolist() == [pd.Timestamp('2020-01-01'), pd.Timestamp('2020-02-01')]
+    assert weather.loc[0, 'high_temp_nyc'] == 5.0
+    assert weather.loc[1, 'precipitation_PRCP_nyc'] == 2.5
+
+    # Checkpointed windows are not requested again
+    n_requests = len(server.requests)
+    assert download_data.fetch_noaa_windows(windows, checkpoint_dir)[0] == results
+    assert len(server.requests) == n_requests
+
+    recent = download_data.get_recent_weather()
+    assert recent[['low_temp_nyc', 'high_temp_nyc']].values.tolist() == [[1.0, 6.0]]
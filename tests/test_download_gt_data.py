@@ -0,0 +1,140 @@
+"""Google Trends weekly indices and incremental clean up"""
+
+import importlib
+import logging
+import sys
+import types
+from unittest import mock
+
+import numpy as np
+import pandas as pd
+import pytest
+
+
+def stand_in(name, **attributes):
+    """
+    Module with only the given attributes.
+    """
+    module = types.ModuleType(name)
+    module.__dict__.update(attributes)
+    return module
+
+# Used by download_gt_data only when the packages are not installed (nothing here requests)
+STAND_INS = {
+    'pytrends': lambda: stand_in('pytrends'),
+    'pytrends.request': lambda: stand_in('pytrends.request', TrendReq=None),
+    'pytrends.exceptions': lambda: stand_in('pytrends.exceptions',
+                                            ResponseError=type('ResponseError', (Exception,), {})),
+    'requests': lambda: stand_in('requests', exceptions=types.SimpleNamespace(
+        RequestException=type('RequestException', (OSError,), {}))),
+}
+
+def import_download_gt_data():
+    """
+    Import download_gt_data, with stand-ins for the packages that are not installed (and no
+    command line arguments, which it parses on import).
+    """
+    missing = {}
+    for name, build in STAND_INS.items():
+        try:
+            importlib.import_module(name)
+        except ImportError:
+            missing[name] = build()
+    with mock.patch.dict(sys.modules, missing), \
+            mock.patch.object(sys, 'argv', ['download_gt_data']):
+        return importlib.import_module('download_gt_data')
+
+download_gt_data = import_download_gt_data()
+
+TERMS = ['stocks', 'recession']
+LAST_DAY = '2024-03-15'
+FIRST_RUN = pd.Timestamp('2024-02-20 12:00')
+SECOND_RUN = pd.Timestamp('2024-03-20 12:00')
+
+
+def weekly_requests(year, weeks, values, requested, term='stocks'):
+    """
+    Rows of a one year weekly request.
+    """
+    weeks = pd.to_datetime(weeks)
+    return pd.DataFrame({
+        'start_date': weeks, 'index': values, 'isPartial': False,
+        'end_date': weeks + pd.Timedelta(days=6), 'search_term': term,
+        'pytrends_params': f"weekly {term} {year} {requested}", 'request_datetime': requested
+    })
+
+def raw_data(end, requested, changes=None):
+    """
+    Monthly, weekly and daily requests of every term from October 2023 to end. Requests of
+    every run return the same values except for changes ({(kind, term, date): index}).
+    """
+    rng = np.random.default_rng(0)
+    days = pd.date_range('2023-10-01', LAST_DAY)
+    months = pd.date_range('2023-10-01', LAST_DAY, freq='MS')
+    weeks = pd.date_range('2023-10-01', LAST_DAY, freq='W-SUN')
+    changes = changes or {}
+
+    def values(kind, term, dates):
+        index = rng.integers(1, 101, len(dates))
+        for i, day in enumerate(dates):
+            index[i] = changes.get((kind, term, day), index[i])
+        return index
+
+    monthly, weekly, daily = [], [], []
+    for term in TERMS:
+        monthly.append(pd.DataFrame({
+            'start_date': months, 'index': values('monthly', term, months), 'isPartial': False,
+            'end_date': months + pd.offsets.MonthEnd(0), 'search_term': term,
+            'pytrends_params': f"monthly {term} {requested}", 'request_datetime': requested
+        }))
+        # A week holding days of two years is in the requests of both
+        for year in [2023, 2024]:
+            in_year = weeks[(weeks.year == year) | ((weeks + pd.Timedelta(days=6)).year == year)]
+            weekly.append(weekly_requests(year, in_year, values(f'weekly {year}', term, in_year),
+                                          requested, term))
+        daily.append(pd.DataFrame({
+            'date': days, 'index': values('daily', term, days), 'isPartial': False,
+            'search_term': term, 'pytrends_params': f"daily {term} {requested}",
+            'request_datetime': requested
+        }))
+
+    monthly, weekly, daily = pd.concat(monthly), pd.concat(weekly), pd.concat(daily)
+    return (monthly.loc[monthly['start_date'] <= end], weekly.loc[weekly['start_date'] <= end],
+            daily.loc[daily['date'] <= end])
+
+def test_cross_year_week_is_day_weighted():
+    gt_weekly = pd.concat([
+        weekly_requests(2023, ['2023-12-24', '2023-12-31'], [50, 27], FIRST_RUN),
+        weekly_requests(2024, ['2023-12-31', '2024-01-07'], [97, 80], FIRST_RUN),
+    ])
+
+    idx_of_week = download_gt_data.week_index(gt_weekly).set_index('week_start_sun')
+
+    # 31 Dec 2023 in the 2023 request, 1-6 Jan 2024 in the 2024 request
+    assert idx_of_week.loc['2023-12-31', 'idx_of_week'] == pytest.approx((27*1 + 97*6) / 7)
+    assert idx_of_week.loc['2023-12-31', 'idx_of_week'] == pytest.approx(87)
+    assert idx_of_week.loc['2023-12-24', 'idx_of_week'] == 50
+    assert idx_of_week.loc['2024-01-07', 'idx_of_week'] == 80
+
+def test_incremental_clean_up_equals_a_full_recompute(caplog):
+    first = raw_data('2024-02-15', FIRST_RUN)
+    previous = download_gt_data.clean_up(*first)
+
+    # Later requests reach another month and revise a month of one term and a week of the other
+    later = raw_data(LAST_DAY, SECOND_RUN, changes={
+        ('monthly', 'stocks', pd.Timestamp('2024-01-01')): 5,
+        ('weekly 2024', 'recession', pd.Timestamp('2024-01-14')): 5,
+    })
+    gt_monthly, gt_weekly = (pd.concat([old, new]) for old, new in zip(first[:2], later[:2]))
+    # Only February and March are requested daily again
+    gt_daily = pd.concat([first[2], later[2].loc[later[2]['date'] >= '2024-02-01']])
+
+    full = download_gt_data.clean_up(gt_monthly, gt_weekly, gt_daily)
+    with caplog.at_level(logging.INFO):
+        incremental = download_gt_data.clean_up(gt_monthly, gt_weekly, gt_daily,
+                                                 previous=previous)
+
+    pd.testing.assert_frame_equal(incremental, full)
+    assert full['date'].max() == pd.Timestamp(LAST_DAY)
+    # January (its month or one of its weeks revised) to March (new daily rows) of both terms
+    assert 'Recomputing 6 (search_term, month) blocks' in caplog.messages
@@ -0,0 +1,99 @@
+"""Feature store entries and their tokens"""
+
+import os
+import threading
+
+import pandas as pd
+
+import data_store
+import feature_store
+import prep_data
+from bench_memory import synthetic_data
+
+
+def test_same_shape_rewrite_is_stale(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    root = str(tmp_path / 'features')
+    frames = synthetic_data(3, 400)
+    config = prep_data.IndicatorConfig(ticker='T000')
+
+    feature_store.get_features(frames, config, drop_tickers=True, root=root)
+    feature_store.get_features(frames, config, drop_tickers=True, root=root)
+    assert feature_store.stats['hits'] >= 1
+    hits = feature_store.stats['hits']
+
+    # Same shape, one price changed
+    stocks_df = frames[0].copy()
+    stocks_df.loc[stocks_df['ticker'] == 'T000', 'Adj Close'] *= 1.01
+    changed = feature_store.get_features((stocks_df, *frames[1:]), config, drop_tickers=True,
+                                         root=root)
+    assert feature_store.stats['hits'] == hits
+    expected = prep_data.prep_data(stocks_df, *frames[1:], config=config, drop_tickers=True)
+    pd.testing.assert_frame_equal(changed, expected)
+
+    # Other tickers do not matter with drop_tickers
+    other = frames[0].copy()
+    other.loc[other['ticker'] == 'T001', 'Adj Close'] *= 1.01
+    assert (feature_store.frames_token((other, *frames[1:]), 'T000', True)
+            == feature_store.frames_token(frames, 'T000', True))
+
+def test_concurrent_writers_of_one_entry(tmp_path):
+    root = str(tmp_path)
+    prepd_data = pd.DataFrame({'Date': pd.bdate_range('2024-01-01', periods=50),
+                               'x': range(50)})
+    errors = []
+
+    def save():
+        try:
+            feature_store.save_features(prepd_data, 'SPY', 'key', {'a': '1'}, root=root)
+        except Exception as e: # pylint: disable=broad-exception-caught
+            errors.append(e)
+
+    threads = [threading.Thread(target=save) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert not errors
+    assert os.listdir(os.path.join(root, 'SPY')) == ['key']
+    pd.testing.assert_frame_equal(feature_store.load_features('SPY', 'key', root), prepd_data)
+
+    # A stale entry is replaced
+    feature_store.save_features(prepd_data.assign(x=1), 'SPY', 'key', {'a': '2'}, root=root)
+    assert feature_store.read_entry('SPY', 'key', root)['tokens'] == {'a': '2'}
+    assert (feature_store.load_features('SPY', 'key', root)['x'] == 1).all()
+    assert os.listdir(os.path.join(root, 'SPY')) == ['key']
+
+def test_dataset_token_changes_when_a_version_is_rewritten(tmp_path):
+    root = str(tmp_path)
+    df = pd.DataFrame({'ticker': ['SPY', 'SPY'], 'Date': pd.to_datetime(['2024-01-02',
+                                                                         '2024-01-03']),
+                       'Adj Close': [1.0, 2.0]})
+    version = data_store.write_dataset('stocks_df', df, root=root)
+    token = data_store.dataset_token('stocks_df', root=root)
+
+    data_store.write_dataset('stocks_df', df.assign(**{'Adj Close': [1.0, 3.0]}),
+                             version=version, root=root)
+    assert data_store.dataset_token('stocks_df', root=root) != token
+
+def test_hit_has_the_dtypes_of_a_miss(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    root = str(tmp_path / 'features')
+    stocks_df, wiki_pageviews, *rest = synthetic_data(3, 400)
+    frames = (prep_data.compact_dtypes(stocks_df), prep_data.compact_dtypes(wiki_pageviews), *rest)
+    config = prep_data.IndicatorConfig(ticker='T000')
+
+    miss = feature_store.get_features(frames, config, drop_tickers=True, root=root)
+    hits = feature_store.stats['hits']
+    hit = feature_store.get_features(frames, config, drop_tickers=True, root=root)
+    assert feature_store.stats['hits'] == hits + 1
+    pd.testing.assert_frame_equal(hit, miss)
+
+    # Categorical and timezone-aware columns, saved as numpy objects
+    frame = stocks_df.loc[:5, ['Date', 'ticker', 'Adj Close']].assign(
+        ticker=lambda df: df['ticker'].astype('category'),
+        utc=lambda df: df['Date'].dt.tz_localize('UTC')
+    )
+    feature_store.save_features(frame, 'T000', 'dtypes', {}, root=root)
+    pd.testing.assert_frame_equal(feature_store.load_features('T000', 'dtypes', root), frame)
@@ -0,0 +1,16 @@
+"""Google Trends job queue"""
+
+import gt_queue
+
+
+def test_add_jobs_requeues_only_requeue_states(tmp_path):
+    queue = gt_queue.JobQueue(str(tmp_path / 'queue.sqlite'))
+    timeframes = [f'2024-0{month}-01 2024-0{month}-28' for month in range(1, 8)]
+    queue.set_states('daily', [('stocks', timeframe, state, None)
+                               for timeframe, state in zip(timeframes, gt_queue.STATES)])
+
+    assert queue.add_jobs('daily', 'stocks', timeframes) == 3
+    assert [queue.state('daily', 'stocks', t) for t in timeframes] == [
+        'pending', 'running', 'fetched', 'done', 'pending', 'empty', 'pending'
+    ]
+    queue.close()
@@ -0,0 +1,57 @@
+"""IndicatorEngine against the pandas rolling calculations"""
+
+import numpy as np
+import pandas as pd
+
+import indicators
+
+
+def low_price_series(n=8000, seed=0):
+    """
+    Prices from 0.05 to about 298, with a flat stretch in the middle.
+    """
+    rng = np.random.default_rng(seed)
+    prices = np.exp(np.linspace(np.log(0.05), np.log(298), n)) * np.exp(rng.normal(0, 0.02, n))
+    prices[3000:3100] = prices[2999]
+    return prices
+
+def test_rolling_std_matches_pandas_on_low_prices():
+    prices = low_price_series()
+    engine = indicators.IndicatorEngine(prices)
+    for window in [2, 5, 20, 200]:
+        expected = pd.Series(prices).rolling(window).std().to_numpy()
+        got = engine.rolling_std(window)[:, 0]
+        np.testing.assert_array_equal(np.isnan(got), np.isnan(expected))
+        # pandas' own rounding: about 1e-10 relative, and up to 1e-7 of the price on flat windows
+        valid = ~np.isnan(expected)
+        error = np.abs(got - expected)[valid]
+        assert (error <= 1e-9 * expected[valid] + 1e-7 * prices[valid]).all()
+
+def test_rolling_std_is_zero_on_flat_windows():
+    prices = low_price_series()
+    engine = indicators.IndicatorEngine(prices)
+    for window in [5, 20, 50]:
+        assert (engine.rolling_std(window)[3000+window-1:3100, 0] == 0).all()
+
+    flat = np.full(500, 0.0731)
+    expected = pd.Series(flat).rolling(20).std().to_numpy()
+    np.testing.assert_array_equal(indicators.IndicatorEngine(flat).rolling_std(20)[:, 0],
+                                  expected)
+
+def test_rolling_std_wide_and_missing_values():
+    rng = np.random.default_rng(1)
+    levels = [0.05, 1, 10, 50, 100, 200, 298]
+    prices = np.exp(rng.normal(0, 0.01, (1500, 7)).cumsum(axis=0)) * levels
+    prices[100:110, 2] = np.nan
+    engine = indicators.IndicatorEngine(prices)
+    expected = pd.DataFrame(prices).rolling(30).std().to_numpy()
+    np.testing.assert_allclose(engine.rolling_std(30), expected, rtol=1e-9, equal_nan=True)
+
+def test_bollinger_matches_pandas():
+    prices = low_price_series()
+    moving_average, upper, lower = indicators.IndicatorEngine(prices).bollinger(20, 2)
+    series = pd.Series(prices)
+    std = series.rolling(20).std().to_numpy()
+    np.testing.assert_allclose(moving_average[:, 0], series.rolling(20).mean(), rtol=1e-10)
+    np.testing.assert_allclose(upper[:, 0], series.rolling(20).mean() + 2 * std, rtol=1e-10)
+    np.testing.assert_allclose(lower[:, 0], series.rolling(20).mean() - 2 * std, rtol=1e-9)
@@ -0,0 +1,45 @@
+"""Search result cache keys and hits"""
+
+import numpy as np
+import pandas as pd
+from sklearn.linear_model import LogisticRegression
+from sklearn.pipeline import make_pipeline
+from sklearn.preprocessing import StandardScaler
+
+import param_search
+from strat_defs import SearchConfig
+
+
+def logit_grid(n_jobs):
+    """
+    Grid setting n_jobs for one solver only, as in strat_logit (the liblinear candidate, an L1
+    penalty strong enough to zero every coefficient, loses).
+    """
+    return [
+        {'logisticregression__C': [1e-4], 'logisticregression__solver': ['liblinear'],
+         'logisticregression__l1_ratio': [1.0]},
+        {'logisticregression__C': [0.1, 1.0], 'logisticregression__solver': ['lbfgs'],
+         'logisticregression__n_jobs': [n_jobs]},
+    ]
+
+def test_n_jobs_is_neither_hashed_nor_cached(tmp_path):
+    rng = np.random.default_rng(0)
+    X = pd.DataFrame(rng.normal(size=(200, 3)), columns=['a', 'b', 'c'])
+    y = pd.Series((X['a'] + rng.normal(size=200) > 0).astype(int))
+    pipeline = make_pipeline(StandardScaler(), LogisticRegression())
+    config = SearchConfig(report=False, cache_dir=str(tmp_path))
+
+    assert (param_search.search_key(pipeline, logit_grid(1), X, y, config)
+            == param_search.search_key(pipeline, logit_grid(2), X, y, config))
+
+    searched = param_search.fit_search(pipeline, logit_grid(1), X, y, config=config)
+    key = param_search.search_key(pipeline, logit_grid(1), X, y, config)
+    record = param_search.load_cached_search(str(tmp_path), key)
+    assert not any(name.endswith('n_jobs') for name in record['best_params'])
+
+    cached = param_search.fit_search(pipeline, logit_grid(2), X, y, config=config)
+    assert searched.get_params()['logisticregression__solver'] == 'lbfgs'
+    assert cached.get_params()['logisticregression__solver'] == 'lbfgs'
+    assert cached.get_params()['logisticregression__C'] == searched.get_params()[
+        'logisticregression__C']
+    assert cached.get_params()['logisticregression__n_jobs'] == 2
@@ -0,0 +1,90 @@
+"""SharedPCA against a plain PCA(svd_solver='full')"""
+
+import numpy as np
+from sklearn.decomposition import PCA
+from sklearn.linear_model import LogisticRegression
+from sklearn.pipeline import make_pipeline
+from sklearn.preprocessing import StandardScaler
+
+import pca_cache
+import strat_defs
+
+
+def correlated_features(n=400, n_features=30, seed=0):
+    """
+    Features driven by a few latent factors plus noise.
+    """
+    rng = np.random.default_rng(seed)
+    factors = rng.normal(size=(n, 4))
+    return factors @ rng.normal(size=(4, n_features)) + rng.normal(0, 0.1, (n, n_features))
+
+def test_shared_pca_is_identical_to_pca():
+    pca_cache.clear_cache()
+    X = correlated_features()
+    for n_components in [1, 3, 10, None]:
+        expected = make_pipeline(StandardScaler(), PCA(n_components, svd_solver='full'))
+        shared = make_pipeline(StandardScaler(), pca_cache.SharedPCA(n_components))
+
+        np.testing.assert_array_equal(shared.fit_transform(X), expected.fit_transform(X))
+        np.testing.assert_array_equal(shared.transform(X[:50]), expected.transform(X[:50]))
+        for attr in ['mean_', 'components_', 'explained_variance_',
+                     'explained_variance_ratio_', 'singular_values_', 'noise_variance_']:
+            np.testing.assert_array_equal(getattr(shared[-1], attr), getattr(expected[-1], attr))
+
+    # One decomposition served every candidate
+    assert pca_cache.stats['misses'] == 1
+    assert pca_cache.stats['hits'] == 3
+    assert pca_cache.stats['updates'] == 0
+
+def test_incremental_updates_are_opt_in():
+    pca_cache.clear_cache()
+    X = correlated_features(600)
+    scaled = [StandardScaler().fit_transform(X[:stop]) for stop in [400, 500, 600]]
+
+    for X_window in scaled:
+        pca_cache.SharedPCA(5).fit(X_window)
+    assert pca_cache.stats['updates'] == 0
+
+    pca_cache.clear_cache()
+    for X_window in scaled:
+        shared = pca_cache.SharedPCA(5, incremental=True).fit(X_window)
+        expected = PCA(5, svd_solver='full').fit(X_window)
+        np.testing.assert_allclose(shared.components_, expected.components_, atol=1e-8)
+        np.testing.assert_allclose(shared.explained_variance_, expected.explained_variance_,
+                                   rtol=1e-10)
+    assert pca_cache.stats['updates'] == 2
+
+def test_cache_is_bounded_by_bytes(monkeypatch):
+    pca_cache.clear_cache()
+    X = correlated_features()
+    entry_bytes = pca_cache._nbytes(pca_cache._full_svd(X))
+    monkeypatch.setattr(pca_cache, 'CACHE_BYTES', 3 * entry_bytes)
+
+    for seed in range(6):
+        pca_cache.SharedPCA(3).fit(correlated_features(seed=seed))
+    assert len(pca_cache._cache) == 3
+
+    monkeypatch.setattr(pca_cache, 'CACHE_BYTES', entry_bytes // 2)
+    pca_cache.clear_cache()
+    pca_cache.SharedPCA(3).fit(X)
+    assert len(pca_cache._cache) == 0
+
+def test_fractional_grid_shares_one_decomposition():
+    pca_cache.clear_cache()
+    X = StandardScaler().fit_transform(correlated_features())
+    for fraction in [0.6, 0.7, 0.8, 0.9, 0.95, 0.999]:
+        shared = pca_cache.SharedPCA(fraction)
+        expected = PCA(fraction, svd_solver='full')
+
+        np.testing.assert_array_equal(shared.fit_transform(X), expected.fit_transform(X))
+        assert shared.n_components_ == expected.n_components_
+        np.testing.assert_array_equal(shared.components_, expected.components_)
+        np.testing.assert_array_equal(shared.noise_variance_, expected.noise_variance_)
+
+    assert pca_cache.stats['misses'] == 1
+    assert pca_cache.stats['hits'] == 5
+
+def test_pca_pipeline_incremental_from_refit_config():
+    assert not strat_defs.pca_pipeline(LogisticRegression())['pca'].incremental
+    refit = strat_defs.RefitConfig(incremental_pca=True)
+    assert strat_defs.pca_pipeline(LogisticRegression(), refit)['pca'].incremental
@@ -0,0 +1,62 @@
+"""Warm-started walk-forward refits against full refits"""
+
+import numpy as np
+import pandas as pd
+from sklearn.ensemble import RandomForestClassifier
+from sklearn.pipeline import make_pipeline
+from sklearn.preprocessing import StandardScaler
+from xgboost import XGBClassifier
+
+import strat_defs
+
+
+def classification_data(n=1200, seed=0):
+    """
+    Daily rows with a few features and a noisy linear target.
+    """
+    rng = np.random.default_rng(seed)
+    X = rng.normal(size=(n, 5))
+    target = (X[:, 0] + 0.5 * X[:, 1] + rng.normal(0, 0.3, n) > 0).astype(int)
+    data = pd.DataFrame(X, columns=[f'x{i}' for i in range(5)])
+    data.insert(0, 'Date', pd.bdate_range('2015-01-01', periods=n))
+    data['Target'] = target
+    return data
+
+def walk_forward_proba(model, refit):
+    data = classification_data()
+    pipeline = make_pipeline(StandardScaler(), model)
+    proba, _, _ = strat_defs.walk_forward(data, 400, pipeline, 10, 'predict_proba', refit)
+    return proba[:, 1], pipeline.steps[-1][1]
+
+def test_forest_refit_stays_close_to_full_refit():
+    refit = strat_defs.RefitConfig(warm_start=True, new_trees=5, max_trees=60,
+                                   full_refit_every=None)
+    full, _ = walk_forward_proba(RandomForestClassifier(30, random_state=0), None)
+    warm, model = walk_forward_proba(RandomForestClassifier(30, random_state=0), refit)
+
+    assert len(model.estimators_) <= refit.max_trees
+    assert model.n_estimators == 30
+    assert np.abs(warm - full).mean() < 0.05
+    assert ((warm > 0.5) == (full > 0.5)).mean() > 0.95
+
+def test_xgboost_refit_stays_close_to_full_refit():
+    refit = strat_defs.RefitConfig(warm_start=True, boost_rounds=5, max_trees=80,
+                                   full_refit_every=10)
+    kwargs = {'n_estimators': 40, 'max_depth': 3, 'random_state': 0}
+    full, _ = walk_forward_proba(XGBClassifier(**kwargs), None)
+    warm, model = walk_forward_proba(XGBClassifier(**kwargs), refit)
+
+    assert model.get_booster().num_boosted_rounds() <= refit.max_trees
+    assert model.n_estimators == 40
+    assert np.abs(warm - full).mean() < 0.05
+    assert ((warm > 0.5) == (full > 0.5)).mean() > 0.95
+
+def test_warm_start_refit_restores_the_estimator():
+    from sklearn.linear_model import LogisticRegression # pylint: disable=import-outside-toplevel
+
+    refit = strat_defs.RefitConfig(warm_start=True, full_refit_every=3)
+    warm, model = walk_forward_proba(LogisticRegression(), refit)
+    full, _ = walk_forward_proba(LogisticRegression(), None)
+
+    assert model.warm_start is False
+    assert np.abs(warm - full).max() < 0.01
@@ -0,0 +1,22 @@
+"""Sunlight lookup table and its CSV cache"""
+
+import os
+
+import pandas as pd
+
+import prep_data
+
+
+def test_sunlight_cache_round_trip(tmp_path):
+    cache_file = str(tmp_path / 'sunlight_nyc.csv')
+    dates = pd.Series(pd.date_range('2020-06-01', periods=10))
+    seconds = prep_data.sunlight_nyc(dates, cache_file)
+
+    assert os.listdir(tmp_path) == ['sunlight_nyc.csv']
+    cached = pd.read_csv(cache_file, parse_dates=['Date'])
+    assert len(cached) == 10
+    assert (cached['sunlight_nyc'].to_numpy() == seconds).all()
+
+    # A fresh process loads the table from the file instead of calling astral
+    del prep_data._sunlight_table[cache_file]
+    assert (prep_data.sunlight_nyc(dates, cache_file) == seconds).all()
@@ -0,0 +1,76 @@
+"""Parameter sweeps against one backtest_strategy run per combination"""
+
+from itertools import product
+
+import numpy as np
+import pytest
+
+import prep_data
+import strat_defs
+import sweep
+from bench_memory import synthetic_data
+
+GRIDS = {
+    'SMA': {'short_window': [5, 20], 'long_window': [50, 100]},
+    'RSI': {'rsi_window': [14, 30], 'overbought': [60, 70]},
+    'VWAP': {},
+    'Bollinger': {'window': [10, 20], 'num_std': [1.5, 2.0]},
+    'Breakout': {'bko_window': [10, 20]},
+}
+START = 120 # after the longest window
+INITIAL_TRAIN_PERIOD = 300
+
+
+def single_configs(strategy, params, ticker):
+    """
+    IndicatorConfig and BacktestConfig of one combination of a sweep.
+    """
+    indicator = prep_data.IndicatorConfig(ticker=ticker)
+    backtest = strat_defs.BacktestConfig()
+    if strategy == 'SMA':
+        indicator.moving_average = prep_data.MovingAverageConfig(**params)
+    elif strategy == 'RSI':
+        indicator.rsi_window = params['rsi_window']
+        backtest.overbought = params['overbought']
+    elif strategy == 'Bollinger':
+        indicator.bollinger = prep_data.BollingerConfig(**params)
+    elif strategy == 'Breakout':
+        backtest.bko_window = params['bko_window']
+    return indicator, backtest
+
+def backtest_performance(strategy_return):
+    """
+    Cumulative return, Sharpe ratio and max drawdown of backtest_strategy's Strategy_Return
+    from the row after START.
+    """
+    returns = np.nan_to_num(strategy_return.to_numpy()[START+1:])
+    equity = np.cumprod(1 + returns)
+    sharpe = np.sqrt(252) * returns.mean() / returns.std(ddof=1)
+    max_drawdown = (equity / np.maximum.accumulate(equity) - 1).min()
+    return equity[-1] - 1, sharpe, max_drawdown
+
+@pytest.mark.parametrize('ticker', ['SPY', 'T000'])
+@pytest.mark.parametrize('strategy', list(GRIDS))
+def test_sweep_matches_backtest_strategy(tmp_path, monkeypatch, strategy, ticker):
+    monkeypatch.chdir(tmp_path)
+    frames = synthetic_data(3, 600)
+    indicator = prep_data.IndicatorConfig(ticker=ticker)
+    data = prep_data.prep_data(*frames, config=indicator, drop_tickers=True)
+
+    result = sweep.sweep_strategy(data, strategy, indicator.target, ticker, GRIDS[strategy],
+                                  start=START, initial_train_period=INITIAL_TRAIN_PERIOD)
+
+    names = list(GRIDS[strategy])
+    for index in product(*(range(len(values)) for values in GRIDS[strategy].values())):
+        params = {name: GRIDS[strategy][name][i] for name, i in zip(names, index)}
+        indicator, backtest = single_configs(strategy, params, ticker)
+        single = prep_data.prep_data(*frames, config=indicator, drop_tickers=True)
+        backtested, _, _ = strat_defs.backtest_strategy(
+            single, strategy, indicator.target, ticker, backtest,
+            initial_train_period=INITIAL_TRAIN_PERIOD
+        )
+
+        expected = backtest_performance(backtested['Strategy_Return'])
+        got = (result.cumulative_return[index], result.sharpe[index],
+               result.max_drawdown[index])
+        np.testing.assert_allclose(got, expected, rtol=1e-9, err_msg=f"{strategy} {params}")
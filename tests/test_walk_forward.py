@@ -0,0 +1,67 @@
+"""Walk-forward predictions against the row-by-row loop they replaced"""
+
+import numpy as np
+import pandas as pd
+import pytest
+from sklearn.linear_model import LogisticRegression
+from sklearn.pipeline import make_pipeline
+from sklearn.preprocessing import StandardScaler
+
+import strat_defs
+
+
+def strategy_data(n=400, first_index=0, seed=0):
+    """
+    Feature rows with a noisy target, indexed from first_index (as after dropna()).
+    """
+    rng = np.random.default_rng(seed)
+    X = rng.normal(size=(n, 4))
+    data = pd.DataFrame(X, columns=['a', 'b', 'c', 'd'],
+                        index=range(first_index, first_index + n))
+    data.insert(0, 'Date', pd.bdate_range('2015-01-01', periods=n))
+    data['Target'] = (X[:, 0] - X[:, 1] + rng.normal(0, 1, n) > 0).astype(int)
+    return data
+
+def row_by_row_pred_loop(data, initial_train_period, pipeline, retrain_days):
+    """
+    The pred_loop before walk_forward: trains on iloc[:i], predicts loc[[i]].
+    """
+    feats = [col for col in data.columns if col not in ['Date', 'Target']]
+
+    pred_results = []
+    for i in range(initial_train_period, len(data)):
+        if (i - initial_train_period) % retrain_days == 0:
+            train_data = data.iloc[:i]
+            pipeline.fit(train_data[feats], train_data['Target'])
+        pred_results.append((i, pipeline.predict(data.loc[[i]][feats])[0]))
+
+    pred_df = pd.DataFrame(pred_results, columns=["index", "Signal"]).set_index("index")
+    data.loc[pred_df.index, "Signal"] = pred_df["Signal"]
+    data['Signal'] = data['Signal'].fillna(1)
+    return data
+
+def pipeline():
+    return make_pipeline(StandardScaler(), LogisticRegression())
+
+@pytest.mark.parametrize('retrain_days', [1, 7])
+def test_matches_row_by_row_loop_on_a_reset_index(retrain_days):
+    data = strategy_data(first_index=50).reset_index(drop=True)
+
+    expected = row_by_row_pred_loop(data.copy(), 300, pipeline(), retrain_days)
+    got, _, _ = strat_defs.pred_loop(data.copy(), 300, pipeline(), retrain_days)
+    pd.testing.assert_series_equal(got['Signal'], expected['Signal'])
+
+def test_predictions_are_aligned_by_position():
+    data = strategy_data(first_index=50)
+    feats = ['a', 'b', 'c', 'd']
+
+    got, _, _ = strat_defs.pred_loop(data.copy(), 300, pipeline(), 1)
+    for position in [300, 301, 350, 399]:
+        model = pipeline().fit(data[feats].iloc[:position], data['Target'].iloc[:position])
+        expected = model.predict(data[feats].iloc[[position]])[0]
+        assert got['Signal'].iloc[position] == expected
+    assert (got['Signal'].iloc[:300] == 1).all()
+
+def test_too_few_rows():
+    with pytest.raises(ValueError, match='initial_train_period'):
+        strat_defs.pred_loop(strategy_data(100), 100, pipeline(), 1)
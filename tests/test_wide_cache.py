@@ -0,0 +1,40 @@
+"""Wide matrix cache snapshots and builds"""
+
+import os
+
+import numpy as np
+
+import prep_data
+from bench_memory import synthetic_data
+
+
+def test_filtered_load_gets_its_own_snapshot(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    stocks_df, wiki_pageviews, *_ = synthetic_data(4, 300)
+    subset = stocks_df['ticker'].isin(['SPY', 'T000'])
+    recent = stocks_df['Date'] >= '2015-06-01'
+
+    full = prep_data.wide_snapshot(stocks_df, wiki_pageviews)
+    assert full == prep_data.wide_snapshot(stocks_df.copy(), wiki_pageviews.copy())
+    assert full != prep_data.wide_snapshot(stocks_df[subset], wiki_pageviews)
+    assert full != prep_data.wide_snapshot(stocks_df[recent], wiki_pageviews)
+
+    small = prep_data.get_wide_cache(stocks_df[subset], wiki_pageviews[subset])
+    assert small.tickers == ['SPY', 'T000']
+    wide = prep_data.get_wide_cache(stocks_df, wiki_pageviews)
+    assert wide.tickers == ['SPY', 'T000', 'T001', 'T002']
+
+def test_build_renames_into_place(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    stocks_df, wiki_pageviews, *_ = synthetic_data(3, 200)
+    cache_dir = str(tmp_path / 'wide')
+
+    snapshot_dir = prep_data.build_wide_cache(stocks_df, wiki_pageviews, 'snap', cache_dir)
+    # A second builder of the same snapshot keeps the finished one
+    assert prep_data.build_wide_cache(stocks_df, wiki_pageviews, 'snap', cache_dir) == snapshot_dir
+    assert os.listdir(cache_dir) == ['snap']
+
+    wide = prep_data.load_wide_cache('snap', cache_dir)
+    spy = wide.frame(['SPY'])
+    expected = stocks_df.loc[stocks_df['ticker'] == 'SPY', 'Adj Close'].to_numpy(np.float32)
+    np.testing.assert_array_equal(spy['Adj Close_SPY'].to_numpy(), expected)